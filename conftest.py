@@ -1,5 +1,6 @@
 import logging
 import os
+import sys
 import uuid
 
 import pytest
@@ -13,6 +14,9 @@ logging.basicConfig(format='%(levelname)s:%(name)s:%(thread)d:%(message)s')
 log_level = os.environ.get('RESIZE_LOG_LEVEL', 'error')
 flask_resize.logger.setLevel(getattr(logging, log_level.upper()))
 
+# Uses `async` syntax
+collect_ignore = ['tests/test_aio.py'] if sys.version_info < (3, 5) else []
+
 
 def pytest_addoption(parser):
     parser.addoption(
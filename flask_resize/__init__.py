@@ -1,3 +1,13 @@
-from . import cache, configuration, exc, resizing, storage  # noqa
+from . import (  # noqa
+    bloom,
+    cache,
+    configuration,
+    exc,
+    jobs,
+    resizing,
+    scheduler,
+    storage,
+    utils
+)
 from .metadata import __version__, __version_info__  # noqa
 from .resizing import Resize, ResizeTarget, logger, make_resizer  # noqa
@@ -1,15 +1,22 @@
+import os
 import sys
 
 PY2 = sys.version_info[0] == 2
 PY3 = sys.version_info[0] == 3
 
 if PY3:
+    import queue
+    from urllib.parse import quote, unquote
+
     string_types = str,
 
     def b(s):
         return s.encode("latin-1")
 
 else:
+    import Queue as queue  # noqa
+    from urllib import quote, unquote  # noqa
+
     string_types = basestring,  # noqa
 
     def b(s):
@@ -28,16 +35,37 @@ except ImportError:
     redis = None
 
 
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError:
+    redis_asyncio = None
+
+
 try:
     import boto3
+    import boto3.s3.transfer
+    import boto3.session
     import botocore
+    import botocore.config
 except ImportError:
     boto3 = None
     botocore = None
 
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
 try:
     FileExistsError = FileExistsError
 except NameError:
     class FileExistsError(IOError):
         pass
+
+
+try:
+    scandir = os.scandir
+except AttributeError:
+    scandir = None
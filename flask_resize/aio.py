@@ -0,0 +1,597 @@
+"""
+Support for asyncio, e.g. in ASGI apps or with Quart. Requires Python 3.5+.
+
+Images are still generated by :class:`resizing.ResizeTarget`, in an
+executor so that the event loop isn't blocked while decoding and encoding.
+"""
+import asyncio
+import binascii
+import functools
+import logging
+import os
+import time
+
+from . import _compat, bloom, cache, constants, exc, scheduler, storage
+from .resizing import ResizeTarget
+
+logger = logging.getLogger('flask_resize')
+
+
+def make_async_resizer(config):
+    """AsyncResizer instance factory
+
+    The `redis` cache store talks to Redis with :mod:`redis.asyncio`. Other
+    cache stores, and all storage backends, are called in an executor.
+    """
+    storage_backend = storage.make(config)
+    if config.cache_store == 'redis':
+        cache_store = AsyncRedisCache(
+            host=config.redis_host,
+            port=config.redis_port,
+            db=config.redis_db,
+            password=config.redis_password,
+            key=config.redis_key,
+            key_codec=cache.CompactKeyCodec(
+                target_directory=config.target_directory,
+                shard_depth=config.shard_depth,
+                shard_width=config.shard_width,
+            ) if config.redis_compact_keys else None,
+            timeout=config.redis_timeout,
+        )
+    else:
+        cache_store = ThreadedCache(
+            cache.make(config, image_store=storage_backend)
+        )
+    return AsyncResizer(
+        storage_backend=ThreadedStorage(storage_backend),
+        cache_store=cache_store,
+        base_url=config.url,
+        name_hashing_method=config.hash_method,
+        target_directory=config.target_directory,
+        raise_on_generate_in_progress=config.raise_on_generate_in_progress,
+        generate_in_progress_timeout=config.generate_in_progress_timeout,
+        noop=config.noop,
+        shard_depth=config.shard_depth,
+        shard_width=config.shard_width,
+        missing_source_ttl=config.missing_source_ttl,
+        scheduler=scheduler.make(config),
+        existence_filter=bloom.make(config),
+    )
+
+
+class _Threaded:
+    def __init__(self, wrapped, executor=None):
+        self.wrapped = wrapped
+        self.executor = executor
+
+    async def _run(self, fn, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(fn, *args, **kwargs)
+        )
+
+    def __getattr__(self, name):
+        if name == 'wrapped':
+            # Not set yet, don't recurse
+            raise AttributeError(name)
+        attr = getattr(self.wrapped, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def method(*args, **kwargs):
+            return await self._run(attr, *args, **kwargs)
+        return method
+
+
+class ThreadedStorage(_Threaded):
+    """Makes a :class:`storage.Storage` usable from asyncio
+
+    Every method of the storage backend is available as a coroutine, which
+    calls it in `executor`.
+
+    Args:
+        wrapped (storage.Storage):
+            The storage backend
+        executor (Any[concurrent.futures.Executor, None]):
+            Executor to call it in. Uses the event loop's default executor
+            if not set.
+    """
+
+
+class ThreadedCache(_Threaded):
+    """Makes a :class:`cache.Cache` usable from asyncio
+
+    Every method of the cache store is available as a coroutine, which
+    calls it in `executor`. :meth:`transaction` is an asynchronous
+    context-manager.
+
+    Args:
+        wrapped (cache.Cache):
+            The cache store
+        executor (Any[concurrent.futures.Executor, None]):
+            Executor to call it in. Uses the event loop's default executor
+            if not set.
+    """
+
+    def transaction(self, unique_key, ttl=600):
+        return _ThreadedTransaction(
+            self, self.wrapped.transaction(unique_key, ttl=ttl)
+        )
+
+
+class _ThreadedTransaction:
+    def __init__(self, threaded, transaction):
+        self.threaded = threaded
+        self.transaction = transaction
+
+    async def __aenter__(self):
+        return await self.threaded._run(self.transaction.__enter__)
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        return await self.threaded._run(
+            self.transaction.__exit__, exc_type, exc_value, traceback
+        )
+
+
+class AsyncRedisCache:
+    """A Redis cache store that uses :mod:`redis.asyncio`
+
+    Keeps its keys like :class:`cache.RedisCache` does, so that both can be
+    used with the same Redis server at the same time. Only supports what's
+    needed by :class:`AsyncResizer`.
+
+    Args:
+        host (Any[str, redis.asyncio.StrictRedis]):
+            Redis host, or a pre-configured Redis client.
+        key (str):
+            The key to store the cache at. Other keys are prefixed with it.
+        key_codec (Any[cache.CompactKeyCodec, None]):
+            Stores keys in a compact form. Keys are stored as is if not set.
+        timeout (Any[float, None]):
+            Number of seconds to wait for a connection, or for a response.
+            Waits indefinitely if not set.
+    """
+
+    def __init__(
+        self,
+        host='localhost',
+        port=6379,
+        db=0,
+        password=None,
+        key=constants.DEFAULT_REDIS_KEY,
+        key_codec=None,
+        timeout=None,
+    ):
+        if _compat.redis_asyncio is None:
+            raise exc.RedisImportError(
+                "Redis 4.2+ must be installed for asyncio Redis support. "
+                "Package found @ https://pypi.python.org/pypi/redis."
+            )
+        self.key = key
+        self.key_codec = key_codec
+
+        if isinstance(host, _compat.string_types):
+            self.redis = _compat.redis_asyncio.StrictRedis(
+                host=host,
+                port=port,
+                db=db,
+                password=password,
+                socket_timeout=timeout,
+                socket_connect_timeout=timeout,
+            )
+        else:
+            self.redis = host
+
+        self._release_lock = self.redis.register_script(
+            cache.RedisCache._release_lock_script
+        )
+        self._renew_lock = self.redis.register_script(
+            cache.RedisCache._renew_lock_script
+        )
+
+    def _encode(self, unique_key):
+        if self.key_codec is None:
+            return unique_key
+        return self.key_codec.encode(unique_key)
+
+    def _get_variants_key(self, source_key):
+        return '-variants-'.join([self.key, source_key])
+
+    def _get_missing_key(self, source_key):
+        return '-missing-'.join([self.key, source_key])
+
+    def _get_transaction_key(self, unique_key):
+        return '-transaction-'.join([self.key, unique_key])
+
+    def _get_done_channel(self, unique_key):
+        return '-done-'.join([self.key, unique_key])
+
+    async def exists(self, unique_key):
+        """Check if key exists in cache"""
+        return bool(
+            await self.redis.sismember(self.key, self._encode(unique_key))
+        )
+
+    async def add(self, unique_key):
+        """Add key to cache"""
+        return bool(await self.redis.sadd(self.key, self._encode(unique_key)))
+
+    async def remove(self, unique_key):
+        """Remove key from cache"""
+        return bool(await self.redis.srem(self.key, self._encode(unique_key)))
+
+    async def add_variant(self, source_key, unique_key):
+        """Record that `unique_key` was generated from `source_key`"""
+        value = self._encode(unique_key)
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.sadd(self._get_variants_key(source_key), value)
+        pipe.hset('-'.join([self.key, 'variant-sources']), value, source_key)
+        return bool((await pipe.execute())[0])
+
+    async def mark_missing(self, source_key, ttl):
+        """Remember that the source image `source_key` doesn't exist"""
+        return bool(await self.redis.set(
+            self._get_missing_key(source_key),
+            1,
+            px=int(ttl * 1000),
+        ))
+
+    async def is_missing(self, source_key):
+        """Check whether the source image `source_key` is marked missing"""
+        return bool(
+            await self.redis.exists(self._get_missing_key(source_key))
+        )
+
+    def transaction(self, unique_key, ttl=600):
+        """
+        Asynchronous context-manager to use when it's important that no one
+        else handles `unique_key` at the same time. Same as
+        :meth:`cache.RedisCache.transaction`, but the lease is renewed by a
+        task instead of a thread.
+        """
+        return _RedisTransaction(self, unique_key, ttl)
+
+    async def wait(self, unique_key, timeout):
+        """
+        Wait for the transaction of `unique_key`, held by someone else, to
+        finish
+
+        Returns:
+            bool:
+                Whether the transaction finished in time, and the image is
+                cached. Also checked if the transaction had already
+                finished, or was never started.
+        """
+        deadline = time.time() + timeout
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(self._get_done_channel(unique_key))
+            # Subscribed before checking, so that it can't finish unnoticed
+            if not await self.redis.exists(
+                self._get_transaction_key(unique_key)
+            ):
+                return await self.exists(unique_key)
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                message = await pubsub.get_message(timeout=remaining)
+                if message is not None and message['type'] == 'message':
+                    return message['data'] in (b'1', '1') and \
+                        await self.exists(unique_key)
+        finally:
+            # `close` was renamed in redis 5.0.1
+            await getattr(pubsub, 'aclose', pubsub.close)()
+
+
+class _RedisTransaction:
+    def __init__(self, redis_cache, unique_key, ttl):
+        self.redis_cache = redis_cache
+        self.unique_key = unique_key
+        self.tkey = redis_cache._get_transaction_key(unique_key)
+        self.token = binascii.hexlify(os.urandom(16))
+        self.ttl_ms = max(1, int(ttl * 1000))
+        self.renewer = None
+
+    async def __aenter__(self):
+        if not await self.redis_cache.redis.set(
+            self.tkey, self.token, nx=True, px=self.ttl_ms
+        ):
+            return False
+        self.renewer = asyncio.ensure_future(self._keep_renewing())
+        return True
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if self.renewer is None:
+            return
+        self.renewer.cancel()
+        try:
+            await self.renewer
+        except asyncio.CancelledError:
+            pass
+        await self.redis_cache._release_lock(
+            keys=[self.tkey], args=[self.token]
+        )
+        await self.redis_cache.redis.publish(
+            self.redis_cache._get_done_channel(self.unique_key),
+            '1' if exc_type is None else '0',
+        )
+
+    async def _keep_renewing(self):
+        while True:
+            await asyncio.sleep(self.ttl_ms / 3000.0)
+            try:
+                renewed = await self.redis_cache._renew_lock(
+                    keys=[self.tkey], args=[self.token, self.ttl_ms]
+                )
+            except Exception as e:
+                logger.warning(
+                    'Failed to renew lock {}: {}'.format(self.tkey, e)
+                )
+                continue
+            if not renewed:
+                logger.error('Lost lock: {}'.format(self.tkey))
+                return
+
+
+class AsyncResizer:
+    """Factory for creating the asynchronous resize function
+
+    The asyncio counterpart of :class:`resizing.Resizer`. Callers that miss
+    on the same image at the same time share one generation.
+
+    Args:
+        storage_backend (ThreadedStorage):
+            The storage backend, with coroutine methods
+        cache_store (Any[ThreadedCache, AsyncRedisCache]):
+            The cache store, with coroutine methods
+        executor (Any[concurrent.futures.Executor, None]):
+            Executor to generate images in. Uses the event loop's default
+            executor if not set.
+        existence_filter (Any[bloom.BloomFilter, None]):
+            Filter of generated images' keys, shared with synchronous
+            resizers. It's called in `executor`.
+    """
+
+    def __init__(
+        self,
+        storage_backend,
+        cache_store,
+        base_url,
+        name_hashing_method=constants.DEFAULT_NAME_HASHING_METHOD,
+        target_directory=constants.DEFAULT_TARGET_DIRECTORY,
+        raise_on_generate_in_progress=False,
+        generate_in_progress_timeout=(
+            constants.DEFAULT_GENERATE_IN_PROGRESS_TIMEOUT
+        ),
+        noop=False,
+        shard_depth=constants.DEFAULT_SHARD_DEPTH,
+        shard_width=constants.DEFAULT_SHARD_WIDTH,
+        missing_source_ttl=constants.DEFAULT_MISSING_SOURCE_TTL,
+        scheduler=None,
+        executor=None,
+        existence_filter=None,
+    ):
+        self.storage_backend = storage_backend
+        self.cache_store = cache_store
+        self.base_url = base_url
+        self.name_hashing_method = name_hashing_method
+        self.target_directory = target_directory
+        self.raise_on_generate_in_progress = raise_on_generate_in_progress
+        self.generate_in_progress_timeout = generate_in_progress_timeout
+        self.noop = noop
+        self.shard_depth = shard_depth
+        self.shard_width = shard_width
+        self.missing_source_ttl = missing_source_ttl
+        self.scheduler = scheduler
+        self.executor = executor
+        self.existence_filter = existence_filter
+        self._in_flight = {}
+        if not self.base_url.endswith('/'):
+            self.base_url += '/'
+
+    async def __call__(
+        self,
+        image_url,
+        dimensions=None,
+        format=None,
+        quality=80,
+        fill=False,
+        bgcolor=None,
+        upscale=True,
+        progressive=True,
+        placeholder=False
+    ):
+        """Resize, convert and cache an image
+
+        Takes the same arguments as :meth:`resizing.Resizer.__call__`.
+
+        Returns:
+            str:
+                URL to the generated and cached image.
+        """
+        if self.noop:
+            return image_url
+
+        target = self._make_target(
+            image_url,
+            dimensions=dimensions,
+            format=format,
+            quality=quality,
+            fill=fill,
+            bgcolor=bgcolor,
+            upscale=upscale,
+            progressive=progressive,
+            placeholder=placeholder,
+        )
+        relative_url = await self._get_path(target)
+        base_url = await self.storage_backend.get_base_url(relative_url)
+        return os.path.join(base_url or self.base_url, relative_url)
+
+    async def resize_many(self, image_urls, *args, **kwargs):
+        """Resize several images using the same arguments, concurrently
+
+        Args:
+            image_urls (Iterable[str]):
+                URLs for the images to resize.
+            *args, **kwargs:
+                Passed on to :meth:`__call__` for each image.
+
+        Returns:
+            List[str]:
+                URLs to the generated and cached images, in the same order
+                as `image_urls`.
+        """
+        return list(await asyncio.gather(*[
+            self(image_url, *args, **kwargs) for image_url in image_urls
+        ]))
+
+    def _make_target(
+        self,
+        image_url,
+        dimensions=None,
+        format=None,
+        quality=80,
+        fill=False,
+        bgcolor=None,
+        upscale=True,
+        progressive=True,
+        placeholder=False
+    ):
+        if image_url and image_url.startswith(self.base_url):
+            image_url = image_url[len(self.base_url):]
+
+        # Only used to compute the key and to generate from an opened
+        # source, so the synchronous stores aren't needed
+        return ResizeTarget(
+            self.storage_backend,
+            image_url,
+            dimensions=dimensions,
+            format=format,
+            quality=quality,
+            fill=fill,
+            bgcolor=bgcolor,
+            upscale=upscale,
+            progressive=progressive,
+            use_placeholder=placeholder,
+            name_hashing_method=self.name_hashing_method,
+            target_directory=self.target_directory,
+            shard_depth=self.shard_depth,
+            shard_width=self.shard_width,
+            scheduler=self.scheduler,
+        )
+
+    async def _get_path(self, target):
+        if await self.cache_store.exists(target.unique_key):
+            logger.debug('Fetched from cache: {}'.format(target.unique_key))
+            return target.unique_key
+
+        if (
+            not target.use_placeholder and
+            await self._source_is_missing(target)
+        ):
+            raise exc.ImageNotFoundError(target.source_image_relative_url)
+
+        if (
+            (
+                self.existence_filter is None or
+                await self._run(
+                    self.existence_filter.might_contain, target.unique_key
+                )
+            ) and
+            await self.storage_backend.exists(target.unique_key)
+        ):
+            await self.cache_store.add(target.unique_key)
+            logger.debug(
+                'Found non-cached image: {}'.format(target.unique_key)
+            )
+            return target.unique_key
+
+        future = self._in_flight.get(target.unique_key)
+        if future is None:
+            future = asyncio.ensure_future(self._generate(target))
+            self._in_flight[target.unique_key] = future
+            future.add_done_callback(
+                lambda f: self._in_flight.pop(target.unique_key, None)
+            )
+        # A caller that's cancelled doesn't cancel it for the others
+        return await asyncio.shield(future)
+
+    async def _source_is_missing(self, target):
+        source_key = target.source_image_relative_url
+        return bool(
+            self.missing_source_ttl and source_key and
+            await self.cache_store.is_missing(source_key)
+        )
+
+    async def _open_source(self, target):
+        source_key = target.source_image_relative_url
+        if await self._source_is_missing(target):
+            if not target.use_placeholder:
+                raise exc.ImageNotFoundError(source_key)
+        elif source_key:
+            try:
+                return await self.storage_backend.open(source_key)
+            except exc.ImageNotFoundError:
+                if self.missing_source_ttl:
+                    await self.cache_store.mark_missing(
+                        source_key, self.missing_source_ttl
+                    )
+                if not target.use_placeholder:
+                    raise
+        return await self._run(target._get_placeholder_source)
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, fn, *args)
+
+    async def _generate(self, target):
+        """Generate `target` and return its relative URL"""
+        key = target.unique_key
+        async with self.cache_store.transaction(key) as transaction_successful:
+            if not transaction_successful:
+                logger.error('GenerateInProgress error for: {}'.format(key))
+                if (
+                    self.generate_in_progress_timeout and
+                    await self.cache_store.wait(
+                        key, self.generate_in_progress_timeout
+                    )
+                ):
+                    return key
+                elif self.raise_on_generate_in_progress:
+                    raise exc.GenerateInProgress(key)
+                return key
+
+            logger.info('Generating image: {}'.format(key))
+            source = await self._open_source(target)
+            try:
+                buf = await self._run(target._generate_impl, source)
+                await self.storage_backend.save(key, buf)
+            except exc.FileExistsError:
+                logger.info('Image already exists: {}'.format(key))
+            except Exception as e:
+                logger.info(
+                    'Exception occurred - removing {} from cache and '
+                    'image store. Exception was: {}'.format(key, e)
+                )
+                try:
+                    await self.storage_backend.delete(key)
+                except Exception as e2:
+                    logger.warning(
+                        'Another exception occurred while doing error cleanup '
+                        'for: {}. The exception was: {}'.format(key, e2)
+                    )
+                await self.cache_store.remove(key)
+                raise
+
+            await self.cache_store.add(key)
+            if self.existence_filter is not None:
+                # Also when it already existed, so it's never reported as
+                # missing
+                await self._run(self.existence_filter.add, key)
+            if target.source_image_relative_url:
+                await self.cache_store.add_variant(
+                    target.source_image_relative_url, key
+                )
+            return key
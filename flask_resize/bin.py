@@ -1,4 +1,6 @@
 import os
+import sys
+import time
 
 import argh
 
@@ -10,12 +12,32 @@ config = flask_resize.configuration.Config.from_pyfile(
 resize = flask_resize.make_resizer(config)
 
 
+def _write_progress(verb, count, started_at):
+    elapsed = time.time() - started_at
+    sys.stderr.write('{} {} images ({:.0f}/s)\n'.format(
+        verb, count, count / elapsed if elapsed else count
+    ))
+
+
+def _with_progress(keys, verb, every=1000):
+    """Pass through `keys`, while reporting the count so far to stderr"""
+    started_at = time.time()
+    count = 0
+    for count, key in enumerate(keys, 1):
+        if count % every == 0:
+            _write_progress(verb, count, started_at)
+        yield key
+    _write_progress(verb, count, started_at)
+
+
 @argh.named('images')
-def clear_images():
+@argh.arg('-p', '--progress', help='Report progress to stderr')
+def clear_images(progress=False):
     """Delete all generated images from the storage backend"""
-    for filepath in resize.storage_backend.delete_tree(
-        resize.target_directory
-    ):
+    filepaths = resize.storage_backend.delete_tree(resize.target_directory)
+    if progress:
+        filepaths = _with_progress(filepaths, 'Deleted')
+    for filepath in filepaths:
         yield filepath
 
 
@@ -27,9 +49,13 @@ def list_cache():
 
 
 @argh.named('images')
-def list_images():
+@argh.arg('-p', '--progress', help='Report progress to stderr')
+def list_images(progress=False):
     """List all generated images found in storage backend"""
-    for key in resize.storage_backend.list_tree(resize.target_directory):
+    keys = resize.storage_backend.list_tree(resize.target_directory)
+    if progress:
+        keys = _with_progress(keys, 'Listed')
+    for key in keys:
         yield key
 
 
@@ -59,17 +85,107 @@ def sync_cache():
         yield 'Added {}'.format(path)
 
 
+@argh.named('shards')
+def migrate_shards():
+    """
+    Move generated images into the directory layout set by
+    RESIZE_SHARD_DEPTH and RESIZE_SHARD_WIDTH, and update the cache
+
+    Run this after changing the sharding settings, so that images that were
+    already generated don't have to be generated again. The cache is
+    updated as images are moved, so that running instances keep finding
+    them.
+    """
+    storage_backend = resize.storage_backend
+    existence_filter = resize.existence_filter
+
+    for chunk in flask_resize.utils.chunked(
+        storage_backend.list_tree(resize.target_directory),
+        1000
+    ):
+        moves = [
+            (path, resize.sharded_key(path)) for path in chunk
+            if resize.sharded_key(path) != path
+        ]
+        if not moves:
+            continue
+        if existence_filter is not None:
+            # Before moving, so that they're never reported as missing
+            existence_filter.add_many(new_path for _, new_path in moves)
+
+        for path, new_path in moves:
+            try:
+                storage_backend.move(path, new_path)
+            except flask_resize.exc.FileExistsError:
+                # Already generated with the new layout
+                storage_backend.delete(path)
+            yield 'Moved {} to {}'.format(path, new_path)
+
+        resize.cache_store.add_many(new_path for _, new_path in moves)
+        resize.cache_store.remove_many(path for path, _ in moves)
+        resize.cache_store.replace_variants(dict(moves))
+
+
+@argh.named('bloom')
+def build_bloom():
+    """
+    Build the Bloom filter (RESIZE_BLOOM_FILTER) from the generated images
+    in the storage backend
+
+    Until the filter has been built, every image is checked for in the
+    storage backend as usual.
+    """
+    existence_filter = resize.existence_filter
+    if existence_filter is None:
+        raise argh.CommandError('RESIZE_BLOOM_FILTER is not configured')
+
+    existence_filter.clear()
+    count = 0
+    for chunk in flask_resize.utils.chunked(
+        resize.storage_backend.list_tree(resize.target_directory),
+        1000
+    ):
+        existence_filter.add_many(chunk)
+        count += len(chunk)
+    existence_filter.mark_ready()
+    yield 'Added {} images'.format(count)
+
+
 @argh.named('cache')
 def clear_cache():
     """Clear the cache backend from generated images' paths"""
     resize.cache_store.clear()
 
 
+@argh.named('source')
+def clear_source(path):
+    """Delete all images generated from the source image at `path`"""
+    for filepath in resize.invalidate(path):
+        yield filepath
+
+
 @argh.named('all')
-def clear_all():
+@argh.arg('-p', '--progress', help='Report progress to stderr')
+def clear_all(progress=False):
     """Clear both the cache and all generated images"""
     clear_cache()
-    for filepath in clear_images():
+    for filepath in clear_images(progress=progress):
+        yield filepath
+
+
+@argh.arg('-b', '--max-bytes', type=int,
+          help='Maximum total size in bytes of generated images to keep')
+@argh.arg('-c', '--max-count', type=int,
+          help='Maximum number of generated images to keep')
+def prune(max_bytes=None, max_count=None):
+    """
+    Delete the least recently used generated images, and remove them from
+    the cache, until the remaining images fit within the budget
+
+    Requires RESIZE_TRACK_ACCESS to be enabled, as only images with tracked
+    accesses are considered.
+    """
+    for filepath in resize.prune(max_bytes=max_bytes, max_count=max_count):
         yield filepath
 
 
@@ -111,9 +227,35 @@ def generate(
     )
 
 
+@argh.arg('-c', '--concurrency', type=int,
+          help='Number of images to generate at the same time')
+@argh.arg('-b', '--burst', help='Stop when the queue is empty')
+def worker(concurrency=None, burst=False):
+    """
+    Generate the images queued by web processes, when
+    RESIZE_GENERATION_QUEUE is enabled
+
+    Failing images are retried RESIZE_GENERATION_MAX_RETRIES times. Run any
+    number of workers, on any number of hosts.
+    """
+    if resize.job_queue is None:
+        raise argh.CommandError('RESIZE_GENERATION_QUEUE is not enabled')
+
+    job_worker = flask_resize.jobs.Worker(
+        resize,
+        resize.job_queue,
+        concurrency=concurrency or config.worker_concurrency,
+    )
+    for job, error in job_worker.run(burst=burst):
+        if error is None:
+            yield 'Generated {}'.format(job.unique_key)
+        else:
+            yield 'Failed {}: {}'.format(job.unique_key, error)
+
+
 parser = argh.ArghParser()
 
-argh.add_commands(parser, [generate])
+argh.add_commands(parser, [generate, prune, worker])
 
 argh.add_commands(
     parser,
@@ -129,7 +271,19 @@ argh.add_commands(
 )
 argh.add_commands(
     parser,
-    [clear_cache, clear_images, clear_all],
+    [build_bloom],
+    namespace='build',
+    title="Commands for building lookup structures",
+)
+argh.add_commands(
+    parser,
+    [migrate_shards],
+    namespace='migrate',
+    title="Commands for migrating generated images",
+)
+argh.add_commands(
+    parser,
+    [clear_cache, clear_images, clear_source, clear_all],
     namespace='clear',
     title="Commands for clearing/deleting images and cache",
 )
@@ -0,0 +1,337 @@
+import hashlib
+import math
+import mmap
+import os
+import struct
+import threading
+from contextlib import contextmanager
+
+from . import _compat, constants, exc, utils
+
+
+def make(config, cache_store=None):
+    """Generate existence filter from supplied config
+
+    Args:
+        config (dict):
+            The config to extract settings from
+        cache_store (Any[cache.Cache, None]):
+            The cache store, whose Redis connection is reused by the `redis`
+            filter if available.
+
+    Returns:
+        Any[FileBloomFilter, RedisBloomFilter, None]:
+            A :class:`BloomFilter` sub-class, based on the
+            `RESIZE_BLOOM_FILTER` value, or None if it isn't set.
+
+    Raises:
+        RuntimeError: If another `RESIZE_BLOOM_FILTER` value was set
+    """
+    if not config.bloom_filter:
+        return None
+
+    kw = dict(
+        capacity=config.bloom_filter_capacity,
+        error_rate=config.bloom_filter_error_rate,
+    )
+    if config.bloom_filter == 'file':
+        if not config.bloom_filter_path:
+            raise RuntimeError(
+                'You must specify RESIZE_BLOOM_FILTER_PATH when '
+                'RESIZE_BLOOM_FILTER is set to "file".'
+            )
+        return FileBloomFilter(config.bloom_filter_path, **kw)
+    elif config.bloom_filter == 'redis':
+        redis = getattr(cache_store, 'redis', None) or config.redis_host
+        return RedisBloomFilter(
+            host=redis,
+            port=config.redis_port,
+            db=config.redis_db,
+            password=config.redis_password,
+            key='-'.join([config.redis_key, 'bloom']),
+            **kw
+        )
+    else:
+        raise RuntimeError(
+            'Non-supported RESIZE_BLOOM_FILTER value: "{}"'
+            .format(config.bloom_filter)
+        )
+
+
+class BloomFilter:
+    """Bloom filter base class
+
+    Answers whether a generated image's key is definitely absent from the
+    storage backend, or might exist. A filter is only consulted once it's
+    been built (see :meth:`mark_ready`), until then every key might exist.
+
+    Args:
+        capacity (int):
+            Expected number of keys
+        error_rate (float):
+            Acceptable rate of false positives when `capacity` keys have
+            been added
+    """
+
+    def __init__(
+        self,
+        capacity=constants.DEFAULT_BLOOM_FILTER_CAPACITY,
+        error_rate=constants.DEFAULT_BLOOM_FILTER_ERROR_RATE,
+    ):
+        self.num_bits = int(math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2
+        ))
+        self.num_hashes = max(
+            1, int(round(self.num_bits / float(capacity) * math.log(2)))
+        )
+
+    def _get_positions(self, key):
+        digest = hashlib.sha1(_compat.b(key)).digest()
+        h1, h2 = struct.unpack('<QQ', digest[:16])
+        h2 |= 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, key):
+        raise NotImplementedError
+
+    def add_many(self, keys):
+        raise NotImplementedError
+
+    def might_contain(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def mark_ready(self):
+        raise NotImplementedError
+
+
+class FileBloomFilter(BloomFilter):
+    """A Bloom filter kept in a memory-mapped file
+
+    The file is shared by all processes on a host that use the same
+    `path`, so that keys added by one process are seen by the others.
+    Writes are serialised with a lock on the file (where `fcntl` is
+    available).
+
+    The filter only learns about images generated on its own host. When
+    several hosts share a storage backend, images generated elsewhere are
+    reported as missing, and generated again, until the filter is rebuilt
+    with `flask-resize build bloom`. Use the `redis` filter to share one
+    between hosts.
+
+    Args:
+        path (str):
+            The file to keep the filter in. Its size and number of hashes
+            are appended to the name, so that processes configured with
+            other settings use other files, and files left behind by old
+            settings can be deleted.
+    """
+
+    _header = struct.Struct('<4sQIB')
+    _magic = b'FRBF'
+
+    def __init__(
+        self,
+        path,
+        capacity=constants.DEFAULT_BLOOM_FILTER_CAPACITY,
+        error_rate=constants.DEFAULT_BLOOM_FILTER_ERROR_RATE,
+    ):
+        BloomFilter.__init__(self, capacity=capacity, error_rate=error_rate)
+        self.path = path
+        self.filename = '{}.{}-{}'.format(
+            path, self.num_bits, self.num_hashes
+        )
+        self._size = self._header.size + (self.num_bits + 7) // 8
+        self._lock = threading.Lock()
+        # Kept open, as closing any descriptor of the file releases the
+        # process' locks on it
+        self._fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0o644)
+        with self._locked():
+            self._map = self._open()
+
+    def _open(self):
+        # Other processes may have mapped the file already, so it's never
+        # shrunk or cleared here, only grown when it's new
+        if os.fstat(self._fd).st_size < self._size:
+            os.ftruncate(self._fd, self._size)
+        mapped = mmap.mmap(self._fd, self._size)
+        if self._header.unpack_from(mapped)[0] != self._magic:
+            self._header.pack_into(
+                mapped, 0, self._magic, self.num_bits, self.num_hashes, 0
+            )
+        return mapped
+
+    @property
+    def is_ready(self):
+        return self._header.unpack_from(self._map)[3] == 1
+
+    @contextmanager
+    def _locked(self):
+        # Bits are set with a read-modify-write of their byte, which would
+        # lose concurrent writes to the same byte without the lock
+        with self._lock:
+            if _compat.fcntl is None:
+                yield
+                return
+            _compat.fcntl.lockf(self._fd, _compat.fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                _compat.fcntl.lockf(self._fd, _compat.fcntl.LOCK_UN)
+
+    def _set_bits(self, key):
+        offset = self._header.size
+        for pos in self._get_positions(key):
+            index = offset + pos // 8
+            self._map[index:index + 1] = struct.pack(
+                'B',
+                bytearray(self._map[index:index + 1])[0] | (1 << (pos % 8))
+            )
+
+    def add(self, key):
+        """Add a key to the filter
+
+        Args:
+            key (str): The key to add
+        """
+        with self._locked():
+            self._set_bits(key)
+
+    def add_many(self, keys):
+        """Add keys to the filter
+
+        Args:
+            keys (Iterable[str]): The keys to add
+        """
+        for chunk in utils.chunked(keys, 1000):
+            with self._locked():
+                for key in chunk:
+                    self._set_bits(key)
+
+    def might_contain(self, key):
+        """Check whether the key might have been added
+
+        Args:
+            key (str): The key to check
+
+        Returns:
+            bool:
+                False if the key definitely hasn't been added. Always True
+                while the filter isn't ready.
+        """
+        if not self.is_ready:
+            return True
+        offset = self._header.size
+        for pos in self._get_positions(key):
+            index = offset + pos // 8
+            if not bytearray(self._map[index:index + 1])[0] & (1 << (pos % 8)):
+                return False
+        return True
+
+    def clear(self):
+        """Remove all keys, and mark the filter as not ready"""
+        with self._locked():
+            self._map[:] = b'\x00' * self._size
+            self._header.pack_into(
+                self._map, 0, self._magic, self.num_bits, self.num_hashes, 0
+            )
+
+    def mark_ready(self):
+        """Start answering lookups, once all existing keys are added"""
+        with self._locked():
+            self._header.pack_into(
+                self._map, 0, self._magic, self.num_bits, self.num_hashes, 1
+            )
+        self._map.flush()
+
+
+class RedisBloomFilter(BloomFilter):
+    """A Bloom filter kept in a Redis bitmap
+
+    Args:
+        host (Any[str, redis.StrictRedis]):
+            Redis host, or a pre-configured Redis client.
+        key (str):
+            The key to store the bitmap at
+    """
+
+    def __init__(
+        self,
+        host='localhost',
+        port=6379,
+        db=0,
+        password=None,
+        key='-'.join([constants.DEFAULT_REDIS_KEY, 'bloom']),
+        capacity=constants.DEFAULT_BLOOM_FILTER_CAPACITY,
+        error_rate=constants.DEFAULT_BLOOM_FILTER_ERROR_RATE,
+    ):
+        BloomFilter.__init__(self, capacity=capacity, error_rate=error_rate)
+        if _compat.redis is None:
+            raise exc.RedisImportError(
+                "Redis must be installed for Redis support. "
+                "Package found @ https://pypi.python.org/pypi/redis."
+            )
+        self.key = key
+        self.ready_key = '-'.join([key, 'ready'])
+
+        if isinstance(host, _compat.string_types):
+            self.redis = _compat.redis.StrictRedis(
+                host=host,
+                port=port,
+                db=db,
+                password=password,
+            )
+        else:
+            self.redis = host
+
+    def add(self, key):
+        """Add a key to the filter
+
+        Args:
+            key (str): The key to add
+        """
+        self.add_many([key])
+
+    def add_many(self, keys):
+        """Add keys to the filter
+
+        Args:
+            keys (Iterable[str]): The keys to add
+        """
+        pipe = self.redis.pipeline(transaction=False)
+        for i, key in enumerate(keys, 1):
+            for pos in self._get_positions(key):
+                pipe.setbit(self.key, pos, 1)
+            if i % 1000 == 0:
+                pipe.execute()
+        pipe.execute()
+
+    def might_contain(self, key):
+        """Check whether the key might have been added
+
+        Args:
+            key (str): The key to check
+
+        Returns:
+            bool:
+                False if the key definitely hasn't been added. Always True
+                while the filter isn't ready.
+        """
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.exists(self.ready_key)
+        for pos in self._get_positions(key):
+            pipe.getbit(self.key, pos)
+        results = pipe.execute()
+        if not results[0]:
+            return True
+        return all(results[1:])
+
+    def clear(self):
+        """Remove all keys, and mark the filter as not ready"""
+        self.redis.delete(self.key, self.ready_key)
+
+    def mark_ready(self):
+        """Start answering lookups, once all existing keys are added"""
+        self.redis.set(self.ready_key, 1)
@@ -1,25 +1,64 @@
+import atexit
+import binascii
+import hashlib
+import logging
+import mmap
 import os
+import sqlite3
+import struct
+import threading
+import time
+import weakref
 from contextlib import contextmanager
 
-from . import _compat, constants, exc
+from . import _compat, constants, exc, utils
 
+logger = logging.getLogger('flask_resize')
 
-def make(config):
+
+def _flush_at_exit(ref):
+    """Write a cache store's buffered accesses, unless it's gone already"""
+    cache_store = ref()
+    if cache_store is None:
+        return
+    try:
+        cache_store.flush()
+    except Exception as e:
+        logger.warning('Failed to flush buffered accesses: {}'.format(e))
+
+
+def make(config, image_store=None):
     """Generate cache store from supplied config
 
     Args:
         config (dict):
             The config to extract settings from
+        image_store (Any[storage.Storage, None]):
+            The storage backend, where the no-op cache keeps its index of
+            each source image's generated images.
 
     Returns:
-        Any[RedisCache, NoopCache]:
+        Any[RedisCache, SQLiteCache, NoopCache, SharedMemoryCache]:
             A :class:`Cache` sub-class, based on the `RESIZE_CACHE_STORE`
-            value.
+            value. Wrapped in a :class:`SharedMemoryCache` if
+            `RESIZE_SHARED_CACHE_PATH` is set.
 
     Raises:
         RuntimeError: If another `RESIZE_CACHE_STORE` value was set
 
     """
+    cache_store = _make_store(config, image_store=image_store)
+    if config.shared_cache_path:
+        return SharedMemoryCache(
+            cache_store,
+            config.shared_cache_path,
+            slots=config.shared_cache_slots,
+            ttl=config.shared_cache_ttl,
+        )
+    return cache_store
+
+
+def _make_store(config, image_store=None):
     if config.cache_store == 'redis':
         kw = dict(
             host=config.redis_host,
@@ -27,10 +66,33 @@ def make(config):
             db=config.redis_db,
             password=config.redis_password,
             key=config.redis_key,
+            access_flush_size=config.access_flush_size,
+            access_flush_interval=config.access_flush_interval,
+            timeout=config.redis_timeout,
+            key_codec=CompactKeyCodec(
+                target_directory=config.target_directory,
+                shard_depth=config.shard_depth,
+                shard_width=config.shard_width,
+            ),
+            compact_keys=config.redis_compact_keys,
         )
         return RedisCache(**kw)
+    elif config.cache_store == 'sqlite':
+        if not config.sqlite_path:
+            raise RuntimeError(
+                'You must specify RESIZE_SQLITE_PATH when '
+                'RESIZE_CACHE_STORE is set to "sqlite".'
+            )
+        return SQLiteCache(
+            config.sqlite_path,
+            access_flush_size=config.access_flush_size,
+            access_flush_interval=config.access_flush_interval,
+        )
     elif config.cache_store == 'noop':
-        return NoopCache()
+        return NoopCache(
+            image_store=image_store if config.noop_cache_index else None,
+            index_directory=config.source_index_directory,
+        )
     else:
         raise RuntimeError(
             'Non-supported RESIZE_CACHE_STORE value: "{}"'
@@ -38,6 +100,83 @@ def make(config):
         )
 
 
+class CompactKeyCodec:
+    """Encodes generated images' keys as short binary strings
+
+    A key such as ``resized-images/<40 character hex digest>.jpg`` is stored
+    as a marker byte, a byte for the file extension and the raw digest.
+    Keys that don't follow the layout set by `target_directory`,
+    `shard_depth` and `shard_width` are kept as is.
+
+    Args:
+        target_directory (str):
+            Directory that the generated images are stored in
+        shard_depth (int):
+            Number of sub-directory levels that the images are spread over
+        shard_width (int):
+            Number of hash characters per sub-directory
+    """
+
+    marker = b'\x00'
+    extensions = ('jpg', 'png')
+
+    def __init__(
+        self,
+        target_directory=constants.DEFAULT_TARGET_DIRECTORY,
+        shard_depth=constants.DEFAULT_SHARD_DEPTH,
+        shard_width=constants.DEFAULT_SHARD_WIDTH,
+    ):
+        self.target_directory = target_directory
+        self.shard_depth = shard_depth
+        self.shard_width = shard_width
+
+    def _make_key(self, filename):
+        return '/'.join([
+            self.target_directory,
+            utils.shard_path(filename, self.shard_depth, self.shard_width),
+        ])
+
+    def encode(self, unique_key):
+        """
+        Args:
+            unique_key (str): Key of a generated image
+
+        Returns:
+            Any[bytes, str]: The compact key, or `unique_key` if it couldn't
+            be compacted
+        """
+        filename = unique_key.rpartition('/')[2]
+        digest, _, ext = filename.partition('.')
+        if (
+            ext not in self.extensions or
+            self._make_key(filename) != unique_key
+        ):
+            return unique_key
+        try:
+            raw_digest = binascii.unhexlify(digest)
+        except (TypeError, ValueError):
+            return unique_key
+        return b''.join([
+            self.marker,
+            struct.pack('B', self.extensions.index(ext)),
+            raw_digest,
+        ])
+
+    def decode(self, value):
+        """
+        Args:
+            value (bytes): A key as stored in the cache
+
+        Returns:
+            str: The key of the generated image
+        """
+        if not value.startswith(self.marker):
+            return value.decode()
+        ext = self.extensions[struct.unpack('B', value[1:2])[0]]
+        digest = binascii.hexlify(value[2:]).decode()
+        return self._make_key('.'.join([digest, ext]))
+
+
 class Cache:
     """Cache base class"""
 
@@ -50,22 +189,101 @@ class Cache:
     def remove(self, unique_key):
         raise NotImplementedError
 
+    def add_many(self, unique_keys):
+        raise NotImplementedError
+
+    def remove_many(self, unique_keys):
+        raise NotImplementedError
+
     def clear(self):
         raise NotImplementedError
 
     def all(self):
         raise NotImplementedError
 
+    def add_variant(self, source_key, unique_key):
+        raise NotImplementedError
+
+    def variants(self, source_key):
+        raise NotImplementedError
+
+    def remove_variants(self, source_key):
+        raise NotImplementedError
+
+    def replace_variants(self, replacements):
+        raise NotImplementedError
+
+    def touch(self, unique_key, size=None):
+        raise NotImplementedError
+
+    def usage(self):
+        raise NotImplementedError
+
+    def least_recently_used(self, count):
+        raise NotImplementedError
+
+    def forget(self, unique_keys):
+        raise NotImplementedError
+
+    def mark_missing(self, source_key, ttl):
+        raise NotImplementedError
+
+    def unmark_missing(self, source_key):
+        raise NotImplementedError
+
+    def is_missing(self, source_key):
+        raise NotImplementedError
+
     def transaction(self, unique_key, ttl=600):
         raise NotImplementedError
 
+    def wait(self, unique_key, timeout):
+        raise NotImplementedError
+
 
 class NoopCache(Cache):
     """
     No-op cache, just to get the same API regardless of whether cache is
     used or not.
+
+    As there's no cache to keep it in, the index of each source image's
+    generated images is stored as empty marker files in the storage
+    backend, if one is passed in (see `RESIZE_NOOP_CACHE_INDEX`). That
+    costs two extra writes per generated image. Missing source images are
+    only remembered within the current process.
+
+    Args:
+        image_store (Any[storage.Storage, None]):
+            Storage backend to keep the source image index in.
+        index_directory (str):
+            Directory in `image_store` to keep the source image index in.
     """
 
+    def __init__(
+        self,
+        image_store=None,
+        index_directory=constants.DEFAULT_SOURCE_INDEX_DIRECTORY
+    ):
+        self.image_store = image_store
+        self.index_directory = index_directory
+        self._missing = {}
+        self._missing_lock = threading.Lock()
+
+    def _get_index_path(self, source_key):
+        name = hashlib.sha1(_compat.b(source_key)).hexdigest()
+        return '/'.join([self.index_directory, name])
+
+    def _get_marker_path(self, source_key, unique_key):
+        return '/'.join([
+            self._get_index_path(source_key),
+            _compat.quote(unique_key, safe=''),
+        ])
+
+    def _get_source_path(self, unique_key):
+        # Not a 40 character hex digest, so can't clash with a source's index
+        name = hashlib.sha1(_compat.b(unique_key)).hexdigest()
+        return '/'.join([self.index_directory, 'sources', name])
+
     def exists(self, unique_key):
         """
         Check if key exists in cache
@@ -102,6 +320,30 @@ class NoopCache(Cache):
         """
         return False
 
+    def add_many(self, unique_keys):
+        """
+        Add keys to cache
+
+        Args:
+            unique_keys (Iterable[str]): Add these keys to the cache
+
+        Returns:
+            bool: Whether any keys were added or not
+        """
+        return False
+
+    def remove_many(self, unique_keys):
+        """
+        Remove keys from cache
+
+        Args:
+            unique_keys (Iterable[str]): Remove these keys from the cache
+
+        Returns:
+            bool: Whether any keys were removed or not
+        """
+        return False
+
     def clear(self):
         """
         Remove all keys from cache
@@ -120,6 +362,208 @@ class NoopCache(Cache):
         """
         return []
 
+    def add_variant(self, source_key, unique_key):
+        """
+        Record that `unique_key` was generated from `source_key`, with a
+        marker file in the storage backend
+
+        The source is also recorded per generated image, so that
+        `replace_variants` can find the affected markers directly.
+
+        Args:
+            source_key (str): Key of the source image
+            unique_key (str): Key of the generated image
+
+        Returns:
+            bool: Whether the variant was added or not
+        """
+        if self.image_store is None:
+            return False
+        try:
+            self.image_store.save(
+                self._get_marker_path(source_key, unique_key),
+                b'',
+            )
+        except exc.FileExistsError:
+            return False
+        try:
+            self.image_store.save(
+                self._get_source_path(unique_key),
+                _compat.b(source_key),
+            )
+        except exc.FileExistsError:
+            pass
+        return True
+
+    def variants(self, source_key):
+        """
+        List the keys of all images generated from `source_key`
+
+        Args:
+            source_key (str): Key of the source image
+
+        Returns:
+            List[str]: Keys of the generated images
+        """
+        if self.image_store is None:
+            return []
+        return [
+            _compat.unquote(marker.rpartition('/')[2])
+            for marker in self.image_store.list_tree(
+                self._get_index_path(source_key)
+            )
+        ]
+
+    def remove_variants(self, source_key):
+        """
+        Forget all images generated from `source_key`
+
+        Args:
+            source_key (str): Key of the source image
+
+        Returns:
+            bool: Whether any variants were removed or not
+        """
+        if self.image_store is None:
+            return False
+        markers = list(self.image_store.list_tree(
+            self._get_index_path(source_key)
+        ))
+        list(self.image_store.delete_many(
+            self._get_source_path(_compat.unquote(marker.rpartition('/')[2]))
+            for marker in markers
+        ))
+        return bool(list(self.image_store.delete_many(markers)))
+
+    def replace_variants(self, replacements):
+        """
+        Replace generated images' keys in the index, e.g. after they were
+        moved or deleted
+
+        Reads each image's source from the record written by `add_variant`,
+        so only the affected markers are touched.
+
+        Args:
+            replacements (Dict[str, Any[str, None]]):
+                Maps old keys to new keys, or to None to remove them
+
+        Returns:
+            bool: Whether any variants were replaced or not
+        """
+        if self.image_store is None or not replacements:
+            return False
+        source_paths = dict(
+            (unique_key, self._get_source_path(unique_key))
+            for unique_key in replacements
+        )
+        existing = self.image_store.exists_many(source_paths.values())
+        old_paths = []
+        for unique_key, new_key in replacements.items():
+            if source_paths[unique_key] not in existing:
+                continue
+            source_key = self.image_store.get(
+                source_paths[unique_key]
+            ).decode('utf-8')
+            old_paths.append(source_paths[unique_key])
+            old_paths.append(self._get_marker_path(source_key, unique_key))
+            if new_key is not None:
+                self.add_variant(source_key, new_key)
+        return bool(list(self.image_store.delete_many(old_paths)))
+
+    def touch(self, unique_key, size=None):
+        """
+        Record that `unique_key` was accessed
+
+        Args:
+            unique_key (str): The accessed key
+            size (Any[int, None]): The generated image's size in bytes
+
+        Returns:
+            bool: Whether the access was recorded or not
+        """
+        return False
+
+    def usage(self):
+        """
+        Get the number and total size of keys with recorded accesses
+
+        Returns:
+            Tuple[int, int]: Number of keys, and their total size in bytes
+        """
+        return 0, 0
+
+    def least_recently_used(self, count):
+        """
+        Get the least recently accessed keys
+
+        Args:
+            count (int): Maximum number of keys to return
+
+        Returns:
+            List[Tuple[str, int]]:
+                Keys and their sizes in bytes, least recently used first
+        """
+        return []
+
+    def forget(self, unique_keys):
+        """
+        Remove recorded accesses for keys
+
+        Args:
+            unique_keys (Iterable[str]): The keys to forget
+
+        Returns:
+            bool: Whether any keys were forgotten or not
+        """
+        return False
+
+    def mark_missing(self, source_key, ttl):
+        """
+        Remember that the source image `source_key` doesn't exist
+
+        Args:
+            source_key (str): Key of the source image
+            ttl (float): Number of seconds to remember it for
+
+        Returns:
+            bool: Whether the source image was marked as missing or not
+        """
+        with self._missing_lock:
+            self._missing[source_key] = time.time() + ttl
+        return True
+
+    def unmark_missing(self, source_key):
+        """
+        Forget that the source image `source_key` was missing
+
+        Args:
+            source_key (str): Key of the source image
+
+        Returns:
+            bool: Whether the source image was marked as missing or not
+        """
+        with self._missing_lock:
+            return self._missing.pop(source_key, None) is not None
+
+    def is_missing(self, source_key):
+        """
+        Check whether the source image `source_key` is known to be missing
+
+        Args:
+            source_key (str): Key of the source image
+
+        Returns:
+            bool: Whether the source image is marked as missing or not
+        """
+        with self._missing_lock:
+            expires_at = self._missing.get(source_key)
+            if expires_at is None:
+                return False
+            elif expires_at <= time.time():
+                del self._missing[source_key]
+                return False
+            return True
+
     @contextmanager
     def transaction(self, unique_key, ttl=600):
         """
@@ -127,12 +571,94 @@ class NoopCache(Cache):
         """
         yield True
 
+    def wait(self, unique_key, timeout):
+        """
+        Transactions never conflict, so there's nothing to wait for.
+        Always returns `False`.
+        """
+        return False
+
 
 class RedisCache(Cache):
     """A Redis-based cache that works with a single set-type key
 
     Basically just useful for checking whether an expected value in the set
     already exists (which is exactly what's needed in Flask-Resize)
+
+    Accesses recorded with :meth:`touch` are buffered, and written to a
+    sorted set (scored by access time) in batches, and when the process
+    exits. A running total of their sizes is kept for :meth:`usage`.
+
+    Transactions are locks owned by a random token, whose lease is renewed
+    in the background for as long as they're held.
+
+    Args:
+        access_flush_size (int):
+            Number of buffered accesses that triggers a write to Redis.
+        access_flush_interval (float):
+            Maximum number of seconds to buffer accesses for.
+        key_codec (Any[CompactKeyCodec, None]):
+            Used to store generated images' keys in a compact form, to save
+            memory. Keys are stored as is if not set.
+        timeout (Any[float, None]):
+            Number of seconds to wait for a connection, or for a response.
+            Waits indefinitely if not set.
+        compact_keys (bool):
+            Whether to store keys with `key_codec`. If off, `key_codec` is
+            only used to read keys that were stored while it was on.
+    """
+
+    # Only touch the lock if it's still held with our token
+    _release_lock_script = """
+        if redis.call('get', KEYS[1]) == ARGV[1] then
+            return redis.call('del', KEYS[1])
+        end
+        return 0
+    """
+    _renew_lock_script = """
+        if redis.call('get', KEYS[1]) == ARGV[1] then
+            return redis.call('pexpire', KEYS[1], ARGV[2])
+        end
+        return 0
+    """
+    # The total is only kept up to date once `usage` has initialised it
+    _set_sizes_script = """
+        local total = 0
+        for i = 1, #ARGV, 2 do
+            local old = redis.call('hget', KEYS[1], ARGV[i])
+            redis.call('hset', KEYS[1], ARGV[i], ARGV[i + 1])
+            total = total + tonumber(ARGV[i + 1]) - (tonumber(old) or 0)
+        end
+        if redis.call('exists', KEYS[2]) == 1 then
+            redis.call('incrby', KEYS[2], string.format('%d', total))
+        end
+        return 1
+    """
+    _forget_sizes_script = """
+        local total = 0
+        for i = 1, #ARGV do
+            local size = redis.call('hget', KEYS[1], ARGV[i])
+            if size then
+                redis.call('hdel', KEYS[1], ARGV[i])
+                total = total + tonumber(size)
+            end
+        end
+        if redis.call('exists', KEYS[2]) == 1 then
+            redis.call('decrby', KEYS[2], string.format('%d', total))
+        end
+        return 0
+    """
+    _total_size_script = """
+        local total = redis.call('get', KEYS[2])
+        if total then
+            return tonumber(total)
+        end
+        total = 0
+        for _, size in ipairs(redis.call('hvals', KEYS[1])) do
+            total = total + tonumber(size)
+        end
+        redis.call('set', KEYS[2], string.format('%d', total))
+        return total
     """
 
     def __init__(
@@ -141,7 +667,12 @@ class RedisCache(Cache):
         port=6379,
         db=0,
         password=None,
-        key=constants.DEFAULT_REDIS_KEY
+        key=constants.DEFAULT_REDIS_KEY,
+        access_flush_size=constants.DEFAULT_ACCESS_FLUSH_SIZE,
+        access_flush_interval=constants.DEFAULT_ACCESS_FLUSH_INTERVAL,
+        key_codec=None,
+        timeout=None,
+        compact_keys=True,
     ):
         if _compat.redis is None:
             raise exc.RedisImportError(
@@ -149,9 +680,25 @@ class RedisCache(Cache):
                 "Package found @ https://pypi.python.org/pypi/redis."
             )
         self.key = key
+        self.access_key = '-'.join([key, 'access'])
+        self.sizes_key = '-'.join([key, 'sizes'])
+        self.total_size_key = '-'.join([key, 'total-size'])
+        self.variant_sources_key = '-'.join([key, 'variant-sources'])
+        self.access_flush_size = access_flush_size
+        self.access_flush_interval = access_flush_interval
+        self.key_codec = key_codec
+        self.compact_keys = compact_keys
         self._host = host
         self._port = port
         self._db = db
+        self._accesses = {}
+        self._sizes = {}
+        self._accesses_flushed_at = time.time()
+        self._accesses_lock = threading.Lock()
+        self._lock_stats = dict.fromkeys(
+            ['acquired', 'contended', 'renewed', 'lost'], 0
+        )
+        self._lock_stats_lock = threading.Lock()
 
         if isinstance(host, _compat.string_types):
             self.redis = _compat.redis.StrictRedis(
@@ -159,10 +706,38 @@ class RedisCache(Cache):
                 port=port,
                 db=db,
                 password=password,
+                socket_timeout=timeout,
+                socket_connect_timeout=timeout,
             )
         else:
             self.redis = host
 
+        self._release_lock = self.redis.register_script(
+            self._release_lock_script
+        )
+        self._renew_lock = self.redis.register_script(
+            self._renew_lock_script
+        )
+        self._set_sizes = self.redis.register_script(self._set_sizes_script)
+        self._forget_sizes = self.redis.register_script(
+            self._forget_sizes_script
+        )
+        self._total_size = self.redis.register_script(
+            self._total_size_script
+        )
+        atexit.register(_flush_at_exit, weakref.ref(self))
+
+    def _encode(self, unique_key):
+        if self.key_codec is None or not self.compact_keys:
+            return unique_key
+        return self.key_codec.encode(unique_key)
+
+    def _decode(self, value):
+        if value.startswith(CompactKeyCodec.marker):
+            # Decodable even if compact keys have since been turned off
+            return (self.key_codec or CompactKeyCodec()).decode(value)
+        return value.decode()
+
     def exists(self, unique_key):
         """
         Check if key exists in cache
@@ -173,7 +748,7 @@ class RedisCache(Cache):
         Returns:
             bool: Whether key exist in cache or not
         """
-        return self.redis.sismember(self.key, unique_key)
+        return self.redis.sismember(self.key, self._encode(unique_key))
 
     def add(self, unique_key):
         """
@@ -185,7 +760,7 @@ class RedisCache(Cache):
         Returns:
             bool: Whether key was added or not
         """
-        return bool(self.redis.sadd(self.key, unique_key))
+        return bool(self.redis.sadd(self.key, self._encode(unique_key)))
 
     def remove(self, unique_key):
         """
@@ -197,7 +772,37 @@ class RedisCache(Cache):
         Returns:
             bool: Whether key was removed or not
         """
-        return bool(self.redis.srem(self.key, unique_key))
+        return bool(self.redis.srem(self.key, self._encode(unique_key)))
+
+    def add_many(self, unique_keys):
+        """
+        Add keys to cache, in batches
+
+        Args:
+            unique_keys (Iterable[str]): Add these keys to the cache
+
+        Returns:
+            bool: Whether any keys were added or not
+        """
+        pipe = self.redis.pipeline(transaction=False)
+        for keys in utils.chunked(map(self._encode, unique_keys), 1000):
+            pipe.sadd(self.key, *keys)
+        return any(pipe.execute())
+
+    def remove_many(self, unique_keys):
+        """
+        Remove keys from cache, in batches
+
+        Args:
+            unique_keys (Iterable[str]): Remove these keys from the cache
+
+        Returns:
+            bool: Whether any keys were removed or not
+        """
+        pipe = self.redis.pipeline(transaction=False)
+        for keys in utils.chunked(map(self._encode, unique_keys), 1000):
+            pipe.srem(self.key, *keys)
+        return any(pipe.execute())
 
     def clear(self):
         """
@@ -206,7 +811,19 @@ class RedisCache(Cache):
         Returns:
             bool: Whether any keys were removed or not
         """
-        return bool(self.redis.delete(self.key))
+        with self._accesses_lock:
+            self._accesses.clear()
+            self._sizes.clear()
+        keys = [
+            self.key,
+            self.access_key,
+            self.sizes_key,
+            self.total_size_key,
+            self.variant_sources_key,
+        ]
+        keys.extend(self.redis.scan_iter(match=self._get_variants_key('*')))
+        keys.extend(self.redis.scan_iter(match=self._get_missing_key('*')))
+        return bool(self.redis.delete(*keys))
 
     def all(self):
         """
@@ -215,34 +832,1069 @@ class RedisCache(Cache):
         Returns:
             List[str]: All the keys in the set, as a list
         """
-        return [v.decode() for v in self.redis.smembers(self.key)]
+        return [self._decode(v) for v in self.redis.smembers(self.key)]
 
-    @contextmanager
-    def transaction(
-        self,
-        unique_key,
-        ttl=600
-    ):
+    def _get_variants_key(self, source_key):
+        return '-variants-'.join([self.key, source_key])
+
+    def add_variant(self, source_key, unique_key):
         """
-        Context-manager to use when it's important that no one else
-        handles `unique_key` at the same time (for example when
-        saving data to a storage backend).
+        Record that `unique_key` was generated from `source_key`
+
+        The source is also recorded per generated image, in a hash, so that
+        `replace_variants` can find the affected sets directly.
 
         Args:
-            unique_key (str):
-                The unique key to ensure atomicity for
-            ttl (int):
-                Time before the transaction is deemed irrelevant and discarded
-                from cache. Is only relevant if the host forcefully restarts.
+            source_key (str): Key of the source image
+            unique_key (str): Key of the generated image
+
+        Returns:
+            bool: Whether the variant was added or not
         """
-        tkey = '-transaction-'.join([self.key, unique_key])
+        value = self._encode(unique_key)
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.sadd(self._get_variants_key(source_key), value)
+        pipe.hset(self.variant_sources_key, value, source_key)
+        return bool(pipe.execute()[0])
 
-        if self.redis.set(tkey, str(os.getpid()), nx=True):
-            self.redis.expire(tkey, ttl)
-        else:
-            yield False
+    def variants(self, source_key):
+        """
+        List the keys of all images generated from `source_key`
 
-        try:
-            yield True
-        finally:
-            self.redis.delete(tkey)
+        Args:
+            source_key (str): Key of the source image
+
+        Returns:
+            List[str]: Keys of the generated images
+        """
+        return [
+            self._decode(v)
+            for v in self.redis.smembers(self._get_variants_key(source_key))
+        ]
+
+    def remove_variants(self, source_key):
+        """
+        Forget all images generated from `source_key`
+
+        Args:
+            source_key (str): Key of the source image
+
+        Returns:
+            bool: Whether any variants were removed or not
+        """
+        variants_key = self._get_variants_key(source_key)
+        values = self.redis.smembers(variants_key)
+        pipe = self.redis.pipeline(transaction=False)
+        if values:
+            pipe.hdel(self.variant_sources_key, *values)
+        pipe.delete(variants_key)
+        return bool(pipe.execute()[-1])
+
+    def replace_variants(self, replacements):
+        """
+        Replace generated images' keys in the index, e.g. after they were
+        moved or deleted
+
+        Looks up each image's source in the hash written by `add_variant`,
+        so only the affected sources' sets are touched.
+
+        Args:
+            replacements (Dict[str, Any[str, None]]):
+                Maps old keys to new keys, or to None to remove them
+
+        Returns:
+            bool: Whether any variants were replaced or not
+        """
+        if not replacements:
+            return False
+        items = list(replacements.items())
+        old_values = [self._encode(unique_key) for unique_key, _ in items]
+        sources = self.redis.hmget(self.variant_sources_key, old_values)
+        pipe = self.redis.pipeline(transaction=False)
+        for (_, new_key), old_value, source in zip(items, old_values, sources):
+            if source is None:
+                continue
+            variants_key = self._get_variants_key(source.decode())
+            if new_key is not None:
+                new_value = self._encode(new_key)
+                pipe.sadd(variants_key, new_value)
+                pipe.hset(self.variant_sources_key, new_value, source)
+            pipe.srem(variants_key, old_value)
+            pipe.hdel(self.variant_sources_key, old_value)
+        return any(pipe.execute())
+
+    def touch(self, unique_key, size=None):
+        """
+        Record that `unique_key` was accessed. The access is buffered and
+        written to Redis in a batch, together with other accesses.
+
+        Args:
+            unique_key (str): The accessed key
+            size (Any[int, None]): The generated image's size in bytes
+
+        Returns:
+            bool: Whether the access was recorded or not
+        """
+        now = time.time()
+        value = self._encode(unique_key)
+        with self._accesses_lock:
+            self._accesses[value] = now
+            if size is not None:
+                self._sizes[value] = size
+            should_flush = (
+                len(self._accesses) >= self.access_flush_size or
+                now - self._accesses_flushed_at >= self.access_flush_interval
+            )
+        if should_flush:
+            self.flush()
+        return True
+
+    def flush(self):
+        """Write buffered accesses to Redis"""
+        with self._accesses_lock:
+            accesses, self._accesses = self._accesses, {}
+            sizes, self._sizes = self._sizes, {}
+            self._accesses_flushed_at = time.time()
+        if not accesses and not sizes:
+            return
+        pipe = self.redis.pipeline(transaction=False)
+        if accesses:
+            pipe.zadd(self.access_key, accesses)
+        if sizes:
+            args = []
+            for value, size in sizes.items():
+                args.extend([value, size])
+            self._set_sizes(
+                keys=[self.sizes_key, self.total_size_key],
+                args=args,
+                client=pipe,
+            )
+        pipe.execute()
+
+    def usage(self):
+        """
+        Get the number and total size of keys with recorded accesses
+
+        Returns:
+            Tuple[int, int]: Number of keys, and their total size in bytes
+        """
+        self.flush()
+        count = self.redis.zcard(self.access_key)
+        size = self._total_size(keys=[self.sizes_key, self.total_size_key])
+        return count, int(size)
+
+    def least_recently_used(self, count):
+        """
+        Get the least recently accessed keys
+
+        Args:
+            count (int): Maximum number of keys to return
+
+        Returns:
+            List[Tuple[str, int]]:
+                Keys and their sizes in bytes, least recently used first
+        """
+        self.flush()
+        keys = self.redis.zrange(self.access_key, 0, count - 1)
+        if not keys:
+            return []
+        sizes = self.redis.hmget(self.sizes_key, keys)
+        return [
+            (self._decode(key), int(size or 0))
+            for key, size in zip(keys, sizes)
+        ]
+
+    def forget(self, unique_keys):
+        """
+        Remove recorded accesses for keys
+
+        Args:
+            unique_keys (Iterable[str]): The keys to forget
+
+        Returns:
+            bool: Whether any keys were forgotten or not
+        """
+        pipe = self.redis.pipeline(transaction=False)
+        for keys in utils.chunked(map(self._encode, unique_keys), 1000):
+            pipe.zrem(self.access_key, *keys)
+            self._forget_sizes(
+                keys=[self.sizes_key, self.total_size_key],
+                args=keys,
+                client=pipe,
+            )
+        return any(pipe.execute())
+
+    def _get_missing_key(self, source_key):
+        return '-missing-'.join([self.key, source_key])
+
+    def mark_missing(self, source_key, ttl):
+        """
+        Remember that the source image `source_key` doesn't exist
+
+        Args:
+            source_key (str): Key of the source image
+            ttl (float): Number of seconds to remember it for
+
+        Returns:
+            bool: Whether the source image was marked as missing or not
+        """
+        return bool(self.redis.set(
+            self._get_missing_key(source_key),
+            1,
+            px=int(ttl * 1000),
+        ))
+
+    def unmark_missing(self, source_key):
+        """
+        Forget that the source image `source_key` was missing
+
+        Args:
+            source_key (str): Key of the source image
+
+        Returns:
+            bool: Whether the source image was marked as missing or not
+        """
+        return bool(self.redis.delete(self._get_missing_key(source_key)))
+
+    def is_missing(self, source_key):
+        """
+        Check whether the source image `source_key` is known to be missing
+
+        Args:
+            source_key (str): Key of the source image
+
+        Returns:
+            bool: Whether the source image is marked as missing or not
+        """
+        return bool(self.redis.exists(self._get_missing_key(source_key)))
+
+    @contextmanager
+    def transaction(
+        self,
+        unique_key,
+        ttl=600
+    ):
+        """
+        Context-manager to use when it's important that no one else
+        handles `unique_key` at the same time (for example when
+        saving data to a storage backend).
+
+        Args:
+            unique_key (str):
+                The unique key to ensure atomicity for
+            ttl (float):
+                Lease time of the transaction, in seconds. Renewed while the
+                transaction is held, so it's only reached if the process
+                stops without releasing it.
+        """
+        tkey = self._get_transaction_key(unique_key)
+        token = binascii.hexlify(os.urandom(16))
+        ttl_ms = max(1, int(ttl * 1000))
+
+        if not self.redis.set(tkey, token, nx=True, px=ttl_ms):
+            self._count_lock_stat('contended')
+            yield False
+            return
+        self._count_lock_stat('acquired')
+
+        stop_renewing = threading.Event()
+        renewer = threading.Thread(
+            target=self._keep_renewing,
+            args=(tkey, token, ttl_ms, stop_renewing),
+        )
+        renewer.daemon = True
+        renewer.start()
+
+        succeeded = False
+        try:
+            yield True
+            succeeded = True
+        finally:
+            stop_renewing.set()
+            renewer.join()
+            self._release_lock(keys=[tkey], args=[token])
+            self.redis.publish(
+                self._get_done_channel(unique_key),
+                '1' if succeeded else '0',
+            )
+
+    def _keep_renewing(self, tkey, token, ttl_ms, stop_renewing):
+        while not stop_renewing.wait(ttl_ms / 3000.0):
+            try:
+                renewed = self._renew_lock(keys=[tkey], args=[token, ttl_ms])
+            except Exception as e:
+                logger.warning(
+                    'Failed to renew lock {}: {}'.format(tkey, e)
+                )
+                continue
+            if not renewed:
+                self._count_lock_stat('lost')
+                logger.error('Lost lock: {}'.format(tkey))
+                return
+            self._count_lock_stat('renewed')
+
+    def _count_lock_stat(self, name):
+        with self._lock_stats_lock:
+            self._lock_stats[name] += 1
+
+    def lock_stats(self):
+        """
+        Get counts of how transactions went, in this process
+
+        Returns:
+            Dict[str, int]:
+                Number of transactions that were `acquired`, or `contended`
+                (held by someone else), and number of times a lease was
+                `renewed`, or `lost` (expired before being renewed).
+        """
+        with self._lock_stats_lock:
+            return dict(self._lock_stats)
+
+    def _get_transaction_key(self, unique_key):
+        return '-transaction-'.join([self.key, unique_key])
+
+    def _get_done_channel(self, unique_key):
+        return '-done-'.join([self.key, unique_key])
+
+    def wait(self, unique_key, timeout):
+        """
+        Wait for the transaction of `unique_key`, held by someone else, to
+        finish
+
+        Blocks until the holder publishes that it's done, without polling.
+
+        Args:
+            unique_key (str):
+                The unique key of the transaction
+            timeout (float):
+                Maximum number of seconds to wait
+
+        Returns:
+            bool:
+                Whether the transaction finished in time, and the image is
+                cached. Also checked if the transaction had already
+                finished, or was never started.
+        """
+        deadline = time.time() + timeout
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.subscribe(self._get_done_channel(unique_key))
+            # Subscribed before checking, so that it can't finish unnoticed
+            if not self.redis.exists(self._get_transaction_key(unique_key)):
+                return bool(self.exists(unique_key))
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                message = pubsub.get_message(timeout=remaining)
+                if message is not None and message['type'] == 'message':
+                    return message['data'] in (b'1', '1') and \
+                        bool(self.exists(unique_key))
+        finally:
+            pubsub.close()
+
+
+class SQLiteCache(Cache):
+    """A cache kept in an SQLite database on the local disk
+
+    Useful when running on a single host, as no external service is
+    needed. The database is opened in WAL mode, so that it can be shared
+    by several processes (e.g. a server's worker processes) which read
+    concurrently with a writer. Each thread and process gets its own
+    connection.
+
+    Accesses recorded with :meth:`touch` are buffered, and written to the
+    database in batches, and when the process exits.
+
+    Args:
+        path (str):
+            The database file. Created if it doesn't exist.
+        timeout (float):
+            Number of seconds to wait for another process' write to finish.
+        access_flush_size (int):
+            Number of buffered accesses that triggers a write.
+        access_flush_interval (float):
+            Maximum number of seconds to buffer accesses for.
+    """
+
+    _schema = [
+        'CREATE TABLE IF NOT EXISTS keys '
+        '(key TEXT PRIMARY KEY) WITHOUT ROWID',
+        'CREATE TABLE IF NOT EXISTS variants '
+        '(source TEXT, key TEXT, PRIMARY KEY (source, key)) WITHOUT ROWID',
+        'CREATE INDEX IF NOT EXISTS variants_key ON variants (key)',
+        'CREATE TABLE IF NOT EXISTS accesses '
+        '(key TEXT PRIMARY KEY, accessed_at REAL, size INTEGER)',
+        'CREATE INDEX IF NOT EXISTS accesses_accessed_at '
+        'ON accesses (accessed_at)',
+        'CREATE TABLE IF NOT EXISTS missing '
+        '(source TEXT PRIMARY KEY, expires_at REAL) WITHOUT ROWID',
+        'CREATE TABLE IF NOT EXISTS locks '
+        '(key TEXT PRIMARY KEY, token TEXT, expires_at REAL) WITHOUT ROWID',
+    ]
+
+    def __init__(
+        self,
+        path,
+        timeout=constants.DEFAULT_SQLITE_TIMEOUT,
+        access_flush_size=constants.DEFAULT_ACCESS_FLUSH_SIZE,
+        access_flush_interval=constants.DEFAULT_ACCESS_FLUSH_INTERVAL,
+    ):
+        self.path = path
+        self.timeout = timeout
+        self.access_flush_size = access_flush_size
+        self.access_flush_interval = access_flush_interval
+        self._local = threading.local()
+        self._accesses = {}
+        self._sizes = {}
+        self._accesses_flushed_at = time.time()
+        self._accesses_lock = threading.Lock()
+        atexit.register(_flush_at_exit, weakref.ref(self))
+        with self._write() as conn:
+            for statement in self._schema:
+                conn.execute(statement)
+
+    @property
+    def connection(self):
+        """The current thread's connection, re-opened after a fork"""
+        conn = getattr(self._local, 'connection', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(
+                self.path,
+                timeout=self.timeout,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _write(self):
+        conn = self.connection
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        else:
+            conn.execute('COMMIT')
+
+    def exists(self, unique_key):
+        """
+        Check if key exists in cache
+
+        Args:
+            unique_key (str): Unique key to check for
+
+        Returns:
+            bool: Whether key exist in cache or not
+        """
+        return self.connection.execute(
+            'SELECT 1 FROM keys WHERE key = ?', (unique_key,)
+        ).fetchone() is not None
+
+    def add(self, unique_key):
+        """
+        Add key to cache
+
+        Args:
+            unique_key (str): Add this key to the cache
+
+        Returns:
+            bool: Whether key was added or not
+        """
+        return self.add_many([unique_key])
+
+    def remove(self, unique_key):
+        """
+        Remove key from cache
+
+        Args:
+            unique_key (str): Remove this key from the cache
+
+        Returns:
+            bool: Whether key was removed or not
+        """
+        return self.remove_many([unique_key])
+
+    def add_many(self, unique_keys):
+        """
+        Add keys to cache
+
+        Args:
+            unique_keys (Iterable[str]): Add these keys to the cache
+
+        Returns:
+            bool: Whether any keys were added or not
+        """
+        with self._write() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                'INSERT OR IGNORE INTO keys (key) VALUES (?)',
+                ((k, ) for k in unique_keys),
+            )
+            return conn.total_changes > before
+
+    def remove_many(self, unique_keys):
+        """
+        Remove keys from cache
+
+        Args:
+            unique_keys (Iterable[str]): Remove these keys from the cache
+
+        Returns:
+            bool: Whether any keys were removed or not
+        """
+        with self._write() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                'DELETE FROM keys WHERE key = ?',
+                ((k, ) for k in unique_keys),
+            )
+            return conn.total_changes > before
+
+    def clear(self):
+        """
+        Remove all keys from cache
+
+        Returns:
+            bool: Whether any keys were removed or not
+        """
+        with self._accesses_lock:
+            self._accesses.clear()
+            self._sizes.clear()
+        with self._write() as conn:
+            removed = conn.execute('DELETE FROM keys').rowcount
+            for table in ('variants', 'accesses', 'missing'):
+                conn.execute('DELETE FROM {}'.format(table))
+            return removed > 0
+
+    def all(self):
+        """
+        List all keys in cache
+
+        Returns:
+            List[str]: All the keys in the set, as a list
+        """
+        return [
+            row[0] for row in self.connection.execute('SELECT key FROM keys')
+        ]
+
+    def add_variant(self, source_key, unique_key):
+        """
+        Record that `unique_key` was generated from `source_key`
+
+        Args:
+            source_key (str): Key of the source image
+            unique_key (str): Key of the generated image
+
+        Returns:
+            bool: Whether the variant was added or not
+        """
+        with self._write() as conn:
+            return conn.execute(
+                'INSERT OR IGNORE INTO variants (source, key) VALUES (?, ?)',
+                (source_key, unique_key),
+            ).rowcount > 0
+
+    def variants(self, source_key):
+        """
+        List the keys of all images generated from `source_key`
+
+        Args:
+            source_key (str): Key of the source image
+
+        Returns:
+            List[str]: Keys of the generated images
+        """
+        return [
+            row[0] for row in self.connection.execute(
+                'SELECT key FROM variants WHERE source = ?', (source_key,)
+            )
+        ]
+
+    def remove_variants(self, source_key):
+        """
+        Forget all images generated from `source_key`
+
+        Args:
+            source_key (str): Key of the source image
+
+        Returns:
+            bool: Whether any variants were removed or not
+        """
+        with self._write() as conn:
+            return conn.execute(
+                'DELETE FROM variants WHERE source = ?', (source_key,)
+            ).rowcount > 0
+
+    def replace_variants(self, replacements):
+        """
+        Replace generated images' keys in the index, e.g. after they were
+        moved or deleted
+
+        Args:
+            replacements (Dict[str, Any[str, None]]):
+                Maps old keys to new keys, or to None to remove them
+
+        Returns:
+            bool: Whether any variants were replaced or not
+        """
+        with self._write() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                'UPDATE OR REPLACE variants SET key = ? WHERE key = ?',
+                (
+                    (new, old) for old, new in replacements.items()
+                    if new is not None
+                ),
+            )
+            conn.executemany(
+                'DELETE FROM variants WHERE key = ?',
+                (
+                    (old, ) for old, new in replacements.items()
+                    if new is None
+                ),
+            )
+            return conn.total_changes > before
+
+    def touch(self, unique_key, size=None):
+        """
+        Record that `unique_key` was accessed. The access is buffered and
+        written to the database in a batch, together with other accesses.
+
+        Args:
+            unique_key (str): The accessed key
+            size (Any[int, None]): The generated image's size in bytes
+
+        Returns:
+            bool: Whether the access was recorded or not
+        """
+        now = time.time()
+        with self._accesses_lock:
+            self._accesses[unique_key] = now
+            if size is not None:
+                self._sizes[unique_key] = size
+            should_flush = (
+                len(self._accesses) >= self.access_flush_size or
+                now - self._accesses_flushed_at >= self.access_flush_interval
+            )
+        if should_flush:
+            self.flush()
+        return True
+
+    def flush(self):
+        """Write buffered accesses to the database"""
+        with self._accesses_lock:
+            accesses, self._accesses = self._accesses, {}
+            sizes, self._sizes = self._sizes, {}
+            self._accesses_flushed_at = time.time()
+        if not accesses:
+            return
+        with self._write() as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO accesses (key, accessed_at, size) '
+                'VALUES (?, ?, COALESCE(?, '
+                '(SELECT size FROM accesses WHERE key = ?), 0))',
+                (
+                    (key, accessed_at, sizes.get(key), key)
+                    for key, accessed_at in accesses.items()
+                ),
+            )
+
+    def usage(self):
+        """
+        Get the number and total size of keys with recorded accesses
+
+        Returns:
+            Tuple[int, int]: Number of keys, and their total size in bytes
+        """
+        self.flush()
+        count, size = self.connection.execute(
+            'SELECT COUNT(*), SUM(size) FROM accesses'
+        ).fetchone()
+        return count, size or 0
+
+    def least_recently_used(self, count):
+        """
+        Get the least recently accessed keys
+
+        Args:
+            count (int): Maximum number of keys to return
+
+        Returns:
+            List[Tuple[str, int]]:
+                Keys and their sizes in bytes, least recently used first
+        """
+        self.flush()
+        return [
+            (key, size) for key, size in self.connection.execute(
+                'SELECT key, size FROM accesses '
+                'ORDER BY accessed_at LIMIT ?',
+                (count,)
+            )
+        ]
+
+    def forget(self, unique_keys):
+        """
+        Remove recorded accesses for keys
+
+        Args:
+            unique_keys (Iterable[str]): The keys to forget
+
+        Returns:
+            bool: Whether any keys were forgotten or not
+        """
+        self.flush()
+        with self._write() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                'DELETE FROM accesses WHERE key = ?',
+                ((k, ) for k in unique_keys),
+            )
+            return conn.total_changes > before
+
+    def mark_missing(self, source_key, ttl):
+        """
+        Remember that the source image `source_key` doesn't exist
+
+        Args:
+            source_key (str): Key of the source image
+            ttl (float): Number of seconds to remember it for
+
+        Returns:
+            bool: Whether the source image was marked as missing or not
+        """
+        with self._write() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO missing (source, expires_at) '
+                'VALUES (?, ?)',
+                (source_key, time.time() + ttl),
+            )
+        return True
+
+    def unmark_missing(self, source_key):
+        """
+        Forget that the source image `source_key` was missing
+
+        Args:
+            source_key (str): Key of the source image
+
+        Returns:
+            bool: Whether the source image was marked as missing or not
+        """
+        with self._write() as conn:
+            return conn.execute(
+                'DELETE FROM missing WHERE source = ? AND expires_at > ?',
+                (source_key, time.time()),
+            ).rowcount > 0
+
+    def is_missing(self, source_key):
+        """
+        Check whether the source image `source_key` is known to be missing
+
+        Args:
+            source_key (str): Key of the source image
+
+        Returns:
+            bool: Whether the source image is marked as missing or not
+        """
+        return self.connection.execute(
+            'SELECT 1 FROM missing WHERE source = ? AND expires_at > ?',
+            (source_key, time.time()),
+        ).fetchone() is not None
+
+    @contextmanager
+    def transaction(self, unique_key, ttl=600):
+        """
+        Context-manager to use when it's important that no one else
+        handles `unique_key` at the same time (for example when
+        saving data to a storage backend).
+
+        Args:
+            unique_key (str):
+                The unique key to ensure atomicity for
+            ttl (int):
+                Time before the transaction is deemed irrelevant and discarded
+                from cache. Is only relevant if the process is killed.
+        """
+        token = binascii.hexlify(os.urandom(16)).decode()
+        now = time.time()
+        with self._write() as conn:
+            conn.execute(
+                'DELETE FROM locks WHERE key = ? AND expires_at <= ?',
+                (unique_key, now),
+            )
+            acquired = conn.execute(
+                'INSERT OR IGNORE INTO locks (key, token, expires_at) '
+                'VALUES (?, ?, ?)',
+                (unique_key, token, now + ttl),
+            ).rowcount > 0
+
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                with self._write() as conn:
+                    conn.execute(
+                        'DELETE FROM locks WHERE key = ? AND token = ?',
+                        (unique_key, token),
+                    )
+
+    def wait(self, unique_key, timeout):
+        """
+        SQLite can't notify other processes when a transaction finishes,
+        and isn't polled. Always returns `False`.
+        """
+        return False
+
+
+class SharedMemoryCache(Cache):
+    """
+    A fixed-size, memory-mapped hash table of cached keys, in front of
+    another cache store
+
+    All processes on a host that use the same `path` share the table, so
+    that a key looked up by one process is found by the others without
+    asking `backend`. Only keys known to be cached are kept, as digests in
+    an open-addressing table, and lookups don't take any locks. When the
+    table is full, older entries are overwritten.
+
+    Entries expire after `ttl` seconds, so that keys removed on other
+    hosts aren't reported as cached for longer than that.
+
+    Args:
+        backend (Cache):
+            The cache store to use for keys that aren't in the table, and
+            for everything other than looking up keys.
+        path (str):
+            The file to keep the table in. Preferably on a memory-backed
+            file system, such as `/dev/shm`. The number of slots is
+            appended to the name, so that processes configured with another
+            number use another file.
+        slots (int):
+            Number of keys the table can hold.
+        ttl (int):
+            Number of seconds to keep a key in the table for.
+    """
+
+    _header = struct.Struct('<4sQ')
+    _magic = b'FRSC'
+    _slot = struct.Struct('<16sI')
+    _empty = b'\x00' * 16
+    max_probes = 8
+
+    def __init__(
+        self,
+        backend,
+        path,
+        slots=constants.DEFAULT_SHARED_CACHE_SLOTS,
+        ttl=constants.DEFAULT_SHARED_CACHE_TTL,
+    ):
+        self.backend = backend
+        self.path = path
+        self.filename = '{}.{}'.format(path, slots)
+        self.slots = slots
+        self.ttl = ttl
+        self._size = (
+            self._header.size + (slots + self.max_probes) * self._slot.size
+        )
+        self._map = self._open()
+
+    def __getattr__(self, name):
+        # Anything specific to the backend, e.g. `RedisCache.redis`
+        if name == 'backend':
+            raise AttributeError(name)
+        return getattr(self.backend, name)
+
+    def _open(self):
+        fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            # Only while setting up a new file. Other processes may have
+            # mapped it already, so it's never shrunk or cleared here.
+            if _compat.fcntl is not None:
+                _compat.fcntl.lockf(fd, _compat.fcntl.LOCK_EX)
+            if os.fstat(fd).st_size < self._size:
+                os.ftruncate(fd, self._size)
+            mapped = mmap.mmap(fd, self._size)
+            if self._header.unpack_from(mapped) != (self._magic, self.slots):
+                self._header.pack_into(mapped, 0, self._magic, self.slots)
+        finally:
+            # Also releases the lock
+            os.close(fd)
+        return mapped
+
+    def _get_digest(self, unique_key):
+        digest = hashlib.sha1(_compat.b(unique_key)).digest()[:16]
+        # An all-zero digest would be taken for an empty slot
+        return digest if digest != self._empty else b'\x01' + digest[1:]
+
+    def _get_offsets(self, digest):
+        home = struct.unpack_from('<Q', digest)[0] % self.slots
+        start = self._header.size + home * self._slot.size
+        return range(
+            start,
+            start + self.max_probes * self._slot.size,
+            self._slot.size,
+        )
+
+    def _lookup(self, digest):
+        now = int(time.time())
+        for offset in self._get_offsets(digest):
+            slot_digest, expires_at = self._slot.unpack_from(self._map, offset)
+            if slot_digest == digest:
+                return expires_at > now
+        return False
+
+    def _insert(self, unique_key):
+        digest = self._get_digest(unique_key)
+        now = int(time.time())
+        offsets = self._get_offsets(digest)
+        target = offsets[0]
+        for offset in offsets:
+            slot_digest, expires_at = self._slot.unpack_from(self._map, offset)
+            if slot_digest == digest:
+                target = offset
+                break
+            elif slot_digest == self._empty or expires_at <= now:
+                target = offset
+        self._slot.pack_into(self._map, target, digest, now + self.ttl)
+
+    def _discard(self, unique_key):
+        digest = self._get_digest(unique_key)
+        for offset in self._get_offsets(digest):
+            if self._slot.unpack_from(self._map, offset)[0] == digest:
+                self._slot.pack_into(self._map, offset, self._empty, 0)
+
+    def exists(self, unique_key):
+        """
+        Check if key exists in cache
+
+        Args:
+            unique_key (str): Unique key to check for
+
+        Returns:
+            bool: Whether key exist in cache or not
+        """
+        if self._lookup(self._get_digest(unique_key)):
+            return True
+        exists = self.backend.exists(unique_key)
+        if exists:
+            self._insert(unique_key)
+        return exists
+
+    def add(self, unique_key):
+        """
+        Add key to cache
+
+        Args:
+            unique_key (str): Add this key to the cache
+
+        Returns:
+            bool: Whether key was added or not
+        """
+        added = self.backend.add(unique_key)
+        self._insert(unique_key)
+        return added
+
+    def remove(self, unique_key):
+        """
+        Remove key from cache
+
+        Args:
+            unique_key (str): Remove this key from the cache
+
+        Returns:
+            bool: Whether key was removed or not
+        """
+        self._discard(unique_key)
+        return self.backend.remove(unique_key)
+
+    def add_many(self, unique_keys):
+        """
+        Add keys to cache
+
+        Args:
+            unique_keys (Iterable[str]): Add these keys to the cache
+
+        Returns:
+            bool: Whether any keys were added or not
+        """
+        unique_keys = list(unique_keys)
+        added = self.backend.add_many(unique_keys)
+        for unique_key in unique_keys:
+            self._insert(unique_key)
+        return added
+
+    def remove_many(self, unique_keys):
+        """
+        Remove keys from cache
+
+        Args:
+            unique_keys (Iterable[str]): Remove these keys from the cache
+
+        Returns:
+            bool: Whether any keys were removed or not
+        """
+        unique_keys = list(unique_keys)
+        for unique_key in unique_keys:
+            self._discard(unique_key)
+        return self.backend.remove_many(unique_keys)
+
+    def clear(self):
+        """
+        Remove all keys from cache
+
+        Returns:
+            bool: Whether any keys were removed or not
+        """
+        self._map[self._header.size:] = b'\x00' * (
+            self._size - self._header.size
+        )
+        return self.backend.clear()
+
+    def all(self):
+        return self.backend.all()
+
+    def add_variant(self, source_key, unique_key):
+        return self.backend.add_variant(source_key, unique_key)
+
+    def variants(self, source_key):
+        return self.backend.variants(source_key)
+
+    def remove_variants(self, source_key):
+        return self.backend.remove_variants(source_key)
+
+    def replace_variants(self, replacements):
+        return self.backend.replace_variants(replacements)
+
+    def touch(self, unique_key, size=None):
+        return self.backend.touch(unique_key, size=size)
+
+    def usage(self):
+        return self.backend.usage()
+
+    def least_recently_used(self, count):
+        return self.backend.least_recently_used(count)
+
+    def forget(self, unique_keys):
+        return self.backend.forget(unique_keys)
+
+    def mark_missing(self, source_key, ttl):
+        return self.backend.mark_missing(source_key, ttl)
+
+    def unmark_missing(self, source_key):
+        return self.backend.unmark_missing(source_key)
+
+    def is_missing(self, source_key):
+        return self.backend.is_missing(source_key)
+
+    def transaction(self, unique_key, ttl=600):
+        return self.backend.transaction(unique_key, ttl=ttl)
+
+    def wait(self, unique_key, timeout):
+        return self.backend.wait(unique_key, timeout)
@@ -9,19 +9,65 @@ class Config:
     noop = False
     root = None
     raise_on_generate_in_progress = False
+    generate_in_progress_timeout = \
+        constants.DEFAULT_GENERATE_IN_PROGRESS_TIMEOUT
     storage_backend = 'file'
+    file_fsync = False
+    file_max_concurrency = constants.DEFAULT_FILE_MAX_CONCURRENCY
     target_directory = constants.DEFAULT_TARGET_DIRECTORY
+    source_index_directory = constants.DEFAULT_SOURCE_INDEX_DIRECTORY
+    noop_cache_index = False
     hash_method = constants.DEFAULT_NAME_HASHING_METHOD
+    shard_depth = constants.DEFAULT_SHARD_DEPTH
+    shard_width = constants.DEFAULT_SHARD_WIDTH
     cache_store = 'noop' if redis is None else 'redis'
     redis_host = 'localhost'
     redis_port = 6379
     redis_db = 0
     redis_password = None
     redis_key = constants.DEFAULT_REDIS_KEY
+    redis_compact_keys = False
+    redis_timeout = None
+    sqlite_path = None
+    shared_cache_path = None
+    shared_cache_slots = constants.DEFAULT_SHARED_CACHE_SLOTS
+    shared_cache_ttl = constants.DEFAULT_SHARED_CACHE_TTL
+    track_access = False
+    access_flush_size = constants.DEFAULT_ACCESS_FLUSH_SIZE
+    access_flush_interval = constants.DEFAULT_ACCESS_FLUSH_INTERVAL
+    missing_source_ttl = constants.DEFAULT_MISSING_SOURCE_TTL
+    circuit_breaker_threshold = 0
+    circuit_breaker_reset_timeout = \
+        constants.DEFAULT_CIRCUIT_BREAKER_RESET_TIMEOUT
+    generation_timeout = None
+    generation_timeout_fallback = 'key'
+    generation_max_concurrency = None
+    generation_max_pixels = None
+    generation_queue = False
+    generation_max_retries = constants.DEFAULT_GENERATION_MAX_RETRIES
+    worker_concurrency = constants.DEFAULT_WORKER_CONCURRENCY
+    bloom_filter = None
+    bloom_filter_path = None
+    bloom_filter_capacity = constants.DEFAULT_BLOOM_FILTER_CAPACITY
+    bloom_filter_error_rate = constants.DEFAULT_BLOOM_FILTER_ERROR_RATE
     s3_access_key = None
     s3_secret_key = None
     s3_bucket = None
     s3_region = None
+    s3_multipart_threshold = constants.DEFAULT_S3_MULTIPART_THRESHOLD
+    s3_multipart_chunksize = constants.DEFAULT_S3_MULTIPART_CHUNKSIZE
+    s3_max_concurrency = constants.DEFAULT_S3_MAX_CONCURRENCY
+    s3_timeout = None
+    s3_max_pool_connections = constants.DEFAULT_S3_MAX_POOL_CONNECTIONS
+    s3_max_retries = None
+    s3_tcp_keepalive = False
+    source_cache_path = None
+    source_cache_max_bytes = constants.DEFAULT_SOURCE_CACHE_MAX_BYTES
+    write_behind_root = None
+    write_behind_url = None
+    write_behind_batch_size = constants.DEFAULT_WRITE_BEHIND_BATCH_SIZE
+    write_behind_max_retries = constants.DEFAULT_WRITE_BEHIND_MAX_RETRIES
+    write_behind_local_ttl = constants.DEFAULT_WRITE_BEHIND_LOCAL_TTL
 
     def __init__(self, **config):
         for key, val in config.items():
@@ -4,9 +4,138 @@ DEFAULT_NAME_HASHING_METHOD = 'sha1'
 DEFAULT_TARGET_DIRECTORY = 'resized-images'
 """Default target directory for generated images"""
 
+DEFAULT_SOURCE_INDEX_DIRECTORY = 'resized-images-index'
+"""
+Default directory for the index of each source image's generated images,
+when the no-op cache is used
+"""
+
+DEFAULT_SHARD_DEPTH = 0
+"""Default number of sub-directory levels to spread generated images over"""
+
+DEFAULT_SHARD_WIDTH = 2
+"""Default number of hash characters per generated image sub-directory"""
+
 DEFAULT_REDIS_KEY = 'flask-resize'
 """Default key to store redis cache as"""
 
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+"""Default size in bytes of chunks when streaming data"""
+
+DEFAULT_FILE_MAX_CONCURRENCY = 8
+"""Default maximum number of threads used for bulk file operations"""
+
+DEFAULT_S3_MULTIPART_THRESHOLD = 8 * 1024 * 1024
+"""Default size in bytes from which S3 uploads use multipart uploads"""
+
+DEFAULT_S3_MULTIPART_CHUNKSIZE = 8 * 1024 * 1024
+"""Default size in bytes of each part in S3 multipart uploads"""
+
+DEFAULT_S3_MAX_CONCURRENCY = 10
+"""Default maximum number of concurrent S3 transfer threads"""
+
+DEFAULT_S3_MAX_POOL_CONNECTIONS = 50
+"""Default maximum number of connections kept open to S3"""
+
+DEFAULT_S3_SPOOL_SIZE = 8 * 1024 * 1024
+"""Default size in bytes up until which S3 downloads are kept in memory"""
+
+DEFAULT_SOURCE_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+"""Default maximum total size in bytes of locally kept source images"""
+
+DEFAULT_SOURCE_CACHE_LOW_WATER = 0.9
+"""
+Default fraction of the maximum size that locally kept source images are
+evicted down to, so that eviction doesn't run again on the next download
+"""
+
+DEFAULT_WRITE_BEHIND_BATCH_SIZE = 50
+"""Default maximum number of images copied to remote storage at once"""
+
+DEFAULT_WRITE_BEHIND_MAX_RETRIES = 5
+"""Default number of times to retry copying an image to remote storage"""
+
+DEFAULT_WRITE_BEHIND_RETRY_DELAY = 1
+"""Default number of seconds to wait after failing to copy an image"""
+
+DEFAULT_WRITE_BEHIND_LOCAL_TTL = 3600
+"""Default number of seconds to keep local copies of copied images for"""
+
+DEFAULT_S3_LIST_THRESHOLD = 1000
+"""
+Default number of keys sharing a directory from which existence is checked by
+listing the directory, instead of checking each key separately
+"""
+
+DEFAULT_SCANDIR_THRESHOLD = 16
+"""
+Default number of files sharing a directory from which existence is checked
+by scanning the directory, instead of checking each file separately
+"""
+
+DEFAULT_ACCESS_FLUSH_SIZE = 1000
+"""Default number of buffered image accesses that are written to the cache"""
+
+DEFAULT_ACCESS_FLUSH_INTERVAL = 60
+"""Default maximum number of seconds to buffer image accesses for"""
+
+DEFAULT_SQLITE_TIMEOUT = 5.0
+"""Default number of seconds to wait for the SQLite cache's write lock"""
+
+DEFAULT_SHARED_CACHE_SLOTS = 1048576
+"""Default number of keys that the shared memory cache can hold"""
+
+DEFAULT_SHARED_CACHE_TTL = 300
+"""Default number of seconds to keep keys in the shared memory cache"""
+
+DEFAULT_GENERATE_IN_PROGRESS_TIMEOUT = 0
+"""
+Default number of seconds to wait for an image that's being generated
+elsewhere. 0 turns it off.
+"""
+
+DEFAULT_GENERATION_THREADS = 8
+"""
+Number of threads that generate images in the background, when
+`RESIZE_GENERATION_TIMEOUT` is set
+"""
+
+DEFAULT_GENERATION_MAX_RETRIES = 3
+"""Default number of times to retry a failing queued generation"""
+
+DEFAULT_GENERATION_LEASE_TIME = 60
+"""
+Default number of seconds that a generation worker is considered alive
+after its last heartbeat
+"""
+
+DEFAULT_GENERATION_QUEUED_TTL = 6 * 60 * 60
+"""
+Default number of seconds that a queued image isn't queued again for, in
+case its job is lost before it's finished
+"""
+
+DEFAULT_WORKER_CONCURRENCY = 4
+"""Default number of images that a worker generates at the same time"""
+
+DEFAULT_CIRCUIT_BREAKER_THRESHOLD = 5
+"""Default number of consecutive failures that opens a circuit breaker"""
+
+DEFAULT_CIRCUIT_BREAKER_RESET_TIMEOUT = 30
+"""Default number of seconds before an open circuit breaker is probed"""
+
+DEFAULT_MISSING_SOURCE_TTL = 0
+"""
+Default number of seconds to remember that a source image is missing for.
+0 turns it off.
+"""
+
+DEFAULT_BLOOM_FILTER_CAPACITY = 1000000
+"""Default number of generated images that the Bloom filter is sized for"""
+
+DEFAULT_BLOOM_FILTER_ERROR_RATE = 0.01
+"""Default false positive rate of the Bloom filter, when at capacity"""
+
 JPEG = 'JPEG'
 """JPEG format"""
 
@@ -33,6 +33,14 @@ class GenerateInProgress(RuntimeError):
     """The image is currently being generated"""
 
 
+class GenerationTimeout(RuntimeError):
+    """Generating the image took too long, it's finished in the background"""
+
+
+class CircuitOpenError(RuntimeError):
+    """A backend is failing, and isn't called until it's probed again"""
+
+
 class CairoSVGImportError(ImportError):
     """
     Raised when an SVG input file is encountered but CairoSVG is not
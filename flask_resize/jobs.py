@@ -0,0 +1,362 @@
+import json
+import logging
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from . import _compat, constants, exc
+
+logger = logging.getLogger('flask_resize')
+
+
+def make(config, cache_store=None):
+    """Generate job queue from supplied config
+
+    Args:
+        config (dict):
+            The config to extract settings from
+        cache_store (Any[cache.Cache, None]):
+            The cache store, whose Redis connection is reused if available.
+
+    Returns:
+        Any[RedisJobQueue, None]:
+            A :class:`RedisJobQueue`, or None if `RESIZE_GENERATION_QUEUE`
+            isn't enabled.
+    """
+    if not config.generation_queue:
+        return None
+    return RedisJobQueue(
+        host=getattr(cache_store, 'redis', None) or config.redis_host,
+        port=config.redis_port,
+        db=config.redis_db,
+        password=config.redis_password,
+        key='-'.join([config.redis_key, 'jobs']),
+        max_retries=config.generation_max_retries,
+    )
+
+
+class Job:
+    """An image waiting to be generated
+
+    Args:
+        unique_key (str):
+            Key of the image to generate
+        args (dict):
+            Keyword arguments for :meth:`resizing.Resizer._make_target`
+        attempts (int):
+            Number of times generating the image has failed
+    """
+
+    def __init__(self, unique_key, args, attempts=0, payload=None):
+        self.unique_key = unique_key
+        self.args = args
+        self.attempts = attempts
+        self.payload = payload
+
+    @classmethod
+    def loads(cls, payload):
+        """Create a job from its serialized form, as kept in the queue"""
+        data = json.loads(
+            payload.decode('utf-8') if isinstance(payload, bytes) else payload
+        )
+        return cls(data['key'], data['args'], data['attempts'], payload)
+
+    def dumps(self):
+        """Serialize the job, to keep it in the queue"""
+        return json.dumps(dict(
+            key=self.unique_key,
+            args=self.args,
+            attempts=self.attempts,
+        ), sort_keys=True)
+
+
+class RedisJobQueue:
+    """A reliable queue of images to generate, kept in Redis lists
+
+    Jobs are moved to a list of the worker that's processing them until
+    they're acknowledged, and put back in the queue if the worker stops
+    sending heartbeats before then.
+
+    Args:
+        host (Any[str, redis.StrictRedis]):
+            Redis host, or a pre-configured Redis client.
+        key (str):
+            The key to keep the queue at. Other keys are prefixed with it.
+        max_retries (int):
+            Number of times to retry a failing job, before it's moved to
+            the list of failed jobs.
+        lease_time (int):
+            Number of seconds that a worker is considered alive after its
+            last heartbeat.
+        queued_ttl (int):
+            Number of seconds that a queued image isn't queued again for,
+            unless its job is finished or given up on before then. Only a
+            safety net for jobs that are lost, so it's long.
+    """
+
+    def __init__(
+        self,
+        host='localhost',
+        port=6379,
+        db=0,
+        password=None,
+        key='-'.join([constants.DEFAULT_REDIS_KEY, 'jobs']),
+        max_retries=constants.DEFAULT_GENERATION_MAX_RETRIES,
+        lease_time=constants.DEFAULT_GENERATION_LEASE_TIME,
+        queued_ttl=constants.DEFAULT_GENERATION_QUEUED_TTL,
+    ):
+        if _compat.redis is None:
+            raise exc.RedisImportError(
+                "Redis must be installed for Redis support. "
+                "Package found @ https://pypi.python.org/pypi/redis."
+            )
+        self.key = key
+        self.failed_key = '-'.join([key, 'failed'])
+        self.max_retries = max_retries
+        self.lease_time = lease_time
+        self.queued_ttl = queued_ttl
+
+        if isinstance(host, _compat.string_types):
+            self.redis = _compat.redis.StrictRedis(
+                host=host,
+                port=port,
+                db=db,
+                password=password,
+            )
+        else:
+            self.redis = host
+
+    def _get_queued_key(self, unique_key):
+        return '-queued-'.join([self.key, unique_key])
+
+    def _get_processing_key(self, worker_id):
+        return '-processing-'.join([self.key, worker_id])
+
+    def _get_heartbeat_key(self, worker_id):
+        return '-worker-'.join([self.key, worker_id])
+
+    def push(self, unique_key, args):
+        """Queue an image for generation
+
+        Args:
+            unique_key (str): Key of the image to generate
+            args (dict): Arguments to generate it with
+
+        Returns:
+            bool: Whether the job was queued, or already was queued
+        """
+        if not self.redis.set(
+            self._get_queued_key(unique_key), 1,
+            nx=True, ex=self.queued_ttl,
+        ):
+            return False
+        self.redis.lpush(self.key, Job(unique_key, args).dumps())
+        return True
+
+    def pop(self, worker_id, timeout=None):
+        """Take the next job off the queue
+
+        Args:
+            worker_id (str):
+                The worker that takes the job. Has to :meth:`ack` or
+                :meth:`retry` it when done.
+            timeout (Any[int, None]):
+                Number of seconds to wait for a job. Doesn't wait if None.
+
+        Returns:
+            Any[Job, None]: The job, or None if there wasn't one
+        """
+        processing_key = self._get_processing_key(worker_id)
+        if timeout is None:
+            payload = self.redis.rpoplpush(self.key, processing_key)
+        else:
+            payload = self.redis.brpoplpush(
+                self.key, processing_key, timeout=timeout
+            )
+        return Job.loads(payload) if payload is not None else None
+
+    def ack(self, worker_id, job):
+        """Remove a finished job
+
+        Args:
+            worker_id (str): The worker that took the job
+            job (Job): The job
+        """
+        pipe = self.redis.pipeline()
+        pipe.lrem(self._get_processing_key(worker_id), 1, job.payload)
+        pipe.delete(self._get_queued_key(job.unique_key))
+        pipe.execute()
+
+    def retry(self, worker_id, job):
+        """Put a failed job back in the queue
+
+        Args:
+            worker_id (str): The worker that took the job
+            job (Job): The job
+
+        Returns:
+            bool:
+                Whether the job was queued again, or was given up on after
+                too many attempts
+        """
+        attempt = Job(job.unique_key, job.args, job.attempts + 1)
+        retried = attempt.attempts <= self.max_retries
+        pipe = self.redis.pipeline()
+        pipe.lrem(self._get_processing_key(worker_id), 1, job.payload)
+        if retried:
+            pipe.lpush(self.key, attempt.dumps())
+        else:
+            pipe.lpush(self.failed_key, attempt.dumps())
+            pipe.delete(self._get_queued_key(job.unique_key))
+        pipe.execute()
+        return retried
+
+    def heartbeat(self, worker_id):
+        """Mark the worker as alive, for another `lease_time` seconds
+
+        Args:
+            worker_id (str): The worker
+        """
+        self.redis.set(
+            self._get_heartbeat_key(worker_id), 1, ex=self.lease_time
+        )
+
+    def recover(self):
+        """Put jobs taken by workers that have stopped back in the queue
+
+        Returns:
+            int: Number of jobs put back
+        """
+        prefix = self._get_processing_key('')
+        count = 0
+        for processing_key in self.redis.scan_iter(match=prefix + '*'):
+            if isinstance(processing_key, bytes):
+                processing_key = processing_key.decode()
+            worker_id = processing_key[len(prefix):]
+            if self.redis.exists(self._get_heartbeat_key(worker_id)):
+                continue
+            while self.redis.rpoplpush(processing_key, self.key) is not None:
+                count += 1
+        if count:
+            logger.warning('Recovered {} unfinished jobs'.format(count))
+        return count
+
+    def __len__(self):
+        return self.redis.llen(self.key)
+
+    def failed(self):
+        """List the jobs that were given up on
+
+        Returns:
+            List[Job]: The failed jobs, most recent first
+        """
+        return [
+            Job.loads(v) for v in self.redis.lrange(self.failed_key, 0, -1)
+        ]
+
+
+class Worker:
+    """Generates the images queued by a :class:`resizing.Resizer`
+
+    Args:
+        resizer (resizing.Resizer):
+            Used to generate the images
+        job_queue (RedisJobQueue):
+            The queue to take jobs from
+        concurrency (int):
+            Number of images to generate at the same time
+        recover_interval (Any[float, None]):
+            Number of seconds between putting back the jobs of workers that
+            have stopped. Defaults to the queue's `lease_time`.
+    """
+
+    def __init__(
+        self,
+        resizer,
+        job_queue,
+        concurrency=constants.DEFAULT_WORKER_CONCURRENCY,
+        recover_interval=None,
+    ):
+        self.resizer = resizer
+        self.job_queue = job_queue
+        self.concurrency = concurrency
+        self.recover_interval = job_queue.lease_time \
+            if recover_interval is None else recover_interval
+        self.worker_id = uuid.uuid4().hex
+
+    def _process(self, job):
+        try:
+            if (
+                self.resizer.cache_store.exists(job.unique_key) or
+                self.resizer.storage_backend.exists(job.unique_key)
+            ):
+                # Queued again after an earlier job was lost, and generated
+                # since
+                self.job_queue.ack(self.worker_id, job)
+                return job, None
+            target = self.resizer._make_target(**job.args)
+            target.generate_view()
+        except exc.GenerateInProgress:
+            # Someone else is already on it
+            self.job_queue.ack(self.worker_id, job)
+            return job, None
+        except (exc.ImageNotFoundError, exc.InvalidResizeSettingError) as e:
+            # Retrying won't help
+            logger.error('Failed to generate {}: {}'.format(
+                job.unique_key, e
+            ))
+            self.job_queue.ack(self.worker_id, job)
+            return job, e
+        except Exception as e:
+            logger.exception('Failed to generate {}'.format(job.unique_key))
+            self.job_queue.retry(self.worker_id, job)
+            return job, e
+        else:
+            self.job_queue.ack(self.worker_id, job)
+            return job, None
+
+    def run(self, burst=False):
+        """Process jobs until stopped
+
+        Args:
+            burst (bool):
+                Stop when there are no more jobs, instead of waiting for
+                new ones.
+
+        Returns:
+            Generator[Tuple[Job, Any[Exception, None]], None, None]:
+                Yields each processed job, and the error that made it fail
+        """
+        self.job_queue.heartbeat(self.worker_id)
+        self.job_queue.recover()
+        recovered_at = time.time()
+        in_flight = set()
+        with ThreadPoolExecutor(self.concurrency) as executor:
+            while True:
+                self.job_queue.heartbeat(self.worker_id)
+                # Other workers can stop at any time, not just before this
+                # one starts
+                if time.time() - recovered_at >= self.recover_interval:
+                    self.job_queue.recover()
+                    recovered_at = time.time()
+                job = None
+                if len(in_flight) < self.concurrency:
+                    job = self.job_queue.pop(
+                        self.worker_id,
+                        timeout=None if burst or in_flight else 1,
+                    )
+                    if job is not None:
+                        in_flight.add(executor.submit(self._process, job))
+                    elif burst and not in_flight:
+                        return
+
+                if not in_flight:
+                    continue
+                has_capacity = len(in_flight) < self.concurrency
+                done, in_flight = wait(
+                    in_flight,
+                    timeout=0 if job is not None and has_capacity else 1,
+                    return_when=FIRST_COMPLETED,
+                )
+                for future in done:
+                    yield future.result()
@@ -1,14 +1,17 @@
-import hashlib
+import concurrent.futures
+import contextlib
 import io
 import logging
 import os
+import sys
+import threading
 
 import pilkit.processors
 import pilkit.utils
 from flask import current_app
 from PIL import Image, ImageColor, ImageDraw, ImageFont
 
-from . import cache, constants, exc, storage, utils
+from . import bloom, cache, constants, exc, jobs, scheduler, storage, utils
 from ._compat import b, cairosvg
 from .configuration import Config
 
@@ -134,6 +137,15 @@ class ResizeTarget:
         cache_store=cache.NoopCache(),
         target_directory=constants.DEFAULT_TARGET_DIRECTORY,
         use_placeholder=False,
+        shard_depth=constants.DEFAULT_SHARD_DEPTH,
+        shard_width=constants.DEFAULT_SHARD_WIDTH,
+        track_access=False,
+        existence_filter=None,
+        missing_source_ttl=constants.DEFAULT_MISSING_SOURCE_TTL,
+        cache_breaker=None,
+        storage_breaker=None,
+        scheduler=None,
+        priority=0,
     ):
         self.source_image_relative_url = source_image_relative_url
         self.use_placeholder = use_placeholder
@@ -152,9 +164,18 @@ class ResizeTarget:
         self.progressive = progressive
         self.name_hashing_method = name_hashing_method
         self.target_directory = target_directory
+        self.shard_depth = shard_depth
+        self.shard_width = shard_width
+        self.track_access = track_access
+        self.missing_source_ttl = missing_source_ttl
 
         self.image_store = image_store
         self.cache_store = cache_store
+        self.existence_filter = existence_filter
+        self.cache_breaker = cache_breaker
+        self.storage_breaker = storage_breaker
+        self.scheduler = scheduler
+        self.priority = priority
 
         self._validate_arguments()
         self.unique_key = self._generate_unique_key()
@@ -186,37 +207,162 @@ class ResizeTarget:
 
     def _generate_unique_key(self):
         cache_key_args = self._get_generate_unique_key_args()
-        hash = hashlib.new(self.name_hashing_method)
+        hash = utils.new_hash(self.name_hashing_method)
         hash.update(b(''.join(str(a) for a in cache_key_args)))
-        name = hash.hexdigest()
-        return '.'.join([
-            '/'.join([self.target_directory, name]),
-            self.file_extension
+        filename = '.'.join([hash.hexdigest(), self.file_extension])
+        return '/'.join([
+            self.target_directory,
+            utils.shard_path(filename, self.shard_depth, self.shard_width),
         ])
 
+    def _call_cache(self, default, method, *args, **kwargs):
+        """Call a cache store method, or return `default` if it's down"""
+        fn = getattr(self.cache_store, method)
+        if self.cache_breaker is None:
+            return fn(*args, **kwargs)
+        try:
+            return self.cache_breaker.call(fn, *args, **kwargs)
+        except exc.CircuitOpenError:
+            return default
+        except Exception as e:
+            # Counted by the breaker, until it opens
+            logger.warning(
+                'Cache store call `{}` failed, using {!r}: {}'
+                .format(method, default, e)
+            )
+            return default
+
+    def _call_storage(self, method, *args):
+        """Call a storage backend method, through its circuit breaker"""
+        fn = getattr(self.image_store, method)
+        if self.storage_breaker is None:
+            return fn(*args)
+        return self.storage_breaker.call(fn, *args)
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """The cache store's transaction, or none if it's down"""
+        if self.cache_breaker is None:
+            with self.cache_store.transaction(
+                self.unique_key
+            ) as transaction_successful:
+                yield transaction_successful
+            return
+
+        def enter():
+            transaction = self.cache_store.transaction(self.unique_key)
+            return transaction, transaction.__enter__()
+
+        try:
+            transaction, transaction_successful = \
+                self.cache_breaker.call(enter)
+        except Exception as e:
+            logger.warning(
+                'Generating {} without a transaction, as the cache store '
+                'is unavailable: {}'.format(self.unique_key, e)
+            )
+            yield True
+            return
+
+        try:
+            yield transaction_successful
+        except Exception:
+            if not transaction.__exit__(*sys.exc_info()):
+                raise
+        else:
+            transaction.__exit__(None, None, None)
+
     def get_cached_path(self):
-        if self.cache_store.exists(self.unique_key):
+        if self._call_cache(False, 'exists', self.unique_key):
             logger.debug('Fetched from cache: {}'.format(self.unique_key))
+            if self.track_access:
+                self._call_cache(False, 'touch', self.unique_key)
             return self.unique_key
         else:
             msg = '`{}` is not cached.'.format(self.unique_key)
             logger.debug(msg)
             raise exc.CacheMiss(msg)
 
+    def source_is_missing(self):
+        """Check whether the source image was recently found to be missing
+
+        Always False unless `missing_source_ttl` is set.
+
+        Returns:
+            bool: Whether the source image is known to be missing
+        """
+        return bool(
+            self.missing_source_ttl and
+            self.source_image_relative_url and
+            self._call_cache(
+                False, 'is_missing', self.source_image_relative_url
+            )
+        )
+
+    def check_source(self):
+        """Fail early if the source image is known to be missing
+
+        When a placeholder is used, it's looked up and generated like any
+        other image instead, without reading the source image again.
+
+        Raises:
+            :class:`exc.ImageNotFoundError`:
+                If the source image is known to be missing, and no
+                placeholder is used.
+        """
+        if not self.use_placeholder and self.source_is_missing():
+            raise exc.ImageNotFoundError(self.source_image_relative_url)
+
     def get_path(self):
-        if self.image_store.exists(self.unique_key):
-            # As the generated image might've been created on another instance,
-            # we'll store the path in cache key here so we won't have to
-            # manually check the path again.
-            self.cache_store.add(self.unique_key)
+        if (
+            self.existence_filter is not None and
+            not self.existence_filter.might_contain(self.unique_key)
+        ):
+            logger.debug(
+                'Skipped existence check for: {}'.format(self.unique_key)
+            )
+            raise exc.ImageNotFoundError(self.unique_key)
 
-            logger.debug('Found non-cached image: {}'.format(self.unique_key))
-            return self.unique_key
-        else:
+        if self.track_access:
+            # Looking up the size is as cheap as checking for existence, and
+            # eviction needs it
+            try:
+                size = self._call_storage('size', self.unique_key)
+            except exc.ImageNotFoundError:
+                raise exc.ImageNotFoundError(self.unique_key)
+        elif not self._call_storage('exists', self.unique_key):
             raise exc.ImageNotFoundError(self.unique_key)
 
+        # As the generated image might've been created on another instance,
+        # we'll store the path in cache key here so we won't have to
+        # manually check the path again.
+        self._call_cache(False, 'add', self.unique_key)
+        if self.track_access:
+            self._call_cache(False, 'touch', self.unique_key, size=size)
+
+        logger.debug('Found non-cached image: {}'.format(self.unique_key))
+        return self.unique_key
+
+    @property
+    def job_args(self):
+        """Arguments for :meth:`Resizer._make_target` to re-create this"""
+        return dict(
+            image_url=self.source_image_relative_url,
+            dimensions=(
+                [self.width, self.height]
+                if self.width or self.height else None
+            ),
+            format=self.format,
+            quality=self.quality,
+            fill=self.fill,
+            bgcolor=self.bgcolor,
+            upscale=self.upscale,
+            progressive=self.progressive,
+            placeholder=self.use_placeholder,
+        )
+
     def get_generated_image(self):
-        return self.image_store.get(self.unique_key)
+        return self._call_storage('get', self.unique_key)
 
     @property
     def source_format(self):
@@ -228,27 +374,59 @@ class ResizeTarget:
             assert fmt.startswith('.')
             return fmt[1:].upper()
 
-    def _generate_impl(self):
+    def _open_source(self):
+        if self.source_is_missing():
+            raise exc.ImageNotFoundError(self.source_image_relative_url)
         try:
-            source_data = self.image_store.get(
-                self.source_image_relative_url
-            )
+            return self._call_storage('open', self.source_image_relative_url)
         except exc.ImageNotFoundError:
-            if self.use_placeholder:
-                source_data = self.generate_placeholder(
-                    'Source image `{}` not found'.format(
-                        self.source_image_relative_url
-                    )
+            if self.missing_source_ttl and self.source_image_relative_url:
+                self._call_cache(
+                    False, 'mark_missing',
+                    self.source_image_relative_url,
+                    self.missing_source_ttl,
                 )
-            else:
-                raise
+            raise
+
+    def _get_placeholder_source(self):
+        return io.BytesIO(self.generate_placeholder(
+            'Source image `{}` not found'.format(
+                self.source_image_relative_url
+            ) if self.source_image_relative_url else None
+        ))
 
-        if self.source_format == constants.SVG:
-            img = convert_svg(source_data)
+    def _generate_impl(self, source=None):
+        if source is None:
+            try:
+                source = self._open_source()
+            except exc.ImageNotFoundError:
+                if self.use_placeholder:
+                    source = self._get_placeholder_source()
+                else:
+                    raise
+
+        with contextlib.closing(source):
+            if self.source_format == constants.SVG:
+                # Rendered at its own size, which isn't known up front
+                with self._admit((self.width or 0) * (self.height or 0)):
+                    return self._process(convert_svg(source.read()))
+            else:
+                # Only reads the header, which has the image's size
+                img = Image.open(source)
+                with self._admit(img.size[0] * img.size[1]):
+                    # Decode while the source is still open
+                    img.load()
+                    return self._process(img)
+
+    @contextlib.contextmanager
+    def _admit(self, pixels):
+        if self.scheduler is None:
+            yield
         else:
-            fp = io.BytesIO(source_data)
-            img = Image.open(fp)
+            with self.scheduler.admit(pixels, priority=self.priority):
+                yield
 
+    def _process(self, img):
         if self.width or self.height:
             resize_to_fit_kw = dict(
                 width=self.width,
@@ -284,12 +462,37 @@ class ResizeTarget:
         save_kwargs.update(options)
         options = save_kwargs
 
-        return image_data(img, self.format, **options)
+        # Kept in the buffer, which is passed directly to the storage backend
+        fp = io.BytesIO()
+        img.save(fp, self.format, **options)
+        fp.seek(0)
+        return fp
 
     def generate(self):
-        with self.cache_store.transaction(
-            self.unique_key
-        ) as transaction_successful:
+        """Generate the image and save it to the storage backend
+
+        Raises:
+            :class:`exc.GenerateInProgress`:
+                If the image is already being generated elsewhere.
+
+        Returns:
+            bytes: The generated image's data
+        """
+        return bytes(self.generate_view())
+
+    def generate_view(self):
+        """Same as :meth:`generate`, without copying the generated data
+
+        Raises:
+            :class:`exc.GenerateInProgress`:
+                If the image is already being generated elsewhere.
+
+        Returns:
+            Any[memoryview, bytes]:
+                A view of the generated image's data. Python 2 doesn't
+                support buffer views, so it's bytes there.
+        """
+        with self._transaction() as transaction_successful:
 
             if transaction_successful:
                 logger.info('Generating image: {}'.format(self.unique_key))
@@ -300,8 +503,15 @@ class ResizeTarget:
                 raise exc.GenerateInProgress(self.unique_key)
 
             try:
-                data = self._generate_impl()
-                self.image_store.save(self.unique_key, data)
+                buf = self._generate_impl()
+                self._call_storage('save', self.unique_key, buf)
+            except exc.FileExistsError:
+                # Generated elsewhere, without our existence check noticing.
+                # Keep the existing image.
+                logger.info('Image already exists: {}'.format(self.unique_key))
+                self._call_cache(False, 'add', self.unique_key)
+                if self.existence_filter is not None:
+                    self.existence_filter.add(self.unique_key)
             except Exception as e:
                 logger.info(
                     'Exception occurred - removing {} from cache and '
@@ -310,7 +520,7 @@ class ResizeTarget:
                 )
 
                 try:
-                    self.image_store.delete(self.unique_key)
+                    self._call_storage('delete', self.unique_key)
                 except Exception as e2:
                     logger.warning(
                         'Another exception occurred while doing error cleanup '
@@ -319,12 +529,26 @@ class ResizeTarget:
                     )
                     pass
 
-                self.cache_store.remove(self.unique_key)
+                self._call_cache(False, 'remove', self.unique_key)
 
                 raise e
             else:
-                self.cache_store.add(self.unique_key)
-            return data
+                self._call_cache(False, 'add', self.unique_key)
+                if self.existence_filter is not None:
+                    self.existence_filter.add(self.unique_key)
+                if self.track_access:
+                    self._call_cache(
+                        False, 'touch',
+                        self.unique_key,
+                        size=len(utils.buffer_view(buf)),
+                    )
+                if self.source_image_relative_url:
+                    self._call_cache(
+                        False, 'add_variant',
+                        self.source_image_relative_url,
+                        self.unique_key,
+                    )
+            return utils.buffer_view(buf)
 
     def generate_placeholder(self, message):
         img = create_placeholder_image(self.width, self.height, message)
@@ -334,6 +558,8 @@ class ResizeTarget:
 class Resizer:
     """Factory for creating the resize function"""
 
+    generation_timeout_fallbacks = ('key', 'original', 'placeholder')
+
     def __init__(
         self,
         storage_backend,
@@ -342,17 +568,70 @@ class Resizer:
         name_hashing_method=constants.DEFAULT_NAME_HASHING_METHOD,
         target_directory=constants.DEFAULT_TARGET_DIRECTORY,
         raise_on_generate_in_progress=False,
-        noop=False
+        noop=False,
+        shard_depth=constants.DEFAULT_SHARD_DEPTH,
+        shard_width=constants.DEFAULT_SHARD_WIDTH,
+        track_access=False,
+        existence_filter=None,
+        missing_source_ttl=constants.DEFAULT_MISSING_SOURCE_TTL,
+        job_queue=None,
+        generate_in_progress_timeout=(
+            constants.DEFAULT_GENERATE_IN_PROGRESS_TIMEOUT
+        ),
+        generation_timeout=None,
+        generation_timeout_fallback='key',
+        cache_breaker=None,
+        storage_breaker=None,
+        scheduler=None,
     ):
+        if generation_timeout_fallback not in \
+                self.generation_timeout_fallbacks:
+            raise exc.InvalidResizeSettingError(
+                'Non-supported generation timeout fallback: "{}"'
+                .format(generation_timeout_fallback)
+            )
         self.storage_backend = storage_backend
         self.cache_store = cache_store
         self.base_url = base_url
         self.name_hashing_method = name_hashing_method
         self.target_directory = target_directory
+        self.shard_depth = shard_depth
+        self.shard_width = shard_width
+        self.track_access = track_access
+        self.existence_filter = existence_filter
+        self.missing_source_ttl = missing_source_ttl
+        self.job_queue = job_queue
         self.raise_on_generate_in_progress = raise_on_generate_in_progress
+        self.generate_in_progress_timeout = generate_in_progress_timeout
+        self.generation_timeout = generation_timeout
+        self.generation_timeout_fallback = generation_timeout_fallback
+        self.cache_breaker = cache_breaker
+        self.storage_breaker = storage_breaker
+        self.scheduler = scheduler
         self.noop = noop
+        self._single_flight = utils.SingleFlight()
+        self._executor = None
+        self._executor_pid = None
+        self._executor_lock = threading.Lock()
         self._fix_base_url()
 
+    @property
+    def executor(self):
+        """
+        Thread pool that generates images when `generation_timeout` is set.
+        Lazily (re-)created, as threads don't survive a fork.
+
+        Returns:
+            concurrent.futures.ThreadPoolExecutor: The executor
+        """
+        with self._executor_lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=constants.DEFAULT_GENERATION_THREADS
+                )
+                self._executor_pid = os.getpid()
+            return self._executor
+
     def _fix_base_url(self):
         if not self.base_url.endswith('/'):
             self.base_url += '/'
@@ -433,10 +712,54 @@ class Resizer:
         if self.noop:
             return image_url
 
+        target = self._make_target(
+            image_url,
+            dimensions=dimensions,
+            format=format,
+            quality=quality,
+            fill=fill,
+            bgcolor=bgcolor,
+            upscale=upscale,
+            progressive=progressive,
+            placeholder=placeholder,
+        )
+
+        try:
+            relative_url = target.get_cached_path()
+        except exc.CacheMiss:
+            target.check_source()
+            try:
+                relative_url = target.get_path()
+            except exc.ImageNotFoundError:
+                relative_url = self._generate(target)
+            except exc.CircuitOpenError:
+                # Storage backend is down, assume it's been generated
+                relative_url = target.unique_key
+
+        return self._get_url(relative_url)
+
+    def _get_url(self, relative_url):
+        """Make an absolute URL of a URL relative to `base_url`"""
+        base_url = self.storage_backend.get_base_url(relative_url)
+        return os.path.join(base_url or self.base_url, relative_url)
+
+    def _make_target(
+        self,
+        image_url,
+        dimensions=None,
+        format=None,
+        quality=80,
+        fill=False,
+        bgcolor=None,
+        upscale=True,
+        progressive=True,
+        placeholder=False,
+        priority=0,
+    ):
         if image_url and image_url.startswith(self.base_url):
             image_url = image_url[len(self.base_url):]
 
-        target = ResizeTarget(
+        return ResizeTarget(
             self.storage_backend,
             image_url,
             dimensions=dimensions,
@@ -450,37 +773,307 @@ class Resizer:
             cache_store=self.cache_store,
             name_hashing_method=self.name_hashing_method,
             target_directory=self.target_directory,
+            shard_depth=self.shard_depth,
+            shard_width=self.shard_width,
+            track_access=self.track_access,
+            existence_filter=self.existence_filter,
+            missing_source_ttl=self.missing_source_ttl,
+            cache_breaker=self.cache_breaker,
+            storage_breaker=self.storage_breaker,
+            scheduler=self.scheduler,
+            priority=priority,
         )
 
+    def invalidate(self, image_url):
+        """Delete all images generated from an image
+
+        Useful when the original image has been replaced or removed.
+
+        Args:
+            image_url (str):
+                URL for the original image. A URL relative to `base_url`
+
+        Returns:
+            List[str]: Keys of the deleted images
+        """
+        if image_url and image_url.startswith(self.base_url):
+            image_url = image_url[len(self.base_url):]
+
+        unique_keys = self.cache_store.variants(image_url)
+        deleted = list(self.storage_backend.delete_many(unique_keys))
+        self.cache_store.remove_many(unique_keys)
+        self.cache_store.remove_variants(image_url)
+        if self.missing_source_ttl:
+            self.cache_store.unmark_missing(image_url)
+        logger.info('Invalidated {} images generated from: {}'.format(
+            len(deleted), image_url
+        ))
+        return deleted
+
+    def prune(self, max_bytes=None, max_count=None):
+        """
+        Delete the least recently used generated images until they fit
+        within the specified budget
+
+        Only images whose accesses are tracked (see `RESIZE_TRACK_ACCESS`)
+        are considered.
+
+        Args:
+            max_bytes (Any[int, None]):
+                Maximum total size in bytes of generated images to keep.
+            max_count (Any[int, None]):
+                Maximum number of generated images to keep.
+
+        Returns:
+            Generator[str, str, None]:
+                Yields the keys of deleted images
+        """
+        count, total_size = self.cache_store.usage()
+
+        def over_budget():
+            return (
+                (max_count is not None and count > max_count) or
+                (max_bytes is not None and total_size > max_bytes)
+            )
+
+        while over_budget():
+            evicted = []
+            for unique_key, size in self.cache_store.least_recently_used(
+                1000
+            ):
+                if not over_budget():
+                    break
+                evicted.append(unique_key)
+                count -= 1
+                total_size -= size
+            if not evicted:
+                break
+
+            for unique_key in self.storage_backend.delete_many(evicted):
+                yield unique_key
+            self.cache_store.remove_many(evicted)
+            self.cache_store.replace_variants(dict.fromkeys(evicted))
+            self.cache_store.forget(evicted)
+
+    def sharded_key(self, unique_key):
+        """
+        Get the key that a generated image's `unique_key` would have with
+        the current sharding settings
+
+        Args:
+            unique_key (str): Key of a generated image
+
+        Returns:
+            str: The key, in the currently configured directory layout
+        """
+        filename = unique_key.rpartition('/')[2]
+        return '/'.join([
+            self.target_directory,
+            utils.shard_path(filename, self.shard_depth, self.shard_width),
+        ])
+
+    def _generate(self, target):
+        """Generate `target` and return its relative URL"""
+        if self.job_queue is not None:
+            # A worker generates it, until then the URL won't work
+            self.job_queue.push(target.unique_key, target.job_args)
+            return target.unique_key
+
         try:
-            relative_url = target.get_cached_path()
-        except exc.CacheMiss:
+            self._run_generation(target)
+        except exc.CircuitOpenError:
+            return target.unique_key
+        except exc.GenerationTimeout:
+            logger.warning(
+                'Generation of {} exceeded {} seconds, using fallback: {}'
+                .format(
+                    target.unique_key,
+                    self.generation_timeout,
+                    self.generation_timeout_fallback,
+                )
+            )
+            return self._get_fallback_path(target)
+        except exc.GenerateInProgress:
+            if (
+                self.generate_in_progress_timeout and
+                self.cache_store.wait(
+                    target.unique_key,
+                    self.generate_in_progress_timeout,
+                )
+            ):
+                logger.debug(
+                    'Waited for generation of: {}'.format(target.unique_key)
+                )
+                return target.unique_key
+            elif self.raise_on_generate_in_progress:
+                raise
+            else:
+                return target.unique_key
+        else:
+            return target.get_path()
+
+    def _run_generation(self, target):
+        # Threads that miss on the same image share one generation
+        if not self.generation_timeout:
+            return self._single_flight.do(
+                target.unique_key, target.generate_view
+            )
+        # Keeps going in the background if it takes too long
+        future = self.executor.submit(
+            self._single_flight.do,
+            target.unique_key,
+            target.generate_view,
+        )
+        try:
+            return future.result(timeout=self.generation_timeout)
+        except concurrent.futures.TimeoutError:
+            if future.done():
+                # Finished just now, or timed out itself
+                return future.result()
+            raise exc.GenerationTimeout(target.unique_key)
+
+    def _get_fallback_path(self, target):
+        """Get the relative URL to use while `target` is being generated"""
+        if self.generation_timeout_fallback == 'original':
+            return target.source_image_relative_url
+        elif self.generation_timeout_fallback == 'placeholder' and (
+            target.width or target.height
+        ):
+            placeholder = self._make_target(
+                '',
+                dimensions=(target.width, target.height),
+                format=target.format,
+                placeholder=True,
+                # Small, and stands in for an image that's taking too long
+                priority=-1,
+            )
             try:
-                relative_url = target.get_path()
+                return placeholder.get_cached_path()
+            except exc.CacheMiss:
+                pass
+            try:
+                return placeholder.get_path()
             except exc.ImageNotFoundError:
-                try:
-                    target.generate()
-                except exc.GenerateInProgress:
-                    if self.raise_on_generate_in_progress:
-                        raise
-                    else:
-                        relative_url = target.unique_key
-                else:
-                    relative_url = target.get_path()
+                pass
+            try:
+                self._single_flight.do(
+                    placeholder.unique_key,
+                    placeholder.generate_view,
+                )
+            except exc.GenerateInProgress:
+                pass
+            return placeholder.unique_key
+        else:
+            return target.unique_key
+
+    def resize_many(self, image_urls, *args, **kwargs):
+        """Resize several images using the same arguments
+
+        Paths that aren't cached are checked for in the storage backend
+        with a single :meth:`storage.Storage.exists_many` call, instead of
+        one request per image.
 
-        return os.path.join(self.base_url, relative_url)
+        Args:
+            image_urls (Iterable[str]):
+                URLs for the images to resize.
+            *args, **kwargs:
+                Passed on to :meth:`__call__` for each image.
+
+        Returns:
+            List[str]:
+                URLs to the generated and cached images, in the same order
+                as `image_urls`.
+        """
+        image_urls = list(image_urls)
+
+        if self.noop:
+            return image_urls
+
+        targets = [
+            self._make_target(image_url, *args, **kwargs)
+            for image_url in image_urls
+        ]
+        relative_urls = {}
+        misses = []
+
+        for target in targets:
+            try:
+                relative_urls[target.unique_key] = target.get_cached_path()
+            except exc.CacheMiss:
+                target.check_source()
+                misses.append(target)
+
+        lookups = [
+            target.unique_key for target in misses
+            if self.existence_filter is None or
+            self.existence_filter.might_contain(target.unique_key)
+        ]
+        assumed = set()
+        try:
+            if self.storage_breaker is None:
+                existing = self.storage_backend.exists_many(lookups)
+            else:
+                existing = self.storage_breaker.call(
+                    self.storage_backend.exists_many, lookups
+                )
+        except exc.CircuitOpenError:
+            # Storage backend is down, assume they've been generated, but
+            # don't cache them as such
+            existing = set()
+            assumed = set(lookups)
+
+        for target in misses:
+            if target.unique_key in relative_urls:
+                # Same image passed in more than once
+                continue
+            elif target.unique_key in assumed:
+                relative_urls[target.unique_key] = target.unique_key
+            elif target.unique_key in existing:
+                target._call_cache(False, 'add', target.unique_key)
+                relative_urls[target.unique_key] = target.unique_key
+            else:
+                relative_urls[target.unique_key] = self._generate(target)
+
+        return [
+            self._get_url(relative_urls[target.unique_key])
+            for target in targets
+        ]
+
+
+def _make_breaker(config, name):
+    if not config.circuit_breaker_threshold:
+        return None
+    return utils.CircuitBreaker(
+        name,
+        failure_threshold=config.circuit_breaker_threshold,
+        reset_timeout=config.circuit_breaker_reset_timeout,
+    )
 
 
 def make_resizer(config):
     """Resizer instance factory"""
+    storage_backend = storage.make(config)
+    cache_store = cache.make(config, image_store=storage_backend)
     return Resizer(
-        storage_backend=storage.make(config),
-        cache_store=cache.make(config),
+        storage_backend=storage_backend,
+        cache_store=cache_store,
         base_url=config.url,
         name_hashing_method=config.hash_method,
         target_directory=config.target_directory,
         raise_on_generate_in_progress=config.raise_on_generate_in_progress,
+        generate_in_progress_timeout=config.generate_in_progress_timeout,
+        generation_timeout=config.generation_timeout,
+        generation_timeout_fallback=config.generation_timeout_fallback,
+        cache_breaker=_make_breaker(config, 'cache'),
+        storage_breaker=_make_breaker(config, 'storage'),
+        scheduler=scheduler.make(config),
         noop=config.noop,
+        shard_depth=config.shard_depth,
+        shard_width=config.shard_width,
+        track_access=config.track_access,
+        existence_filter=bloom.make(config, cache_store=cache_store),
+        missing_source_ttl=config.missing_source_ttl,
+        job_queue=jobs.make(config, cache_store=cache_store),
     )
 
 
@@ -0,0 +1,150 @@
+import contextlib
+import heapq
+import itertools
+import threading
+import time
+
+
+def make(config):
+    """Generate generation scheduler from supplied config
+
+    Args:
+        config (dict):
+            The config to extract settings from
+
+    Returns:
+        Any[Scheduler, None]:
+            A :class:`Scheduler`, or None if neither
+            `RESIZE_GENERATION_MAX_CONCURRENCY` nor
+            `RESIZE_GENERATION_MAX_PIXELS` is set.
+    """
+    if not config.generation_max_concurrency and \
+            not config.generation_max_pixels:
+        return None
+    return Scheduler(
+        max_concurrency=config.generation_max_concurrency,
+        max_pixels=config.generation_max_pixels,
+    )
+
+
+class Scheduler:
+    """Admits image generations in this process, within a budget
+
+    Generations wait in a queue until both fewer than `max_concurrency`
+    are running, and their decoded pixels fit in what's left of
+    `max_pixels`. A generation that's bigger than `max_pixels` on its own
+    is admitted once nothing else is running. The queue is ordered by
+    priority (lowest first), then by arrival, and only its head is
+    admitted, so that big images aren't starved by small ones.
+
+    Args:
+        max_concurrency (Any[int, None]):
+            Maximum number of generations to run at the same time. None
+            doesn't limit it.
+        max_pixels (Any[int, None]):
+            Maximum number of decoded pixels of the generations running at
+            the same time. None doesn't limit it.
+    """
+
+    def __init__(self, max_concurrency=None, max_pixels=None):
+        self.max_concurrency = max_concurrency
+        self.max_pixels = max_pixels
+        self._queue = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._running = 0
+        self._running_pixels = 0
+        self._stats = dict.fromkeys(['admitted', 'waited'], 0)
+        self._wait_time = 0.0
+        self._max_wait_time = 0.0
+
+    def _fits(self, pixels):
+        if self.max_concurrency and self._running >= self.max_concurrency:
+            return False
+        if self.max_pixels and self._running and \
+                self._running_pixels + pixels > self.max_pixels:
+            return False
+        return True
+
+    def acquire(self, pixels, priority=0):
+        """Wait until a generation is admitted
+
+        Has to be followed by :meth:`release` when the generation is done.
+
+        Args:
+            pixels (int): Estimated number of pixels the generation decodes
+            priority (int): Generations with lower values are admitted first
+        """
+        entry = (priority, next(self._counter))
+        start = time.time()
+        with self._cond:
+            heapq.heappush(self._queue, entry)
+            queued = False
+            try:
+                while self._queue[0] is not entry or not self._fits(pixels):
+                    queued = True
+                    self._cond.wait()
+            except BaseException:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                self._cond.notify_all()
+                raise
+            heapq.heappop(self._queue)
+            self._running += 1
+            self._running_pixels += pixels
+
+            waited = time.time() - start
+            self._stats['admitted'] += 1
+            if queued:
+                self._stats['waited'] += 1
+            self._wait_time += waited
+            self._max_wait_time = max(self._max_wait_time, waited)
+            # The next one in line might fit as well
+            self._cond.notify_all()
+
+    def release(self, pixels):
+        """Mark an admitted generation as done
+
+        Args:
+            pixels (int): What was passed to :meth:`acquire`
+        """
+        with self._cond:
+            self._running -= 1
+            self._running_pixels -= pixels
+            self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def admit(self, pixels, priority=0):
+        """Run the block once the generation is admitted
+
+        Args:
+            pixels (int): Estimated number of pixels the generation decodes
+            priority (int): Generations with lower values are admitted first
+        """
+        self.acquire(pixels, priority=priority)
+        try:
+            yield
+        finally:
+            self.release(pixels)
+
+    def stats(self):
+        """
+        Get the state of the queue, and how long generations waited in it
+
+        Returns:
+            Dict[str, Any[int, float]]:
+                Number of generations `running`, their `running_pixels`,
+                number of generations `queued`, total number `admitted`,
+                of which `waited` had to wait, and the `total_wait_time` and
+                `max_wait_time` in seconds.
+        """
+        with self._cond:
+            return dict(
+                running=self._running,
+                running_pixels=self._running_pixels,
+                queued=len(self._queue),
+                admitted=self._stats['admitted'],
+                waited=self._stats['waited'],
+                total_wait_time=self._wait_time,
+                max_wait_time=self._max_wait_time,
+            )
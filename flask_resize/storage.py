@@ -1,7 +1,21 @@
+import bisect
+import collections
+import errno
+import hashlib
+import io
+import logging
+import mmap
 import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-from . import exc, utils
-from ._compat import PY2, boto3, botocore, string_types
+from . import constants, exc, utils
+from ._compat import boto3, botocore, fcntl, queue, scandir, string_types
+
+logger = logging.getLogger('flask_resize')
 
 
 def make(config):
@@ -12,9 +26,12 @@ def make(config):
             The config to extract settings from
 
     Returns:
-        Any[FileStorage, S3Storage]:
+        Any[FileStorage, S3Storage, TieredStorage, SourceCacheStorage]:
             A :class:`Storage` sub-class, based on the `RESIZE_STORAGE_BACKEND`
-            value.
+            value. Wrapped in a :class:`TieredStorage` if
+            `RESIZE_WRITE_BEHIND_ROOT` is set, and in a
+            :class:`SourceCacheStorage` if `RESIZE_SOURCE_CACHE_PATH` is
+            set.
 
     Raises:
         RuntimeError: If another `RESIZE_STORAGE_BACKEND` value was set
@@ -36,6 +53,13 @@ def make(config):
             secret_key=config.s3_secret_key,
             bucket=config.s3_bucket,
             region_name=config.s3_region,
+            multipart_threshold=config.s3_multipart_threshold,
+            multipart_chunksize=config.s3_multipart_chunksize,
+            max_concurrency=config.s3_max_concurrency,
+            timeout=config.s3_timeout,
+            max_pool_connections=config.s3_max_pool_connections,
+            max_retries=config.s3_max_retries,
+            tcp_keepalive=config.s3_tcp_keepalive,
         )
         config.url = store.base_url
 
@@ -58,7 +82,11 @@ def make(config):
         if not config.root.endswith(os.sep):
             config.root = config.root + os.sep
 
-        store = FileStorage(base_path=config.root)
+        store = FileStorage(
+            base_path=config.root,
+            fsync=config.file_fsync,
+            max_concurrency=config.file_max_concurrency,
+        )
 
     else:
         raise RuntimeError(
@@ -66,27 +94,170 @@ def make(config):
             .format(config.storage_backend)
         )
 
+    if config.write_behind_root:
+        if not isinstance(config.write_behind_url, string_types):
+            raise RuntimeError(
+                'You must specify a valid RESIZE_WRITE_BEHIND_URL '
+                'when RESIZE_WRITE_BEHIND_ROOT is set.'
+            )
+        store = TieredStorage(
+            FileStorage(base_path=config.write_behind_root),
+            store,
+            config.write_behind_url,
+            batch_size=config.write_behind_batch_size,
+            max_retries=config.write_behind_max_retries,
+            local_ttl=config.write_behind_local_ttl,
+        )
+
+    if config.source_cache_path:
+        store = SourceCacheStorage(
+            store,
+            config.source_cache_path,
+            max_bytes=config.source_cache_max_bytes,
+        )
+
     return store
 
 
 class Storage:
     """Storage backend base class"""
 
+    max_concurrency = constants.DEFAULT_FILE_MAX_CONCURRENCY
+
     def __init__(self, *args, **kwargs):
-        pass
+        self._executor = None
+        self._executor_pid = None
+        self._executor_lock = threading.Lock()
+
+    @property
+    def executor(self):
+        """
+        Thread pool used for concurrent requests. Lazily (re-)created, as
+        threads don't survive a fork.
+
+        Returns:
+            concurrent.futures.ThreadPoolExecutor: The executor
+        """
+        with self._executor_lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_concurrency
+                )
+                self._executor_pid = os.getpid()
+            return self._executor
 
     def get(self, relative_path):
         raise NotImplementedError
 
+    def open(self, relative_path):
+        """Get a readable binary stream for specified key
+
+        Backends should override this when they can provide the data without
+        reading it all into memory first.
+
+        Args:
+            relative_path (str): The key to get data for
+
+        Returns:
+            A seekable file-like object, positioned at the start of the data
+        """
+        return io.BytesIO(self.get(relative_path))
+
     def save(self, relative_path, bdata):
         raise NotImplementedError
 
     def exists(self, relative_path):
         raise NotImplementedError
 
+    def etag(self, relative_path):
+        raise NotImplementedError
+
+    def size(self, relative_path):
+        """Get the size of the data at specified key
+
+        Backends should override this when they can get the size without
+        reading the data.
+
+        Args:
+            relative_path (str): The key to get the size of
+
+        Raises:
+            :class:`exc.ImageNotFoundError`: If the key doesn't exist
+
+        Returns:
+            int: The size in bytes
+        """
+        return len(self.get(relative_path))
+
+    def get_base_url(self, relative_path):
+        """Get the URL that specified key is served at, if not the default
+
+        Backends should override this when some keys are served elsewhere
+        than at `RESIZE_URL`.
+
+        Args:
+            relative_path (str): The key
+
+        Returns:
+            Any[str, None]: The base URL, or None to use the default
+        """
+        return None
+
+    def exists_many(self, relative_paths):
+        """Check which of the keys exist in the backend
+
+        Backends should override this when they can check several keys more
+        efficiently than one at a time.
+
+        Args:
+            relative_paths (Iterable[str]): The keys to check
+
+        Returns:
+            Set[str]: The keys that exist
+        """
+        return set(key for key in relative_paths if self.exists(key))
+
     def delete(self, relative_path):
         raise NotImplementedError
 
+    def delete_many(self, relative_paths):
+        """Delete data at the specified keys, ignoring missing keys
+
+        Backends should override this when they can delete several keys more
+        efficiently than one at a time.
+
+        Args:
+            relative_paths (Iterable[str]): The keys to delete
+
+        Returns:
+            Generator[str, str, None]:
+                Yields deleted keys
+        """
+        for key in relative_paths:
+            try:
+                self.delete(key)
+            except (exc.ImageNotFoundError, OSError) as e:
+                if getattr(e, 'errno', errno.ENOENT) != errno.ENOENT:
+                    raise
+            yield key
+
+    def move(self, relative_path, new_relative_path):
+        """Move data from one key to another
+
+        Backends should override this when they can move data without
+        downloading it.
+
+        Args:
+            relative_path (str): The key to move
+            new_relative_path (str): The key to move to
+        """
+        fp = self.open(relative_path)
+        try:
+            self.save(new_relative_path, fp)
+        finally:
+            fp.close()
+        self.delete(relative_path)
+
     def list_tree(self, subdir):
         raise NotImplementedError
 
@@ -106,11 +277,28 @@ class FileStorage(Storage):
         base_path (str):
             The directory where files will be read from and written to.
             Expected to use the local OS's path separator.
+        fsync (bool):
+            Whether to flush saved files to disk before they're published.
+            Defaults to False.
+        max_concurrency (int):
+            Maximum number of threads used to delete files in bulk.
 
     """
 
-    def __init__(self, base_path):
+    temp_file_prefix = '.flask-resize-'
+    temp_file_suffix = '.tmp'
+    scandir_threshold = constants.DEFAULT_SCANDIR_THRESHOLD
+
+    def __init__(
+        self,
+        base_path,
+        fsync=False,
+        max_concurrency=constants.DEFAULT_FILE_MAX_CONCURRENCY,
+    ):
+        Storage.__init__(self)
         self.base_path = base_path
+        self.fsync = fsync
+        self.max_concurrency = max_concurrency
 
     def _get_full_path(self, key):
         """
@@ -146,22 +334,128 @@ class FileStorage(Storage):
             else:
                 raise
 
+    def open(self, key):
+        """Get a readable binary stream for specified key
+
+        The file is memory-mapped when possible, so that its data is read
+        lazily and shared with other processes through the OS page cache.
+
+        Args:
+            key (str): The key / relative file path to get data for
+
+        Returns:
+            Any[mmap.mmap, file]: A seekable, read-only file-like object
+        """
+        if not key:
+            raise exc.ImageNotFoundError()
+        path = self._get_full_path(key)
+        try:
+            fp = open(path, 'rb')
+        except IOError as e:
+            if e.errno == 2:
+                raise exc.ImageNotFoundError(*e.args)
+            else:
+                raise
+        try:
+            mapped = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError):
+            # Empty files can't be memory-mapped
+            return fp
+        fp.close()
+        return mapped
+
+    def _is_own_file(self, filename):
+        # Temporary files, and e.g. markers kept by `TieredStorage`
+        return filename.startswith(self.temp_file_prefix)
+
+    def _publish(self, temp_path, full_path):
+        """
+        Make `temp_path` available at `full_path`, without replacing any
+        existing file
+
+        Args:
+            temp_path (str): The fully written temporary file
+            full_path (str): The final path of the file
+
+        Raises:
+            :class:`exc.FileExistsError`: If `full_path` already exists
+        """
+        try:
+            os.link(temp_path, full_path)
+        except (AttributeError, OSError) as e:
+            if getattr(e, 'errno', None) == errno.EEXIST:
+                raise exc.FileExistsError(
+                    errno.EEXIST, 'File exists', full_path
+                )
+            # Hard links aren't supported on this platform or file system.
+            # Fall back to a rename, which can't guarantee exclusivity on
+            # POSIX systems.
+            if os.path.exists(full_path):
+                raise exc.FileExistsError(
+                    errno.EEXIST, 'File exists', full_path
+                )
+            os.rename(temp_path, full_path)
+
+        if self.fsync:
+            self._fsync_directory(os.path.dirname(full_path))
+
+    def _fsync_directory(self, path):
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            # Directories can't be opened on e.g. Windows
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
     def save(self, key, bdata):
         """Store binary file data at specified key
 
+        The data is first written to a temporary file in the destination
+        directory, which is then published at `key`. Readers will therefore
+        never see a partially written file, and an interrupted save won't
+        leave a truncated file behind.
+
         Args:
             key (str): The key / relative file path to store data at
-            bdata (bytes): The file data
+            bdata (Any[bytes, file-like]):
+                The file data, or a readable binary file object
+
+        Raises:
+            :class:`exc.FileExistsError`: If the key already exists
         """
         full_path = self._get_full_path(key)
-        utils.mkdir_p(os.path.split(full_path)[0])
+        dirname = os.path.split(full_path)[0]
+        utils.mkdir_p(dirname)
 
-        # Python 2 doesn't natively support `xb` mode as used below. Have to
-        # manually check for the file's existence.
-        if PY2 and self.exists(key):
-            raise exc.FileExistsError(17, 'File exists')
-        with open(full_path, 'wb' if PY2 else 'xb') as fp:
-            fp.write(bdata)
+        # Fail early instead of writing data that can't be published anyway
+        if os.path.exists(full_path):
+            raise exc.FileExistsError(errno.EEXIST, 'File exists', full_path)
+
+        fd, temp_path = tempfile.mkstemp(
+            prefix=self.temp_file_prefix,
+            suffix=self.temp_file_suffix,
+            dir=dirname,
+        )
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                if hasattr(bdata, 'read'):
+                    shutil.copyfileobj(bdata, fp, constants.DEFAULT_CHUNK_SIZE)
+                else:
+                    fp.write(bdata)
+                if self.fsync:
+                    fp.flush()
+                    os.fsync(fp.fileno())
+            self._publish(temp_path, full_path)
+        finally:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
 
     def exists(self, key):
         """Check if the key exists in the backend
@@ -177,6 +471,89 @@ class FileStorage(Storage):
         full_path = self._get_full_path(key)
         return os.path.exists(full_path)
 
+    def etag(self, key):
+        """Get a value that changes whenever the file at `key` changes
+
+        Args:
+            key (str): The key / relative file path to get the ETag for
+
+        Raises:
+            :class:`exc.ImageNotFoundError`: If the file doesn't exist
+
+        Returns:
+            str: The file's modification time and size
+        """
+        if not key:
+            raise exc.ImageNotFoundError()
+        try:
+            st = os.stat(self._get_full_path(key))
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                raise exc.ImageNotFoundError(*e.args)
+            raise
+        return '{:x}-{:x}'.format(int(st.st_mtime * 1000000), st.st_size)
+
+    def size(self, key):
+        """Get the size of the file at `key`
+
+        Args:
+            key (str): The key / relative file path to get the size of
+
+        Raises:
+            :class:`exc.ImageNotFoundError`: If the file doesn't exist
+
+        Returns:
+            int: The file's size in bytes
+        """
+        if not key:
+            raise exc.ImageNotFoundError()
+        try:
+            return os.path.getsize(self._get_full_path(key))
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                raise exc.ImageNotFoundError(*e.args)
+            raise
+
+    def _list_directory(self, path):
+        if scandir is None:
+            return set(
+                name for name in os.listdir(path)
+                if os.path.isfile(os.path.join(path, name))
+            )
+        return set(entry.name for entry in scandir(path) if entry.is_file())
+
+    def exists_many(self, keys):
+        """Check which of the keys exist in the backend
+
+        When many keys share a directory, that directory is scanned once
+        instead of checking each file separately.
+
+        Args:
+            keys (Iterable[str]): The keys / relative file paths to check
+
+        Returns:
+            Set[str]: The keys that exist
+        """
+        found = set()
+        keys = [key for key in keys if key]
+        for dirname, dir_keys in utils.group_by_dirname(keys).items():
+            if len(dir_keys) < self.scandir_threshold:
+                found.update(key for key in dir_keys if self.exists(key))
+                continue
+            try:
+                filenames = self._list_directory(
+                    self._get_full_path(dirname)
+                )
+            except OSError as e:
+                if e.errno == errno.ENOENT:
+                    continue
+                raise
+            found.update(
+                key for key in dir_keys
+                if key.rpartition('/')[2] in filenames
+            )
+        return found
+
     def delete(self, key):
         """Delete file at specified key
 
@@ -185,6 +562,57 @@ class FileStorage(Storage):
         """
         os.remove(self._get_full_path(key))
 
+    def move(self, key, new_key):
+        """Move file from one key to another
+
+        Args:
+            key (str): The key / relative file path to move
+            new_key (str): The key / relative file path to move to
+
+        Raises:
+            :class:`exc.FileExistsError`: If `new_key` already exists
+        """
+        full_path = self._get_full_path(key)
+        new_full_path = self._get_full_path(new_key)
+        utils.mkdir_p(os.path.split(new_full_path)[0])
+        self._publish(full_path, new_full_path)
+        try:
+            os.remove(full_path)
+        except OSError as e:
+            # Already gone if the file had to be renamed
+            if e.errno != errno.ENOENT:
+                raise
+
+    def _walk(self, path, relative_path):
+        """
+        Recursively yields the relative paths of all regular files below
+        `path`, using :func:`os.scandir` where available
+        """
+        if scandir is None:
+            for root, dirs, filenames in os.walk(path):
+                root_relative_path = '/'.join(filter(None, [
+                    relative_path,
+                    root[len(path):].strip(os.sep).replace(os.sep, '/'),
+                ]))
+                for filename in filenames:
+                    if not self._is_own_file(filename):
+                        yield '/'.join([root_relative_path, filename])
+            return
+
+        try:
+            entries = scandir(path)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return
+            raise
+        for entry in entries:
+            entry_relative_path = '/'.join([relative_path, entry.name])
+            if entry.is_dir(follow_symlinks=False):
+                for key in self._walk(entry.path, entry_relative_path):
+                    yield key
+            elif not self._is_own_file(entry.name):
+                yield entry_relative_path
+
     def list_tree(self, subdir):
         """
         Recursively yields all regular files' names in a sub-directory of the
@@ -202,15 +630,33 @@ class FileStorage(Storage):
                 Yields subdirectory's filenames
         """
         assert subdir, 'Subdir must be specified'
-        base_path = self.base_path
-        if not base_path.endswith(os.sep):
-            base_path += os.sep
-        tree_base = os.path.join(base_path, subdir)
-        for root, dirs, filenames in os.walk(tree_base, topdown=False):
-            for filename in filenames:
-                root_relative_path = root[len(base_path):].replace(os.sep, '/')
-                relative_path = '/'.join([root_relative_path, filename])
-                yield relative_path
+        subdir = subdir.strip('/')
+        return self._walk(self._get_full_path(subdir), subdir)
+
+    def _delete_missing_ok(self, key):
+        try:
+            self.delete(key)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        return key
+
+    def delete_many(self, keys):
+        """Delete files at the specified keys, ignoring missing files
+
+        Files are deleted concurrently, by up to `max_concurrency` threads.
+
+        Args:
+            keys (Iterable[str]):
+                The keys / relative file paths to delete
+
+        Returns:
+            Generator[str, str, None]:
+                Yields deleted keys
+        """
+        for chunk in utils.chunked(keys, 1000):
+            for key in self.executor.map(self._delete_missing_ok, chunk):
+                yield key
 
     def delete_tree(self, subdir):
         """
@@ -224,10 +670,7 @@ class FileStorage(Storage):
             Generator[str, str, None]:
                 Yields deleted subdirectory's filenames
         """
-        for relative_path in self.list_tree(subdir):
-            full_path = self._get_full_path(relative_path)
-            os.remove(full_path)
-            yield relative_path
+        return self.delete_many(self.list_tree(subdir))
 
 
 class S3Storage(Storage):
@@ -247,6 +690,33 @@ class S3Storage(Storage):
             Defaults to reading from the local AWS config.
         file_acl (str):
             The ACL to set on uploaded images. Defaults to "public-read"
+        multipart_threshold (int):
+            Size in bytes from which uploads are split into a multipart
+            upload.
+        multipart_chunksize (int):
+            Size in bytes of each part of a multipart upload.
+        max_concurrency (int):
+            Maximum number of threads used to transfer the parts of a
+            multipart upload.
+        spool_size (int):
+            Size in bytes up until which data fetched with :meth:`open` is
+            kept in memory. Larger objects are spooled to a temporary file.
+        list_threshold (int):
+            Number of keys sharing a directory from which
+            :meth:`exists_many` lists that directory instead of checking
+            each key separately.
+        timeout (Any[float, None]):
+            Number of seconds to wait for a connection, or for a response.
+            Defaults to the boto3 defaults.
+        max_pool_connections (int):
+            Maximum number of connections kept open to S3. Should be at
+            least the number of threads that use the storage at the same
+            time, including `max_concurrency`.
+        max_retries (Any[int, None]):
+            Number of times to retry a failed request, with exponential
+            backoff. Defaults to the boto3 defaults.
+        tcp_keepalive (bool):
+            Whether to send TCP keepalive packets on idle connections
 
     """
 
@@ -256,7 +726,16 @@ class S3Storage(Storage):
         access_key=None,
         secret_key=None,
         region_name=None,
-        file_acl='public-read'
+        file_acl='public-read',
+        multipart_threshold=constants.DEFAULT_S3_MULTIPART_THRESHOLD,
+        multipart_chunksize=constants.DEFAULT_S3_MULTIPART_CHUNKSIZE,
+        max_concurrency=constants.DEFAULT_S3_MAX_CONCURRENCY,
+        spool_size=constants.DEFAULT_S3_SPOOL_SIZE,
+        list_threshold=constants.DEFAULT_S3_LIST_THRESHOLD,
+        timeout=None,
+        max_pool_connections=constants.DEFAULT_S3_MAX_POOL_CONNECTIONS,
+        max_retries=None,
+        tcp_keepalive=False,
     ):
         if boto3 is None:
             raise exc.Boto3ImportError(
@@ -266,6 +745,7 @@ class S3Storage(Storage):
         default_session = botocore.session.get_session()
         default_credentials = default_session.get_credentials()
 
+        Storage.__init__(self)
         self.bucket_name = bucket
         self.access_key = \
             access_key or getattr(default_credentials, 'access_key', None)
@@ -274,14 +754,51 @@ class S3Storage(Storage):
         self.region_name = \
             region_name or default_session.get_config_variable('region')
         self.file_acl = 'public-read'
-        self.s3 = boto3.resource(
-            's3',
-            aws_access_key_id=access_key,
-            aws_secret_access_key=secret_key,
-            region_name=region_name,
+        self.max_concurrency = max_concurrency
+        self.spool_size = spool_size
+        self.list_threshold = list_threshold
+        self.transfer_config = boto3.s3.transfer.TransferConfig(
+            multipart_threshold=multipart_threshold,
+            multipart_chunksize=multipart_chunksize,
+            max_concurrency=max_concurrency,
         )
+        config_kw = dict(max_pool_connections=max_pool_connections)
+        if timeout is not None:
+            config_kw.update(connect_timeout=timeout, read_timeout=timeout)
+        if max_retries is not None:
+            config_kw['retries'] = dict(
+                max_attempts=max_retries,
+                mode='standard',
+            )
+        if tcp_keepalive:
+            config_kw['tcp_keepalive'] = True
+        self.client_config = botocore.config.Config(**config_kw)
+        self._client = None
+        self._client_pid = None
+        self._client_lock = threading.Lock()
         self._verify_configuration()
 
+    @property
+    def client(self):
+        """
+        Low-level S3 client, shared by all threads. Lazily (re-)created, as
+        its connections can't be shared with a forked process.
+
+        Returns:
+            botocore.client.S3: The client
+        """
+        with self._client_lock:
+            if self._client is None or self._client_pid != os.getpid():
+                # Sessions aren't thread safe, unlike the clients they make
+                session = boto3.session.Session(
+                    aws_access_key_id=self.access_key,
+                    aws_secret_access_key=self.secret_key,
+                    region_name=self.region_name,
+                )
+                self._client = session.client('s3', config=self.client_config)
+                self._client_pid = os.getpid()
+            return self._client
+
     @property
     def base_url(self):
         """The base URL for the storage's bucket
@@ -289,7 +806,7 @@ class S3Storage(Storage):
         Returns:
             str: The URL
         """
-        return '/'.join([self.s3.meta.client._endpoint.host, self.bucket_name])
+        return '/'.join([self.client.meta.endpoint_url, self.bucket_name])
 
     def _verify_configuration(self):
         if self.access_key is None:
@@ -305,20 +822,14 @@ class S3Storage(Storage):
                 "Could not find S3 setting for region_name"
             )
 
-    def get(self, relative_path):
-        """Get binary file data for specified key
-
-        Args:
-            key (str): The key to get data for
-
-        Returns:
-            bytes: The file's binary data
-        """
+    def _get_body(self, relative_path):
         if not relative_path:
             raise exc.ImageNotFoundError()
-        obj = self.s3.Object(self.bucket_name, relative_path)
         try:
-            resp = obj.get()
+            resp = self.client.get_object(
+                Bucket=self.bucket_name,
+                Key=relative_path,
+            )
         except botocore.exceptions.ClientError as e:
             if e.response['Error']['Code'] == 'NoSuchKey':
                 new_exc = exc.ImageNotFoundError(*e.args)
@@ -326,20 +837,61 @@ class S3Storage(Storage):
                 raise new_exc
             else:
                 raise
-        return resp['Body'].read()
+        return resp['Body']
+
+    def get(self, relative_path):
+        """Get binary file data for specified key
+
+        Args:
+            key (str): The key to get data for
+
+        Returns:
+            bytes: The file's binary data
+        """
+        return self._get_body(relative_path).read()
+
+    def open(self, relative_path):
+        """Get a readable binary stream for specified key
+
+        The object is streamed into a spooled temporary file, so that only
+        objects smaller than `spool_size` are held in memory.
+
+        Args:
+            key (str): The key to get data for
+
+        Returns:
+            A seekable file-like object, positioned at the start of the data
+        """
+        body = self._get_body(relative_path)
+        fp = tempfile.SpooledTemporaryFile(max_size=self.spool_size)
+        try:
+            shutil.copyfileobj(body, fp, constants.DEFAULT_CHUNK_SIZE)
+        except Exception:
+            fp.close()
+            raise
+        finally:
+            body.close()
+        fp.seek(0)
+        return fp
 
     def save(self, relative_path, bdata):
         """Store binary file data at specified key
 
+        Data larger than the configured `multipart_threshold` is uploaded as
+        a multipart upload, with its parts transferred concurrently.
+
         Args:
             key (str): The key to store data at
-            bdata (bytes): The file data
+            bdata (Any[bytes, file-like]):
+                The file data, or a readable binary file object
         """
-        self.s3.meta.client.put_object(
-            Bucket=self.bucket_name,
-            Key=relative_path,
-            Body=bdata,
-            ACL=self.file_acl
+        fp = bdata if hasattr(bdata, 'read') else io.BytesIO(bdata)
+        self.client.upload_fileobj(
+            fp,
+            self.bucket_name,
+            relative_path,
+            ExtraArgs={'ACL': self.file_acl},
+            Config=self.transfer_config,
         )
 
     def exists(self, relative_path):
@@ -354,7 +906,7 @@ class S3Storage(Storage):
         if not relative_path:
             return False
         try:
-            self.s3.meta.client.head_object(
+            self.client.head_object(
                 Bucket=self.bucket_name,
                 Key=relative_path
             )
@@ -366,21 +918,192 @@ class S3Storage(Storage):
         else:
             return True
 
+    def etag(self, relative_path):
+        """Get the ETag of the object at specified key
+
+        Args:
+            relative_path (str): The key to get the ETag for
+
+        Raises:
+            :class:`exc.ImageNotFoundError`: If the key doesn't exist
+
+        Returns:
+            str: The ETag
+        """
+        if not relative_path:
+            raise exc.ImageNotFoundError()
+        try:
+            resp = self.client.head_object(
+                Bucket=self.bucket_name,
+                Key=relative_path,
+            )
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] == '404':
+                new_exc = exc.ImageNotFoundError(*e.args)
+                new_exc.original_exc = e
+                raise new_exc
+            else:
+                raise
+        return resp['ETag']
+
+    def size(self, relative_path):
+        """Get the size of the object at specified key
+
+        Args:
+            relative_path (str): The key to get the size of
+
+        Raises:
+            :class:`exc.ImageNotFoundError`: If the key doesn't exist
+
+        Returns:
+            int: The size in bytes
+        """
+        if not relative_path:
+            raise exc.ImageNotFoundError()
+        try:
+            resp = self.client.head_object(
+                Bucket=self.bucket_name,
+                Key=relative_path,
+            )
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] == '404':
+                new_exc = exc.ImageNotFoundError(*e.args)
+                new_exc.original_exc = e
+                raise new_exc
+            else:
+                raise
+        return resp['ContentLength']
+
+    def _list_range(self, prefix, keys):
+        """
+        List the keys in `prefix` that sort between the first and last of
+        `keys`, and return the ones among them that exist
+
+        Gives up once the listing has taken more requests than it has
+        checked keys, i.e. when the keys are spread too thinly among other
+        objects for listing to be cheaper than checking each key.
+
+        Returns:
+            Tuple[Set[str], List[str]]:
+                The keys that exist, and the keys that weren't checked
+        """
+        keys = sorted(keys)
+        wanted = set(keys)
+        found = set()
+        requests = 0
+        kw = dict(
+            Bucket=self.bucket_name,
+            Prefix=prefix,
+            # Any proper prefix of a key sorts before the key itself
+            StartAfter=keys[0][:-1],
+        )
+        while True:
+            resp = self.client.list_objects_v2(**kw)
+            requests += 1
+            contents = resp.get('Contents', ())
+            for obj in contents:
+                if obj['Key'] > keys[-1]:
+                    return found, []
+                if obj['Key'] in wanted:
+                    found.add(obj['Key'])
+            if not resp.get('NextContinuationToken'):
+                return found, []
+            kw['ContinuationToken'] = resp['NextContinuationToken']
+            checked = bisect.bisect_right(keys, contents[-1]['Key']) \
+                if contents else 0
+            if checked < requests:
+                return found, keys[checked:]
+
+    def exists_many(self, relative_paths):
+        """Check which of the keys exist in the backend
+
+        When at least `list_threshold` keys share a directory, the
+        directory is listed instead, unless they turn out to be spread too
+        thinly among its other objects. Other keys are checked with
+        concurrent HEAD requests.
+
+        Args:
+            relative_paths (Iterable[str]): The keys to check
+
+        Returns:
+            Set[str]: The keys that exist
+        """
+        found = set()
+        to_check = []
+        keys = [key for key in relative_paths if key]
+        for prefix, prefix_keys in utils.group_by_dirname(keys).items():
+            if len(prefix_keys) >= self.list_threshold:
+                listed, unchecked = self._list_range(
+                    prefix + '/' if prefix else '',
+                    prefix_keys
+                )
+                found.update(listed)
+                to_check.extend(unchecked)
+            else:
+                to_check.extend(prefix_keys)
+
+        results = self.executor.map(self.exists, to_check)
+        found.update(key for key, ok in zip(to_check, results) if ok)
+        return found
+
     def delete(self, relative_path):
         """Delete file at specified key
 
         Args:
             key (str): The key to delete
         """
-        return self.s3.meta.client.delete_object(
+        return self.client.delete_object(
             Bucket=self.bucket_name,
             Key=relative_path,
         )
 
+    def move(self, relative_path, new_relative_path):
+        """Move data from one key to another, with a server-side copy
+
+        Args:
+            relative_path (str): The key to move
+            new_relative_path (str): The key to move to
+        """
+        self.client.copy(
+            {'Bucket': self.bucket_name, 'Key': relative_path},
+            self.bucket_name,
+            new_relative_path,
+            ExtraArgs={'ACL': self.file_acl},
+            Config=self.transfer_config,
+        )
+        self.delete(relative_path)
+
+    # Generated images' names start with a hex digit, so splitting the key
+    # space at these spreads the listing evenly over up to 16 requests
+    _list_boundaries = '123456789abcdef'
+
+    def _list_page(self, kw, end):
+        """
+        List one page of keys, up until `end`
+
+        Returns:
+            Tuple[List[str], Any[dict, None]]:
+                The keys, and the arguments to list the next page with, or
+                None if there are no more keys in the range
+        """
+        resp = self.client.list_objects_v2(**kw)
+        keys = []
+        for obj in resp.get('Contents', ()):
+            if end is not None and obj['Key'] >= end:
+                return keys, None
+            keys.append(obj['Key'])
+        if not resp.get('NextContinuationToken'):
+            return keys, None
+        return keys, dict(kw, ContinuationToken=resp['NextContinuationToken'])
+
     def list_tree(self, subdir):
         """
         Recursively yields all keys in a sub-directory of the storage backend
 
+        The key space is split into ranges at each hex digit, which are
+        listed concurrently, a page at a time. Keys are yielded as pages
+        arrive, in no particular order.
+
         Args:
             subdir (str):
                 The subdirectory to list keys for
@@ -393,16 +1116,66 @@ class S3Storage(Storage):
         if not subdir.endswith('/'):
             subdir += '/'
 
-        kw = dict(Bucket=self.bucket_name, Prefix=subdir)
+        bounds = [None] + [subdir + c for c in self._list_boundaries] + [None]
+        ranges = collections.deque()
+        for start, end in zip(bounds, bounds[1:]):
+            kw = dict(Bucket=self.bucket_name, Prefix=subdir)
+            if start is not None:
+                # Sorts after every key that starts with the previous
+                # character, and before `start` itself
+                kw['StartAfter'] = ''.join([
+                    start[:-1], chr(ord(start[-1]) - 1), u'\U0010ffff'
+                ])
+            ranges.append((kw, end))
+
+        pending = collections.deque()
+        while ranges or pending:
+            # Limits the number of listed keys held in memory to a page
+            # per thread
+            while ranges and len(pending) < self.max_concurrency:
+                kw, end = ranges.popleft()
+                pending.append(
+                    (self.executor.submit(self._list_page, kw, end), end)
+                )
+            future, end = pending.popleft()
+            keys, next_kw = future.result()
+            for key in keys:
+                yield key
+            if next_kw is not None:
+                ranges.appendleft((next_kw, end))
 
-        while True:
-            resp = self.s3.meta.client.list_objects_v2(**kw)
-            for obj in resp.get('Contents', ()):
-                yield obj['Key']
-            if resp.get('NextContinuationToken'):
-                kw['ContinuationToken'] = resp['NextContinuationToken']
-            else:
-                break
+    def _delete_batch(self, keys):
+        self.client.delete_objects(
+            Bucket=self.bucket_name,
+            Delete={
+                'Objects': [{'Key': key} for key in keys]
+            }
+        )
+        return keys
+
+    def delete_many(self, relative_paths):
+        """
+        Delete the specified keys, in concurrent batches of up to 1000 keys
+
+        Args:
+            relative_paths (Iterable[str]): The keys to delete
+
+        Returns:
+            Generator[str, str, None]:
+                Yields deleted keys
+        """
+        pending = collections.deque()
+
+        for keys in utils.chunked(relative_paths, 1000):
+            pending.append(self.executor.submit(self._delete_batch, keys))
+            # Limit the number of listed keys held in memory
+            if len(pending) >= self.max_concurrency:
+                for key in pending.popleft().result():
+                    yield key
+
+        while pending:
+            for key in pending.popleft().result():
+                yield key
 
     def delete_tree(self, subdir):
         """
@@ -417,13 +1190,544 @@ class S3Storage(Storage):
                 Yields subdirectory's deleted keys
         """
         assert subdir, 'Subdir must be specified'
+        return self.delete_many(self.list_tree(subdir))
 
-        for keys in utils.chunked(self.list_tree(subdir), 1000):
-            self.s3.meta.client.delete_objects(
-                Bucket=self.bucket_name,
-                Delete={
-                    'Objects': [{'Key': key} for key in keys]
-                }
-            )
-            for key in keys:
+
+class SourceCacheStorage(Storage):
+    """
+    Keeps copies of the images read from a storage backend on the local disk
+
+    Useful with a remote backend, such as :class:`S3Storage`, as generating
+    several images from the same source image then only downloads it once.
+    Before a copy is used, it's checked to still be up to date with the
+    image's ETag in the backend. Copies are filled atomically, so they can
+    be shared by all processes on the host, and the least recently used
+    ones are removed when they take up more than `max_bytes`.
+
+    Everything but reading is passed on to the backend.
+
+    Args:
+        backend (Storage):
+            The storage backend to read images from
+        path (str):
+            The directory to keep the copies in
+        max_bytes (int):
+            Maximum total size in bytes of the copies
+        low_water (float):
+            Fraction of `max_bytes` that copies are removed down to, once
+            they take up more than `max_bytes`
+    """
+
+    def __init__(
+        self,
+        backend,
+        path,
+        max_bytes=constants.DEFAULT_SOURCE_CACHE_MAX_BYTES,
+        low_water=constants.DEFAULT_SOURCE_CACHE_LOW_WATER,
+    ):
+        Storage.__init__(self)
+        self.backend = backend
+        self.path = path
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self.local = FileStorage(base_path=path)
+        self._size = None
+        self._size_lock = threading.Lock()
+
+    def __getattr__(self, name):
+        # Anything specific to the backend, e.g. `S3Storage.base_url`
+        if name == 'backend':
+            raise AttributeError(name)
+        return getattr(self.backend, name)
+
+    def _get_local_key(self, relative_path, etag):
+        digest = hashlib.sha1(relative_path.encode('utf-8')).hexdigest()
+        version = hashlib.sha1(etag.encode('utf-8')).hexdigest()[:16]
+        return '/'.join([digest[:2], '-'.join([digest, version])])
+
+    def _fill(self, relative_path, local_key):
+        fp = self.backend.open(relative_path)
+        try:
+            self.local.save(local_key, fp)
+        except exc.FileExistsError:
+            # Filled by someone else in the meantime
+            return
+        finally:
+            fp.close()
+
+        size = os.path.getsize(self.local._get_full_path(local_key))
+        with self._size_lock:
+            if self._size is not None:
+                self._size += size
+            should_evict = self._size is None or self._size > self.max_bytes
+        if should_evict:
+            self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used copies if they take up more than
+        `max_bytes`, until they take up at most `low_water` of it
+
+        The directory is only walked here. In between, the size is kept up
+        to date with this process' own copies, so leaving room below
+        `max_bytes` means the next ones don't trigger another walk.
+
+        Returns:
+            int: Number of removed copies
+        """
+        entries = []
+        for dirpath, _, filenames in os.walk(self.path):
+            for filename in filenames:
+                if self.local._is_own_file(filename):
+                    continue
+                full_path = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(full_path)
+                except OSError:
+                    # Removed by someone else
+                    continue
+                entries.append((st.st_mtime, st.st_size, full_path))
+
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        if total > self.max_bytes:
+            target = int(self.max_bytes * self.low_water)
+        else:
+            target = total
+        entries.sort()
+        for _, size, full_path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(full_path)
+            except OSError:
+                pass
+            total -= size
+            removed += 1
+
+        with self._size_lock:
+            self._size = total
+        return removed
+
+    def open(self, relative_path):
+        """Get a readable binary stream for specified key
+
+        Downloaded to the local disk first, unless an up to date copy is
+        already there.
+
+        Args:
+            relative_path (str): The key to get data for
+
+        Returns:
+            A seekable file-like object, positioned at the start of the data
+        """
+        if not relative_path:
+            raise exc.ImageNotFoundError()
+        local_key = self._get_local_key(
+            relative_path, self.backend.etag(relative_path)
+        )
+        try:
+            fp = self.local.open(local_key)
+        except exc.ImageNotFoundError:
+            try:
+                self._fill(relative_path, local_key)
+            except (IOError, OSError) as e:
+                logger.warning(
+                    'Failed to keep a copy of {}: {}'.format(relative_path, e)
+                )
+                return self.backend.open(relative_path)
+            try:
+                fp = self.local.open(local_key)
+            except exc.ImageNotFoundError:
+                # Evicted right away, as it's bigger than `max_bytes`
+                return self.backend.open(relative_path)
+        else:
+            logger.debug('Read from source cache: {}'.format(relative_path))
+            # Marks it as recently used
+            try:
+                os.utime(self.local._get_full_path(local_key), None)
+            except OSError:
+                pass
+        return fp
+
+    def get(self, relative_path):
+        """Get binary file data for specified key
+
+        Args:
+            relative_path (str): The key to get data for
+
+        Returns:
+            bytes: The file's binary data
+        """
+        fp = self.open(relative_path)
+        try:
+            return fp.read()
+        finally:
+            fp.close()
+
+    def etag(self, relative_path):
+        return self.backend.etag(relative_path)
+
+    def size(self, relative_path):
+        return self.backend.size(relative_path)
+
+    def get_base_url(self, relative_path):
+        return self.backend.get_base_url(relative_path)
+
+    def save(self, relative_path, bdata):
+        return self.backend.save(relative_path, bdata)
+
+    def exists(self, relative_path):
+        return self.backend.exists(relative_path)
+
+    def exists_many(self, relative_paths):
+        return self.backend.exists_many(relative_paths)
+
+    def delete(self, relative_path):
+        return self.backend.delete(relative_path)
+
+    def delete_many(self, relative_paths):
+        return self.backend.delete_many(relative_paths)
+
+    def move(self, relative_path, new_relative_path):
+        return self.backend.move(relative_path, new_relative_path)
+
+    def list_tree(self, subdir):
+        return self.backend.list_tree(subdir)
+
+    def delete_tree(self, subdir):
+        return self.backend.delete_tree(subdir)
+
+
+class TieredStorage(Storage):
+    """
+    Saves images to the local disk, and copies them to a remote storage
+    backend in the background
+
+    Saving then doesn't wait for e.g. an upload to S3. Until an image has
+    been copied, it's served from the local disk at `local_url`. Once
+    copied, it's served from the remote backend, but kept on the local
+    disk for another `local_ttl` seconds, so that URLs to it that were
+    already handed out keep working. Copied images are marked as such with
+    an empty file next to them.
+
+    Images left on the local disk by previous processes are picked up by
+    one process per host, the first to save an image: those that weren't
+    copied yet are copied, and the others are removed once `local_ttl`
+    seconds have passed since they were copied.
+
+    The local disk isn't shared, so `local_url` has to be served by the
+    host that saved the image. Other processes on the same host hand out
+    `local_url` for an image until its local copy is removed.
+
+    Args:
+        local (FileStorage):
+            Storage backend that images are saved to first
+        remote (Storage):
+            Storage backend that images are copied to
+        local_url (str):
+            URL that `local`'s directory is served at
+        batch_size (int):
+            Maximum number of images to copy at the same time
+        max_retries (int):
+            Number of times to retry copying an image, before it's left on
+            the local disk
+        retry_delay (float):
+            Number of seconds to wait after a failed copy. Doubled for each
+            consecutive failure.
+        local_ttl (float):
+            Number of seconds to keep copied images on the local disk for
+    """
+
+    def __init__(
+        self,
+        local,
+        remote,
+        local_url,
+        batch_size=constants.DEFAULT_WRITE_BEHIND_BATCH_SIZE,
+        max_retries=constants.DEFAULT_WRITE_BEHIND_MAX_RETRIES,
+        retry_delay=constants.DEFAULT_WRITE_BEHIND_RETRY_DELAY,
+        local_ttl=constants.DEFAULT_WRITE_BEHIND_LOCAL_TTL,
+    ):
+        Storage.__init__(self)
+        self.local = local
+        self.remote = remote
+        self.local_url = local_url if local_url.endswith('/') \
+            else local_url + '/'
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.local_ttl = local_ttl
+        self._queue = None
+        # Copied keys, and when their local copies are removed
+        self._copied = {}
+        self._uploader_pid = None
+        self._uploader_lock = threading.Lock()
+        self._claim_fd = None
+
+    def __getattr__(self, name):
+        # Anything specific to the remote backend, e.g. `S3Storage.base_url`
+        if name == 'remote':
+            raise AttributeError(name)
+        return getattr(self.remote, name)
+
+    def _get_queue(self):
+        """
+        Get the queue of images to copy. The thread that copies them is
+        lazily (re-)started, as threads don't survive a fork.
+        """
+        with self._uploader_lock:
+            if self._uploader_pid != os.getpid():
+                self._queue = queue.Queue()
+                self._copied = {}
+                self._uploader_pid = os.getpid()
+                expiries = collections.deque()
+                if self._claim_local_files():
+                    self._pick_up_local_files(expiries)
+                uploader = threading.Thread(
+                    target=self._upload_forever,
+                    args=(self._queue, self._copied, expiries),
+                )
+                uploader.daemon = True
+                uploader.start()
+            return self._queue
+
+    def _claim_local_files(self):
+        """
+        Whether this process is the one on the host that picks up the
+        images left on the local disk. The claim is held until it exits.
+        """
+        if fcntl is None:
+            return True
+        utils.mkdir_p(self.local.base_path)
+        fd = os.open(
+            os.path.join(
+                self.local.base_path,
+                self.local.temp_file_prefix + 'uploader.lock',
+            ),
+            os.O_RDWR | os.O_CREAT,
+            0o644,
+        )
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            os.close(fd)
+            return False
+        self._claim_fd = fd
+        return True
+
+    def _pick_up_local_files(self, expiries):
+        """
+        Queue the images on the local disk that weren't copied yet, and
+        schedule the removal of the others
+        """
+        found = []
+        for key in self.local._walk(self.local.base_path, ''):
+            key = key.lstrip('/')
+            try:
+                copied_at = os.path.getmtime(self._get_marker_path(key))
+            except OSError:
+                self._queue.put((key, 0))
+            else:
+                found.append((copied_at + self.local_ttl, key))
+        for expires_at, key in sorted(found):
+            self._copied[key] = expires_at
+            expiries.append((expires_at, key))
+
+    def _get_marker_path(self, key):
+        dirname, filename = os.path.split(self.local._get_full_path(key))
+        return os.path.join(
+            dirname, self.local.temp_file_prefix + 'copied-' + filename
+        )
+
+    def _remove_marker(self, key):
+        try:
+            os.remove(self._get_marker_path(key))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def _upload_forever(self, pending, copied, expiries):
+        failures = 0
+        while True:
+            self._remove_expired(copied, expiries)
+            try:
+                batch = [pending.get(
+                    timeout=max(0, expiries[0][0] - time.time())
+                    if expiries else None
+                )]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(pending.get_nowait())
+                except queue.Empty:
+                    break
+
+            results = list(self.remote.executor.map(self._upload, batch))
+            for (key, attempts), uploaded in zip(batch, results):
+                if uploaded:
+                    expires_at = time.time() + self.local_ttl
+                    copied[key] = expires_at
+                    expiries.append((expires_at, key))
+                elif attempts < self.max_retries:
+                    pending.put((key, attempts + 1))
+                else:
+                    logger.error(
+                        'Gave up copying {} after {} attempts'
+                        .format(key, attempts + 1)
+                    )
+            self._remove_expired(copied, expiries)
+            for _ in batch:
+                pending.task_done()
+
+            if all(results):
+                failures = 0
+            else:
+                # Back off while the remote backend is failing
+                time.sleep(self.retry_delay * 2 ** min(failures, 6))
+                failures += 1
+
+    def _upload(self, item):
+        key, _ = item
+        try:
+            fp = self.local.open(key)
+        except exc.ImageNotFoundError:
+            # Deleted, or already copied by another process
+            return True
+        try:
+            self.remote.save(key, fp)
+        except exc.FileExistsError:
+            pass
+        except Exception as e:
+            logger.warning('Failed to copy {}: {}'.format(key, e))
+            return False
+        finally:
+            fp.close()
+        logger.debug('Copied to remote storage: {}'.format(key))
+        try:
+            # Not copied again by the process that picks up local files
+            with open(self._get_marker_path(key), 'ab'):
+                pass
+        except (IOError, OSError) as e:
+            logger.warning('Failed to mark {} as copied: {}'.format(key, e))
+        return True
+
+    def _remove_expired(self, copied, expiries):
+        """Remove local copies of images that were copied long enough ago"""
+        now = time.time()
+        while expiries and expiries[0][0] <= now:
+            expires_at, key = expiries.popleft()
+            # Unless it was saved again since
+            if copied.get(key) == expires_at:
+                del copied[key]
+                self.local._delete_missing_ok(key)
+                self._remove_marker(key)
+
+    def flush(self):
+        """Wait until all saved images have been copied, or given up on"""
+        if self._uploader_pid == os.getpid():
+            self._queue.join()
+
+    def get_base_url(self, relative_path):
+        """Get the URL that specified key is served at, if not the default
+
+        Args:
+            relative_path (str): The key
+
+        Returns:
+            Any[str, None]:
+                `local_url` if the key hasn't been copied yet, otherwise
+                None
+        """
+        if relative_path not in self._copied and \
+                self.local.exists(relative_path):
+            return self.local_url
+        return self.remote.get_base_url(relative_path)
+
+    def get(self, relative_path):
+        try:
+            return self.local.get(relative_path)
+        except exc.ImageNotFoundError:
+            return self.remote.get(relative_path)
+
+    def open(self, relative_path):
+        try:
+            return self.local.open(relative_path)
+        except exc.ImageNotFoundError:
+            return self.remote.open(relative_path)
+
+    def etag(self, relative_path):
+        try:
+            return self.local.etag(relative_path)
+        except exc.ImageNotFoundError:
+            return self.remote.etag(relative_path)
+
+    def size(self, relative_path):
+        try:
+            return self.local.size(relative_path)
+        except exc.ImageNotFoundError:
+            return self.remote.size(relative_path)
+
+    def save(self, relative_path, bdata):
+        """Store binary file data at specified key, on the local disk
+
+        It's copied to the remote backend in the background.
+
+        Args:
+            relative_path (str): The key to store data at
+            bdata (Any[bytes, file-like]):
+                The file data, or a readable binary file object
+        """
+        pending = self._get_queue()
+        # Left behind if it was deleted while being copied
+        self._remove_marker(relative_path)
+        self.local.save(relative_path, bdata)
+        self._copied.pop(relative_path, None)
+        pending.put((relative_path, 0))
+
+    def exists(self, relative_path):
+        return (
+            self.local.exists(relative_path) or
+            self.remote.exists(relative_path)
+        )
+
+    def exists_many(self, relative_paths):
+        relative_paths = list(relative_paths)
+        found = self.local.exists_many(relative_paths)
+        return found | self.remote.exists_many(
+            key for key in relative_paths if key not in found
+        )
+
+    def delete(self, relative_path):
+        self.local._delete_missing_ok(relative_path)
+        self._remove_marker(relative_path)
+        return self.remote.delete(relative_path)
+
+    def delete_many(self, relative_paths):
+        relative_paths = list(relative_paths)
+        for key in self.local.delete_many(relative_paths):
+            self._remove_marker(key)
+        return self.remote.delete_many(relative_paths)
+
+    def move(self, relative_path, new_relative_path):
+        if self.local.exists(relative_path):
+            pending = self._get_queue()
+            self._remove_marker(relative_path)
+            self._remove_marker(new_relative_path)
+            self.local.move(relative_path, new_relative_path)
+            self._copied.pop(new_relative_path, None)
+            pending.put((new_relative_path, 0))
+        else:
+            self.remote.move(relative_path, new_relative_path)
+
+    def list_tree(self, subdir):
+        keys = set(self.local.list_tree(subdir))
+        for key in keys:
+            yield key
+        for key in self.remote.list_tree(subdir):
+            if key not in keys:
                 yield key
+
+    def delete_tree(self, subdir):
+        return self.delete_many(self.list_tree(subdir))
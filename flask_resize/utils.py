@@ -1,10 +1,17 @@
 import errno
+import hashlib
 import itertools
+import logging
 import os
+import threading
+import time
+from concurrent.futures import Future
 
 from . import constants, exc
 from ._compat import string_types
 
+logger = logging.getLogger('flask_resize')
+
 
 def mkdir_p(path):
     """Creates all non-existing directories encountered in the passed in path
@@ -125,3 +132,224 @@ def chunked(iterable, size):
     """Split iterable `iter` into one or more `size` sized tuples"""
     it = iter(iterable)
     return iter(lambda: tuple(itertools.islice(it, size)), ())
+
+
+def buffer_view(fp):
+    """Get the contents of a :class:`io.BytesIO` without copying them
+
+    Args:
+        fp (io.BytesIO): The buffer to get the contents of
+
+    Returns:
+        Any[memoryview, bytes]:
+            A view of the buffer's contents. Python 2 doesn't support buffer
+            views, so a copy is returned instead.
+    """
+    try:
+        return fp.getbuffer()
+    except AttributeError:
+        return fp.getvalue()
+
+
+def group_by_dirname(keys):
+    """Group forward slash separated keys by their directory
+
+    Args:
+        keys (Iterable[str]): The keys to group
+
+    Returns:
+        Dict[str, List[str]]:
+            Keys by directory. Keys without a directory are grouped under an
+            empty string.
+    """
+    groups = {}
+    for key in keys:
+        groups.setdefault(key.rpartition('/')[0], []).append(key)
+    return groups
+
+
+def shard_path(filename, depth, width=2):
+    """Prefix a filename with directories made from its first characters
+
+    Used to spread files over many directories, e.g. ``abcdef.jpg`` is
+    turned into ``ab/cd/abcdef.jpg`` with a `depth` of 2 and a `width`
+    of 2.
+
+    Args:
+        filename (str): The filename to shard, usually a hash
+        depth (int): Number of directory levels. 0 disables sharding.
+        width (int): Number of characters per directory name
+
+    Returns:
+        str: The filename, prefixed with its forward slash separated shards
+    """
+    shards = [
+        filename[i * width:(i + 1) * width]
+        for i in range(depth)
+    ]
+    return '/'.join(shards + [filename])
+
+
+def new_hash(method):
+    """Create a hash object from a hashing method name
+
+    Args:
+        method (str):
+            Any method supported by :func:`hashlib.new`. A digest size in
+            bytes can be appended after a colon for methods that support it,
+            e.g. ``blake2b:16``.
+
+    Returns:
+        A :mod:`hashlib` hash object
+    """
+    name, _, digest_size = method.partition(':')
+    if digest_size:
+        return hashlib.new(name, digest_size=int(digest_size))
+    return hashlib.new(name)
+
+
+class SingleFlight:
+    """Share the result of a call between threads that make it concurrently
+
+    While a call for a key is in flight, other calls for the same key wait
+    for it and get its result (or exception), instead of making it again.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs):
+        """Call `fn`, unless a call for `key` is already in flight
+
+        Args:
+            key (str): Identifies the call
+            fn (Callable): Called with `args` and `kwargs`
+
+        Returns:
+            Any: What `fn` returned, in this thread or another one
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class CircuitBreaker:
+    """Stop calling a backend that keeps failing, for a while
+
+    After `failure_threshold` consecutive failed calls the breaker opens,
+    and calls fail right away with :class:`exc.CircuitOpenError`. Once
+    `reset_timeout` seconds have passed, a single call is let through to
+    probe the backend (half-open). If it succeeds the breaker closes,
+    otherwise it opens again.
+
+    Args:
+        name (str):
+            Name of the backend, used in logs and errors
+        failure_threshold (int):
+            Number of consecutive failures that opens the breaker
+        reset_timeout (float):
+            Number of seconds to wait before probing the backend again
+        ignore (Tuple[Type[Exception], ...]):
+            Exceptions that are part of normal operation, and don't count
+            as failures
+    """
+
+    def __init__(
+        self,
+        name,
+        failure_threshold=constants.DEFAULT_CIRCUIT_BREAKER_THRESHOLD,
+        reset_timeout=constants.DEFAULT_CIRCUIT_BREAKER_RESET_TIMEOUT,
+        ignore=(exc.ImageNotFoundError, exc.FileExistsError, exc.CacheMiss),
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.ignore = ignore
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """str: `closed`, `open` or `half-open`"""
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            elif (
+                self._probing or
+                time.time() - self._opened_at < self.reset_timeout
+            ):
+                return 'open'
+            return 'half-open'
+
+    def call(self, fn, *args, **kwargs):
+        """Call `fn`, unless the breaker is open
+
+        Args:
+            fn (Callable): Called with `args` and `kwargs`
+
+        Raises:
+            :class:`exc.CircuitOpenError`: If the breaker is open
+
+        Returns:
+            Any: What `fn` returned
+        """
+        with self._lock:
+            probe = self._opened_at is not None
+            if probe:
+                if (
+                    self._probing or
+                    time.time() - self._opened_at < self.reset_timeout
+                ):
+                    raise exc.CircuitOpenError(self.name)
+                self._probing = True
+
+        try:
+            result = fn(*args, **kwargs)
+        except self.ignore:
+            self._succeeded()
+            raise
+        except Exception:
+            self._failed(probe)
+            raise
+        else:
+            self._succeeded()
+            return result
+
+    def _succeeded(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info('Circuit breaker closed: {}'.format(self.name))
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def _failed(self, probe):
+        with self._lock:
+            self._failures += 1
+            if probe or self._failures >= self.failure_threshold:
+                if not probe:
+                    logger.warning(
+                        'Circuit breaker opened: {}'.format(self.name)
+                    )
+                self._opened_at = time.time()
+                self._probing = False
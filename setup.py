@@ -35,15 +35,16 @@ setup(
     install_requires=[
         'argh',
         'Flask',
+        'futures; python_version < "3"',
         'pilkit',
         'Pillow',
     ],
     extras_require={
         'svg': ['cairosvg'],
-        'redis': ['redis'],
+        'redis': ['redis>=3.5'],
         's3': ['boto3'],
         'full': (
-            ['redis', 'boto3'] +
+            ['redis>=3.5', 'boto3'] +
             (['cairosvg'] if sys.version_info >= (3, 4) else [])
         ),
         'test': [
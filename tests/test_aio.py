@@ -0,0 +1,155 @@
+import asyncio
+import os
+import uuid
+
+import pytest
+
+from flask_resize import aio, bloom, cache, exc, resizing, storage
+from flask_resize.configuration import Config
+
+from .decorators import requires_redis
+
+
+def _run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+@pytest.fixture
+def async_resizer(tmpdir):
+    return aio.AsyncResizer(
+        storage_backend=aio.ThreadedStorage(
+            storage.FileStorage(base_path=str(tmpdir))
+        ),
+        cache_store=aio.ThreadedCache(cache.NoopCache()),
+        base_url='/',
+    )
+
+
+def test_async_resize(tmpdir, image1_data, async_resizer):
+    tmpdir.join('file1.png').write_binary(image1_data)
+    target = async_resizer._make_target('file1.png', '100x100')
+
+    url = _run(async_resizer('file1.png', '100x100'))
+    assert url == '/' + target.unique_key
+    assert tmpdir.join(target.unique_key).check()
+
+    # Same key as the synchronous resizer
+    resizer = resizing.Resizer(
+        storage_backend=storage.FileStorage(base_path=str(tmpdir)),
+        cache_store=cache.NoopCache(),
+        base_url='/',
+    )
+    assert resizer('file1.png', '100x100') == url
+
+    with pytest.raises(exc.ImageNotFoundError):
+        _run(async_resizer('file2.png', '100x100'))
+
+    url = _run(async_resizer('file2.png', '100x100', placeholder=True))
+    assert tmpdir.join(url.lstrip('/')).check()
+
+    # Known to be missing before this placeholder was generated
+    async_resizer.missing_source_ttl = 60
+    _run(async_resizer.cache_store.mark_missing('file3.png', 60))
+    with pytest.raises(exc.ImageNotFoundError):
+        _run(async_resizer('file3.png', '100x100'))
+    url = _run(async_resizer('file3.png', '50x50', placeholder=True))
+    assert tmpdir.join(url.lstrip('/')).check()
+
+
+def test_async_resize_many(tmpdir, image1_data, image2_data, async_resizer):
+    tmpdir.join('file1.png').write_binary(image1_data)
+    tmpdir.join('file2.png').write_binary(image2_data)
+
+    urls = _run(async_resizer.resize_many(
+        ['file1.png', 'file2.png', 'file1.png'], '100x100'
+    ))
+    assert urls == [
+        '/' + async_resizer._make_target(image_url, '100x100').unique_key
+        for image_url in ['file1.png', 'file2.png', 'file1.png']
+    ]
+    for url in urls:
+        assert tmpdir.join(url.lstrip('/')).check()
+    assert async_resizer._in_flight == {}
+
+
+def test_make_async_resizer(tmpdir):
+    async_resizer = aio.make_async_resizer(Config(
+        url='/',
+        root=str(tmpdir),
+        cache_store='noop',
+    ))
+    assert isinstance(async_resizer.storage_backend, aio.ThreadedStorage)
+    assert isinstance(async_resizer.cache_store, aio.ThreadedCache)
+
+
+def test_async_resize_existence_filter(tmpdir, image1_data, async_resizer):
+    tmpdir.join('file1.png').write_binary(image1_data)
+    existence_filter = bloom.FileBloomFilter(
+        str(tmpdir.join('bloom')),
+        capacity=1000,
+    )
+    existence_filter.mark_ready()
+    async_resizer.existence_filter = existence_filter
+    target = async_resizer._make_target('file1.png', '100x100')
+
+    # Generated elsewhere, so only the storage backend knows about it
+    tmpdir.join(target.unique_key).write_binary(b'', ensure=True)
+    url = _run(async_resizer('file1.png', '100x100'))
+    assert url == '/' + target.unique_key
+    assert tmpdir.join(target.unique_key).read_binary() == b''
+    assert existence_filter.might_contain(target.unique_key) is True
+
+
+@requires_redis
+def test_make_async_resizer_compact_keys(tmpdir):
+    config = Config(
+        url='/',
+        root=str(tmpdir),
+        cache_store='redis',
+        redis_compact_keys=True,
+        shard_depth=1,
+    )
+    async_resizer = aio.make_async_resizer(config)
+    unique_key = async_resizer._make_target('file1.png', '100x').unique_key
+
+    # Stored in the same form as by the synchronous cache
+    encoded = async_resizer.cache_store._encode(unique_key)
+    assert encoded != unique_key
+    assert encoded == cache.make(config)._encode(unique_key)
+
+
+@requires_redis
+def test_async_redis_cache():
+    async_cache = aio.AsyncRedisCache(
+        host=os.environ.get('REDIS_HOST', 'localhost'),
+        key='flask-resize-redis-test-{}'.format(uuid.uuid4().hex),
+    )
+
+    async def check():
+        assert await async_cache.exists('hello') is False
+        assert await async_cache.add('hello') is True
+        assert await async_cache.exists('hello') is True
+        assert await async_cache.remove('hello') is True
+
+        assert await async_cache.is_missing('source') is False
+        await async_cache.mark_missing('source', 10)
+        assert await async_cache.is_missing('source') is True
+
+        async with async_cache.transaction('hello') as successful:
+            assert successful is True
+            async with async_cache.transaction('hello') as successful2:
+                assert successful2 is False
+            assert await async_cache.wait('hello', 0.1) is False
+        assert await async_cache.wait('hello', 0.1) is False
+        await async_cache.add('hello')
+        assert await async_cache.wait('hello', 0.1) is True
+
+        await async_cache.redis.delete(
+            async_cache._get_missing_key('source')
+        )
+
+    _run(check())
@@ -60,6 +60,27 @@ def test_bin_list_has_images(
     assert run(env, 'flask-resize', 'list', 'images') == [image1_key]
 
 
+@slow
+def test_bin_list_images_progress(
+    env,
+    resizetarget_opts,
+    image1_name,
+    image1_data,
+    image1_key
+):
+    resize_target = flask_resize.ResizeTarget(**resizetarget_opts)
+
+    resize_target.image_store.save(image1_name, image1_data)
+    resize_target.generate()
+    output = subprocess.check_output(
+        ['flask-resize', 'list', 'images', '--progress'],
+        env=env,
+        stderr=subprocess.STDOUT,
+    ).decode().splitlines()
+    assert output[0] == image1_key
+    assert output[1].startswith('Listed 1 images')
+
+
 @requires_redis
 @slow
 def test_bin_list_cache_empty(env, redis_cache):
@@ -119,3 +140,118 @@ def test_bin_sync_cache(
     run(env, 'flask-resize', 'sync', 'cache')
 
     assert run(env, 'flask-resize', 'list', 'images') == [image1_key]
+
+
+@slow
+def test_bin_migrate_shards(
+    env,
+    tmpdir,
+    resizetarget_opts,
+    image1_name,
+    image1_data,
+    image1_key
+):
+    resize_target = flask_resize.ResizeTarget(**resizetarget_opts)
+
+    resize_target.image_store.save(image1_name, image1_data)
+    resize_target.generate()
+
+    bloom_path = str(tmpdir.join('bloom'))
+    with open(env['FLASK_RESIZE_CONF'], 'a') as fp:
+        fp.write(
+            "\nRESIZE_BLOOM_FILTER = 'file'"
+            "\nRESIZE_BLOOM_FILTER_PATH = '{}'\n"
+            .format(bloom_path.replace('\\', '\\\\'))
+        )
+    assert run(env, 'flask-resize', 'build', 'bloom') == ['Added 1 images']
+
+    with open(env['FLASK_RESIZE_CONF'], 'a') as fp:
+        fp.write('\nRESIZE_SHARD_DEPTH = 2\n')
+
+    directory, filename = image1_key.rsplit('/', 1)
+    expected_key = '/'.join([directory, filename[:2], filename[2:4], filename])
+
+    assert run(env, 'flask-resize', 'migrate', 'shards') == [
+        'Moved {} to {}'.format(image1_key, expected_key)
+    ]
+    assert run(env, 'flask-resize', 'list', 'images') == [expected_key]
+    assert run(env, 'flask-resize', 'migrate', 'shards') == []
+
+    # Still known to exist at the new path
+    existence_filter = flask_resize.bloom.FileBloomFilter(bloom_path)
+    assert existence_filter.might_contain(expected_key) is True
+
+
+@requires_redis
+@slow
+def test_bin_clear_source(
+    env,
+    resizetarget_opts,
+    image1_name,
+    image1_data,
+    image1_key,
+    redis_cache
+):
+    resizetarget_opts.update(cache_store=redis_cache)
+    resize_target = flask_resize.ResizeTarget(**resizetarget_opts)
+
+    resize_target.image_store.save(image1_name, image1_data)
+    resize_target.generate()
+
+    assert run(env, 'flask-resize', 'clear', 'source', 'other.png') == []
+    assert run(env, 'flask-resize', 'clear', 'source', image1_name) == \
+        [image1_key]
+    assert run(env, 'flask-resize', 'list', 'images') == []
+
+
+@slow
+def test_bin_build_bloom(
+    env,
+    tmpdir,
+    resizetarget_opts,
+    image1_name,
+    image1_data
+):
+    resize_target = flask_resize.ResizeTarget(**resizetarget_opts)
+
+    resize_target.image_store.save(image1_name, image1_data)
+    resize_target.generate()
+
+    with open(env['FLASK_RESIZE_CONF'], 'a') as fp:
+        fp.write(
+            "\nRESIZE_BLOOM_FILTER = 'file'"
+            "\nRESIZE_BLOOM_FILTER_PATH = '{}'\n"
+            .format(str(tmpdir.join('bloom')).replace('\\', '\\\\'))
+        )
+
+    assert run(env, 'flask-resize', 'build', 'bloom') == ['Added 1 images']
+
+    existence_filter = flask_resize.bloom.FileBloomFilter(
+        str(tmpdir.join('bloom'))
+    )
+    assert existence_filter.might_contain(resize_target.unique_key) is True
+    assert existence_filter.might_contain('resized-images/other.png') is False
+
+
+@requires_redis
+@slow
+def test_bin_worker(env, image1_name, image1_data, redis_cache):
+    with open(env['FLASK_RESIZE_CONF'], 'a') as fp:
+        fp.write('\nRESIZE_GENERATION_QUEUE = True\n')
+    config = flask_resize.configuration.Config.from_pyfile(
+        env['FLASK_RESIZE_CONF']
+    )
+    resizer = flask_resize.make_resizer(config)
+    resizer.storage_backend.save(image1_name, image1_data)
+    key = resizer(image1_name, '100x')[len(config.url) + 1:]
+
+    try:
+        assert run(env, 'flask-resize', 'worker', '--burst') == [
+            'Generated {}'.format(key)
+        ]
+        assert run(env, 'flask-resize', 'list', 'images') == [key]
+    finally:
+        redis = resizer.job_queue.redis
+        keys = list(redis.scan_iter(match=resizer.job_queue.key + '*'))
+        if keys:
+            redis.delete(*keys)
@@ -0,0 +1,99 @@
+import pytest
+
+from flask_resize import bloom, cache, exc, resizing, storage
+
+from .decorators import requires_redis
+
+
+def _check_filter(existence_filter):
+    existence_filter.add('resized-images/a.png')
+    assert existence_filter.might_contain('resized-images/b.png') is True
+
+    existence_filter.add_many(['resized-images/b.png'])
+    existence_filter.mark_ready()
+    assert existence_filter.might_contain('resized-images/a.png') is True
+    assert existence_filter.might_contain('resized-images/b.png') is True
+    assert existence_filter.might_contain('resized-images/c.png') is False
+
+    existence_filter.clear()
+    assert existence_filter.might_contain('resized-images/c.png') is True
+
+
+def test_file_bloom_filter(tmpdir):
+    path = str(tmpdir.join('bloom'))
+    _check_filter(bloom.FileBloomFilter(path, capacity=1000))
+
+    existence_filter = bloom.FileBloomFilter(path, capacity=1000)
+    existence_filter.add('resized-images/a.png')
+    existence_filter.mark_ready()
+
+    reopened = bloom.FileBloomFilter(path, capacity=1000)
+    assert reopened.might_contain('resized-images/a.png') is True
+    assert reopened.might_contain('resized-images/c.png') is False
+
+    resized = bloom.FileBloomFilter(path, capacity=2000)
+    assert resized.might_contain('resized-images/c.png') is True
+    # Other settings use another file, leaving the mapped one alone
+    assert resized.filename != reopened.filename
+    assert reopened.might_contain('resized-images/a.png') is True
+    assert reopened.might_contain('resized-images/c.png') is False
+
+
+@requires_redis
+def test_redis_bloom_filter(redis_cache):
+    existence_filter = bloom.RedisBloomFilter(
+        host=redis_cache.redis,
+        key='-'.join([redis_cache.key, 'bloom']),
+        capacity=1000,
+    )
+    try:
+        _check_filter(existence_filter)
+    finally:
+        existence_filter.clear()
+
+
+def test_bloom_filter_skips_exists(tmpdir, resizetarget_opts, image1_name,
+                                   image1_data):
+    existence_filter = bloom.FileBloomFilter(
+        str(tmpdir.join('bloom')),
+        capacity=1000,
+    )
+    existence_filter.mark_ready()
+    resizetarget_opts.update(existence_filter=existence_filter)
+    resize_target = resizing.ResizeTarget(**resizetarget_opts)
+
+    resize_target.image_store.save(image1_name, image1_data)
+    resize_target.image_store.save(resize_target.unique_key, image1_data)
+
+    # Not in the filter, so the image isn't looked for in the storage backend
+    with pytest.raises(exc.ImageNotFoundError):
+        resize_target.get_path()
+
+    resize_target.image_store.delete(resize_target.unique_key)
+    resize_target.generate()
+    assert existence_filter.might_contain(resize_target.unique_key) is True
+    assert resize_target.get_path() == resize_target.unique_key
+
+
+def test_bloom_filter_added_when_generated_elsewhere(tmpdir, image1_data):
+    tmpdir.join('file1.png').write_binary(image1_data)
+
+    def make(name):
+        existence_filter = bloom.FileBloomFilter(
+            str(tmpdir.join(name)),
+            capacity=1000,
+        )
+        existence_filter.mark_ready()
+        return resizing.Resizer(
+            storage_backend=storage.FileStorage(base_path=str(tmpdir)),
+            cache_store=cache.NoopCache(),
+            base_url='/',
+            existence_filter=existence_filter,
+        )
+
+    url = make('bloom1')('file1.png', '10x')
+    # The other instance's filter doesn't know about it, so it generates
+    # the image again, and keeps the existing one
+    resizer = make('bloom2')
+    assert resizer('file1.png', '10x') == url
+    assert resizer.existence_filter.might_contain(url.lstrip('/')) is True
@@ -1,6 +1,9 @@
+import os
+import weakref
+
 import pytest
 
-from flask_resize import exc, resizing
+from flask_resize import cache, configuration, exc, resizing
 
 from .decorators import requires_redis
 
@@ -24,3 +27,348 @@ def test_redis_cache(redis_cache, resizetarget_opts, image1_data, image1_name):
 
     redis_cache.remove(resize_target.unique_key)
     assert redis_cache.exists(resize_target.unique_key) is False
+
+
+@requires_redis
+def test_redis_cache_many(redis_cache):
+    assert redis_cache.add_many(['a', 'b', 'c']) is True
+    assert set(redis_cache.all()) == {'a', 'b', 'c'}
+
+    assert redis_cache.remove_many(['a', 'b']) is True
+    assert redis_cache.all() == ['c']
+    assert redis_cache.remove_many(['a']) is False
+
+
+@requires_redis
+def test_redis_cache_variants(redis_cache):
+    assert redis_cache.add_variant('a.png', 'resized-images/1.png') is True
+    assert redis_cache.add_variant('a.png', 'resized-images/2.png') is True
+    assert redis_cache.add_variant('b.png', 'resized-images/3.png') is True
+
+    assert set(redis_cache.variants('a.png')) == \
+        {'resized-images/1.png', 'resized-images/2.png'}
+
+    assert redis_cache.remove_variants('a.png') is True
+    assert redis_cache.variants('a.png') == []
+    assert redis_cache.variants('b.png') == ['resized-images/3.png']
+    assert redis_cache.replace_variants({
+        'resized-images/1.png': 'resized-images/ab/1.png',
+    }) is False
+    assert redis_cache.variants('a.png') == []
+
+    assert redis_cache.replace_variants({
+        'resized-images/3.png': 'resized-images/ab/3.png',
+    }) is True
+    assert redis_cache.variants('b.png') == ['resized-images/ab/3.png']
+    assert redis_cache.replace_variants({
+        'resized-images/ab/3.png': None,
+    }) is True
+    assert redis_cache.variants('b.png') == []
+    redis_cache.add_variant('b.png', 'resized-images/3.png')
+
+    redis_cache.clear()
+    assert redis_cache.variants('b.png') == []
+    assert not redis_cache.redis.exists(redis_cache.variant_sources_key)
+
+
+def test_noop_cache_variants(filestorage):
+    noop_cache = cache.NoopCache(image_store=filestorage)
+
+    assert noop_cache.add_variant('a.png', 'resized-images/1.png') is True
+    assert noop_cache.add_variant('a.png', 'resized-images/1.png') is False
+    assert noop_cache.add_variant('a.png', 'resized-images/2.png') is True
+
+    assert set(noop_cache.variants('a.png')) == \
+        {'resized-images/1.png', 'resized-images/2.png'}
+    assert noop_cache.variants('b.png') == []
+
+    assert noop_cache.replace_variants({
+        'resized-images/1.png': 'resized-images/ab/1.png',
+        'resized-images/2.png': None,
+        'resized-images/3.png': None,
+    }) is True
+    assert noop_cache.variants('a.png') == ['resized-images/ab/1.png']
+
+    assert noop_cache.remove_variants('a.png') is True
+    assert noop_cache.variants('a.png') == []
+    assert noop_cache.replace_variants({
+        'resized-images/ab/1.png': 'resized-images/1.png',
+    }) is False
+    assert noop_cache.variants('a.png') == []
+
+    assert cache.NoopCache().variants('a.png') == []
+
+    # The index is opt-in, as it costs a write per generated image
+    config = configuration.Config(cache_store='noop')
+    assert cache.make(config, filestorage).image_store is None
+    config.noop_cache_index = True
+    assert cache.make(config, filestorage).image_store is filestorage
+
+
+@requires_redis
+def test_redis_cache_access_tracking(redis_cache):
+    redis_cache.access_flush_size = 2
+
+    redis_cache.touch('a', size=10)
+    # Buffered until flushed
+    assert redis_cache.redis.zcard(redis_cache.access_key) == 0
+    redis_cache.touch('b', size=20)
+    assert redis_cache.redis.zcard(redis_cache.access_key) == 2
+
+    redis_cache.touch('c', size=30)
+    redis_cache.touch('a')
+
+    assert redis_cache.usage() == (3, 60)
+    assert redis_cache.least_recently_used(2) == [('b', 20), ('c', 30)]
+
+    assert redis_cache.forget(['b', 'c']) is True
+    assert redis_cache.least_recently_used(10) == [('a', 10)]
+
+    # A running total is kept, once it's been initialised from the sizes
+    assert redis_cache.usage() == (1, 10)
+    redis_cache.touch('a', size=15)
+    redis_cache.touch('d', size=5)
+    assert redis_cache.usage() == (2, 20)
+    redis_cache.redis.set(redis_cache.total_size_key, 1000)
+    assert redis_cache.usage() == (2, 1000)
+    redis_cache.redis.delete(redis_cache.total_size_key)
+    assert redis_cache.usage() == (2, 20)
+
+
+@requires_redis
+def test_redis_cache_flush_at_exit(redis_cache):
+    redis_cache.touch('a', size=10)
+    assert redis_cache.redis.zcard(redis_cache.access_key) == 0
+    cache._flush_at_exit(weakref.ref(redis_cache))
+    assert redis_cache.redis.zcard(redis_cache.access_key) == 1
+
+
+def test_compact_key_codec():
+    codec = cache.CompactKeyCodec(shard_depth=1)
+    unique_key = \
+        'resized-images/e1/e1307a6b8f166778588914d5130bd92bcd7f20ca.jpg'
+
+    encoded = codec.encode(unique_key)
+    assert len(encoded) == 22
+    assert codec.decode(encoded) == unique_key
+
+    for other_key in ['resized-images/e1307a6b8f.jpg',
+                      'resized-images/e1/e1307a6b8f.gif',
+                      'resized-images/xy/xyz.jpg',
+                      'other-directory/e1/e1307a6b8f.jpg']:
+        assert codec.encode(other_key) == other_key
+        assert codec.decode(other_key.encode()) == other_key
+
+
+@requires_redis
+def test_redis_cache_compact_keys(redis_cache):
+    unique_key = 'resized-images/e1307a6b8f166778588914d5130bd92bcd7f20ca.jpg'
+    redis_cache.add('resized-images/plain.png')
+    redis_cache.key_codec = cache.CompactKeyCodec()
+
+    assert redis_cache.add(unique_key) is True
+    assert redis_cache.exists(unique_key)
+    assert set(redis_cache.all()) == \
+        {unique_key, 'resized-images/plain.png'}
+    assert redis_cache.redis.sismember(
+        redis_cache.key,
+        redis_cache.key_codec.encode(unique_key),
+    )
+
+    redis_cache.add_variant('a.png', unique_key)
+    assert redis_cache.variants('a.png') == [unique_key]
+
+    redis_cache.access_flush_size = 1
+    redis_cache.touch(unique_key, size=10)
+    assert redis_cache.least_recently_used(1) == [(unique_key, 10)]
+
+    redis_cache.key_codec = None
+    assert not redis_cache.exists(unique_key)
+    assert unique_key in redis_cache.all()
+
+    # Sharded keys read back with the configured layout after compact keys
+    # are turned off
+    sharded_key = \
+        'resized-images/e1/e1307a6b8f166778588914d5130bd92bcd7f20ca.jpg'
+    redis_cache.key_codec = cache.CompactKeyCodec(shard_depth=1)
+    redis_cache.add(sharded_key)
+    redis_cache.compact_keys = False
+    assert not redis_cache.exists(sharded_key)
+    assert sharded_key in redis_cache.all()
+
+
+@requires_redis
+def test_redis_cache_missing(redis_cache):
+    assert redis_cache.is_missing('a.png') is False
+    assert redis_cache.mark_missing('a.png', 60) is True
+    assert redis_cache.is_missing('a.png') is True
+    assert redis_cache.unmark_missing('a.png') is True
+    assert redis_cache.is_missing('a.png') is False
+
+    redis_cache.mark_missing('a.png', 60)
+    redis_cache.clear()
+    assert redis_cache.is_missing('a.png') is False
+
+
+def test_noop_cache_missing():
+    noop_cache = cache.NoopCache()
+
+    assert noop_cache.is_missing('a.png') is False
+    assert noop_cache.mark_missing('a.png', 60) is True
+    assert noop_cache.is_missing('a.png') is True
+    assert noop_cache.unmark_missing('a.png') is True
+    assert noop_cache.is_missing('a.png') is False
+
+    noop_cache.mark_missing('a.png', 0)
+    assert noop_cache.is_missing('a.png') is False
+
+
+@pytest.fixture
+def sqlite_cache(tmpdir):
+    return cache.SQLiteCache(str(tmpdir.join('cache.sqlite')))
+
+
+def test_sqlite_cache(sqlite_cache, resizetarget_opts, image1_data,
+                      image1_name):
+    resizetarget_opts.update(cache_store=sqlite_cache)
+    resize_target = resizing.ResizeTarget(**resizetarget_opts)
+
+    with pytest.raises(exc.CacheMiss):
+        resize_target.get_cached_path()
+
+    resize_target.image_store.save(image1_name, image1_data)
+    resize_target.generate()
+
+    assert sqlite_cache.exists(resize_target.unique_key) is True
+    assert resize_target.get_cached_path() == resize_target.unique_key
+    assert sqlite_cache.variants(image1_name) == [resize_target.unique_key]
+
+    # Shared with other connections to the same database
+    other_cache = cache.SQLiteCache(sqlite_cache.path)
+    assert other_cache.exists(resize_target.unique_key) is True
+
+    assert sqlite_cache.remove(resize_target.unique_key) is True
+    assert other_cache.exists(resize_target.unique_key) is False
+
+
+def test_sqlite_cache_many(sqlite_cache):
+    assert sqlite_cache.add_many(['a', 'b', 'c']) is True
+    assert sqlite_cache.add_many(['a']) is False
+    assert set(sqlite_cache.all()) == {'a', 'b', 'c'}
+
+    assert sqlite_cache.remove_many(['a', 'b']) is True
+    assert sqlite_cache.all() == ['c']
+    assert sqlite_cache.remove_many(['a']) is False
+
+    sqlite_cache.add_variant('a.png', 'a')
+    sqlite_cache.add_variant('a.png', 'b')
+    sqlite_cache.add_variant('b.png', 'b')
+    assert sqlite_cache.replace_variants({'a': 'c', 'b': None}) is True
+    assert sqlite_cache.replace_variants({'b': None}) is False
+    assert sqlite_cache.variants('a.png') == ['c']
+    assert sqlite_cache.variants('b.png') == []
+    assert sqlite_cache.clear() is True
+    assert sqlite_cache.all() == []
+    assert sqlite_cache.variants('a.png') == []
+
+
+def test_sqlite_cache_access_tracking(sqlite_cache):
+    sqlite_cache.access_flush_size = 2
+
+    def stored():
+        return sqlite_cache.connection.execute(
+            'SELECT COUNT(*) FROM accesses'
+        ).fetchone()[0]
+
+    sqlite_cache.touch('a', size=10)
+    # Buffered until flushed
+    assert stored() == 0
+    sqlite_cache.touch('b', size=20)
+    assert stored() == 2
+    sqlite_cache.touch('a')
+
+    assert sqlite_cache.usage() == (2, 30)
+    assert sqlite_cache.least_recently_used(1) == [('b', 20)]
+    assert sqlite_cache.forget(['b']) is True
+    assert sqlite_cache.least_recently_used(10) == [('a', 10)]
+
+
+def test_sqlite_cache_missing(sqlite_cache):
+    assert sqlite_cache.is_missing('a.png') is False
+    assert sqlite_cache.mark_missing('a.png', 60) is True
+    assert sqlite_cache.is_missing('a.png') is True
+    assert sqlite_cache.unmark_missing('a.png') is True
+    assert sqlite_cache.is_missing('a.png') is False
+
+    sqlite_cache.mark_missing('a.png', 0)
+    assert sqlite_cache.is_missing('a.png') is False
+
+
+def test_sqlite_cache_transaction(sqlite_cache):
+    other_cache = cache.SQLiteCache(sqlite_cache.path)
+
+    with sqlite_cache.transaction('a') as acquired:
+        assert acquired is True
+        with other_cache.transaction('a') as other_acquired:
+            assert other_acquired is False
+        with other_cache.transaction('b') as other_acquired:
+            assert other_acquired is True
+
+    with other_cache.transaction('a') as other_acquired:
+        assert other_acquired is True
+
+    with sqlite_cache.transaction('a', ttl=0):
+        # Expired locks are taken over
+        with other_cache.transaction('a') as other_acquired:
+            assert other_acquired is True
+
+
+def test_shared_memory_cache(tmpdir, sqlite_cache):
+    path = str(tmpdir.join('shared'))
+    shared_cache = cache.SharedMemoryCache(sqlite_cache, path, slots=64)
+    # Another process' view of the same table, with no keys of its own
+    other_cache = cache.SharedMemoryCache(cache.NoopCache(), path, slots=64)
+
+    assert other_cache.exists('a') is False
+    assert shared_cache.add_many(['a', 'b']) is True
+    assert other_cache.exists('a') is True
+    assert other_cache.exists('b') is True
+
+    # Another number of slots uses another file, leaving the mapped one alone
+    resized_cache = cache.SharedMemoryCache(cache.NoopCache(), path, slots=32)
+    assert resized_cache.filename != shared_cache.filename
+    assert resized_cache.exists('a') is False
+    assert other_cache.exists('a') is True
+
+    assert shared_cache.remove('a') is True
+    assert other_cache.exists('a') is False
+
+    # Cached in the backend, but not yet in the table
+    sqlite_cache.add('c')
+    assert other_cache.exists('c') is False
+    assert shared_cache.exists('c') is True
+    assert other_cache.exists('c') is True
+
+    assert shared_cache.clear() is True
+    assert other_cache.exists('b') is False
+    assert shared_cache.exists('b') is False
+
+
+def test_shared_memory_cache_bounded(tmpdir):
+    path = str(tmpdir.join('shared'))
+    shared_cache = cache.SharedMemoryCache(cache.NoopCache(), path, slots=4)
+    size = os.path.getsize(shared_cache.filename)
+
+    shared_cache.add_many(str(i) for i in range(100))
+    assert os.path.getsize(shared_cache.filename) == size
+    assert sum(shared_cache.exists(str(i)) for i in range(100)) <= \
+        shared_cache.slots + shared_cache.max_probes
+
+
+def test_shared_memory_cache_ttl(tmpdir):
+    path = str(tmpdir.join('shared'))
+    shared_cache = cache.SharedMemoryCache(
+        cache.NoopCache(), path, slots=64, ttl=0
+    )
+    shared_cache.add('a')
+    assert shared_cache.exists('a') is False
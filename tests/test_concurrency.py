@@ -1,3 +1,4 @@
+import time
 from multiprocessing.dummy import Pool
 
 import pytest
@@ -45,18 +46,20 @@ def test_generate_in_progress_resizer_option_true(
         redis_host=redis_cache.redis,
         raise_on_generate_in_progress=True
     )
-    resizer = flask_resize.make_resizer(config)
+    # Threads share generations within a resizer, so use one per thread
+    # like separate processes would
+    resizers = [flask_resize.make_resizer(config) for i in range(2)]
 
     # Save original file
-    resizer.storage_backend.save(image1_name, image1_data)
+    resizers[0].storage_backend.save(image1_name, image1_data)
 
-    def run(x):
+    def run(resizer):
         return resizer(image1_name)
 
     pool = Pool(2)
 
     with pytest.raises(flask_resize.exc.GenerateInProgress):
-        pool.map(run, [None] * 2)
+        pool.map(run, resizers)
 
 
 @requires_redis
@@ -84,3 +87,147 @@ def test_generate_in_progress_resizer_option_false(
     pool = Pool(2)
     data = pool.map(run, [None] * 2)
     assert len(data) == 2
+
+
+@requires_redis
+def test_wait_for_transaction(redis_cache):
+    pool = Pool(1)
+
+    with redis_cache.transaction('a') as acquired:
+        assert acquired is True
+        result = pool.apply_async(redis_cache.wait, ('a', 10))
+        # Nothing to wait for when no one holds the transaction, but it
+        # only helps if the image was generated
+        assert redis_cache.wait('b', 10) is False
+        redis_cache.add('b')
+        assert redis_cache.wait('b', 10) is True
+        assert redis_cache.wait('a', 0.1) is False
+        redis_cache.add('a')
+    assert result.get(timeout=10) is True
+
+    # Finished without generating the image
+    with redis_cache.transaction('c'):
+        result = pool.apply_async(redis_cache.wait, ('c', 10))
+        redis_cache.wait('c', 0.1)
+    assert result.get(timeout=10) is False
+
+    with pytest.raises(ValueError):
+        with redis_cache.transaction('a'):
+            result = pool.apply_async(redis_cache.wait, ('a', 10))
+            redis_cache.wait('a', 0.1)
+            raise ValueError
+    assert result.get(timeout=10) is False
+
+
+@requires_redis
+def test_generate_in_progress_resizer_wait(
+    redis_cache,
+    image1_data,
+    image1_name,
+    tmpdir
+):
+    config = Config(
+        root=str(tmpdir),
+        url='/',
+        redis_host=redis_cache.redis,
+        redis_key=redis_cache.key,
+        raise_on_generate_in_progress=True,
+        generate_in_progress_timeout=10,
+    )
+    resizer = flask_resize.make_resizer(config)
+
+    # Save original file
+    resizer.storage_backend.save(image1_name, image1_data)
+
+    def run(x):
+        return resizer(image1_name, '100x')
+
+    pool = Pool(4)
+    urls = pool.map(run, [None] * 4)
+    assert len(set(urls)) == 1
+    assert resizer.storage_backend.exists(urls[0].lstrip('/'))
+
+
+@requires_redis
+def test_redis_transaction_lock(redis_cache):
+    tkey = redis_cache._get_transaction_key('a')
+
+    with redis_cache.transaction('a') as acquired:
+        assert acquired is True
+        token = redis_cache.redis.get(tkey)
+        with redis_cache.transaction('a') as other_acquired:
+            assert other_acquired is False
+        # Not released by the one that didn't acquire it
+        assert redis_cache.redis.get(tkey) == token
+    assert redis_cache.redis.exists(tkey) == 0
+
+    with redis_cache.transaction('a'):
+        # Expired and taken over by someone else, who keeps it
+        redis_cache.redis.set(tkey, b'other')
+    assert redis_cache.redis.get(tkey) == b'other'
+    redis_cache.redis.delete(tkey)
+
+    assert redis_cache.lock_stats()['acquired'] == 2
+    assert redis_cache.lock_stats()['contended'] == 1
+
+
+@requires_redis
+def test_redis_transaction_lease_renewal(redis_cache):
+    tkey = redis_cache._get_transaction_key('a')
+
+    with redis_cache.transaction('a', ttl=0.3):
+        time.sleep(0.7)
+        assert redis_cache.redis.exists(tkey) == 1
+        assert redis_cache.lock_stats()['renewed'] >= 1
+
+        redis_cache.redis.set(tkey, b'other')
+        time.sleep(0.3)
+        assert redis_cache.lock_stats()['lost'] == 1
+    redis_cache.redis.delete(tkey)
+
+
+def test_single_flight_generation(tmpdir, image1_data, image1_name):
+    saved = []
+
+    class FileStorage(flask_resize.storage.FileStorage):
+        def save(self, relative_path, bdata):
+            saved.append(relative_path)
+            return super(FileStorage, self).save(relative_path, bdata)
+
+    resizer = flask_resize.resizing.Resizer(
+        storage_backend=FileStorage(base_path=str(tmpdir)),
+        cache_store=flask_resize.cache.NoopCache(),
+        base_url='/',
+    )
+    resizer.storage_backend.save(image1_name, image1_data)
+    del saved[:]
+
+    def run(x):
+        return resizer(image1_name, '100x')
+
+    pool = Pool(8)
+    urls = pool.map(run, [None] * 8)
+    assert len(set(urls)) == 1
+    assert saved == [urls[0].lstrip('/')]
+
+
+def test_file_bloom_filter_concurrent_adds(tmpdir):
+    path = str(tmpdir.join('bloom'))
+    keys = ['resized-images/{}.png'.format(i) for i in range(2000)]
+    # Small enough that concurrent adds often set bits in the same byte
+    filters = [
+        flask_resize.bloom.FileBloomFilter(path, capacity=len(keys))
+        for _ in range(4)
+    ]
+
+    def run(i):
+        existence_filter = filters[i % len(filters)]
+        for key in keys[i::8]:
+            existence_filter.add(key)
+
+    pool = Pool(8)
+    pool.map(run, range(8))
+    pool.close()
+
+    filters[0].mark_ready()
+    assert all(filters[0].might_contain(key) for key in keys)
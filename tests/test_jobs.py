@@ -0,0 +1,137 @@
+import pytest
+
+from flask_resize import jobs, make_resizer
+from flask_resize.configuration import Config
+
+from .decorators import requires_redis
+
+
+@pytest.fixture
+def job_queue(redis_cache):
+    job_queue = jobs.RedisJobQueue(
+        host=redis_cache.redis,
+        key='-'.join([redis_cache.key, 'jobs']),
+        max_retries=1,
+    )
+    yield job_queue
+    keys = list(redis_cache.redis.scan_iter(match=job_queue.key + '*'))
+    if keys:
+        redis_cache.redis.delete(*keys)
+
+
+@requires_redis
+def test_job_queue(job_queue):
+    assert job_queue.push('resized-images/a.png', {'image_url': 'a.png'})
+    assert not job_queue.push('resized-images/a.png', {'image_url': 'a.png'})
+    assert len(job_queue) == 1
+    # Kept until the job is finished, however long it's queued for
+    assert job_queue.redis.ttl(
+        job_queue._get_queued_key('resized-images/a.png')
+    ) > job_queue.lease_time
+
+    job = job_queue.pop('worker-1')
+    assert job.unique_key == 'resized-images/a.png'
+    assert job.args == {'image_url': 'a.png'}
+    assert job_queue.pop('worker-1') is None
+
+    assert job_queue.retry('worker-1', job) is True
+    job = job_queue.pop('worker-1')
+    assert job.attempts == 1
+    assert job_queue.retry('worker-1', job) is False
+    assert len(job_queue) == 0
+    assert [j.attempts for j in job_queue.failed()] == [2]
+
+    # Not queued anymore, so it can be queued again
+    assert job_queue.push('resized-images/a.png', {'image_url': 'a.png'})
+    job = job_queue.pop('worker-1')
+    job_queue.ack('worker-1', job)
+    assert job_queue.recover() == 0
+    assert job_queue.push('resized-images/a.png', {'image_url': 'a.png'})
+
+
+@requires_redis
+def test_job_queue_recover(job_queue):
+    job_queue.push('resized-images/a.png', {'image_url': 'a.png'})
+    job_queue.push('resized-images/b.png', {'image_url': 'b.png'})
+    job_queue.heartbeat('worker-1')
+    job_queue.pop('worker-1')
+    job_queue.pop('worker-2')
+
+    # Only worker-2 has stopped sending heartbeats
+    assert job_queue.recover() == 1
+    assert job_queue.pop('worker-3').unique_key == 'resized-images/b.png'
+
+
+@requires_redis
+def test_worker(tmpdir, image1_data, redis_cache, job_queue):
+    tmpdir.join('file1.png').write_binary(image1_data)
+    resizer = make_resizer(Config(
+        root=str(tmpdir),
+        url='/',
+        redis_host=redis_cache.redis,
+        redis_key=redis_cache.key,
+        generation_queue=True,
+    ))
+
+    urls = [
+        resizer('file1.png', '100x'),
+        resizer('file1.png', '200x', format='jpg', bgcolor='#f00'),
+        resizer('file1.png', '100x'),
+        resizer('missing.png', '100x'),
+    ]
+    keys = [url.lstrip('/') for url in urls]
+    assert resizer.storage_backend.exists_many(keys) == set()
+    assert len(resizer.job_queue) == 3
+
+    worker = jobs.Worker(resizer, resizer.job_queue, concurrency=2)
+    results = {
+        job.unique_key: error for job, error in worker.run(burst=True)
+    }
+    assert set(results) == set(keys)
+    assert results[keys[0]] is None
+    assert results[keys[1]] is None
+    assert results[keys[3]] is not None
+
+    assert resizer.storage_backend.exists_many(keys) == set(keys[:3])
+    assert len(resizer.job_queue) == 0
+    assert resizer.job_queue.failed() == []
+
+    # Queued again, e.g. after the first job was lost, but already generated
+    tmpdir.join(keys[0]).write_binary(b'existing')
+    target = resizer._make_target('file1.png', '100x')
+    assert resizer.job_queue.push(keys[0], target.job_args) is True
+    assert [
+        (job.unique_key, error) for job, error in worker.run(burst=True)
+    ] == [(keys[0], None)]
+    assert tmpdir.join(keys[0]).read_binary() == b'existing'
+
+
+@requires_redis
+def test_worker_recovers_periodically(tmpdir, image1_data, redis_cache,
+                                      job_queue):
+    tmpdir.join('file1.png').write_binary(image1_data)
+    resizer = make_resizer(Config(
+        root=str(tmpdir),
+        url='/',
+        redis_host=redis_cache.redis,
+        redis_key=redis_cache.key,
+        generation_queue=True,
+    ))
+    keys = [
+        resizer('file1.png', dims).lstrip('/') for dims in ('100x', '200x')
+    ]
+    # Taken by a worker that stops without finishing it, recovered when
+    # the new one starts
+    resizer.job_queue.pop('worker-2')
+
+    worker = jobs.Worker(resizer, resizer.job_queue, recover_interval=0)
+    results = worker.run(burst=True)
+    processed = [next(results)[0].unique_key]
+
+    # Taken by a worker that stopped after the new one started
+    resizer('file1.png', '300x')
+    keys.append(resizer.job_queue.pop('worker-3').unique_key)
+
+    processed.extend(job.unique_key for job, _ in results)
+    assert sorted(processed) == sorted(keys)
+    assert resizer.storage_backend.exists_many(keys) == set(keys)
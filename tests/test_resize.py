@@ -1,14 +1,16 @@
 import io
 import re
+import time
 
 import flask
 import pytest
 from PIL import Image
 
-from flask_resize import cache, exc, resizing
+from flask_resize import cache, exc, make_resizer, resizing, storage, utils
+from flask_resize.configuration import Config
 
 from .base import create_resizeapp
-from .decorators import requires_cairosvg, requires_no_cairosvg
+from .decorators import requires_cairosvg, requires_no_cairosvg, requires_redis
 
 
 def test_resizetarget_init(filestorage):
@@ -43,6 +45,20 @@ def test_resizetarget_init(filestorage):
     )
 
 
+def test_resizetarget_sharded_key(filestorage):
+    target = resizing.ResizeTarget(
+        filestorage,
+        'path/to/my/file.png',
+        dimensions='100x50',
+        format='jpeg',
+        shard_depth=2,
+    )
+    assert(
+        target.unique_key ==
+        'resized-images/e1/30/e1307a6b8f166778588914d5130bd92bcd7f20ca.jpg'
+    )
+
+
 def test_resizetarget_generate(
     resizetarget_opts,
     image1_data,
@@ -113,6 +129,149 @@ def test_resize_filter(tmpdir, image1_data, image2_data):
         assert file2_expected_url in rendered
 
 
+def test_resize_many(tmpdir, image1_data, image2_data):
+    tmpdir.join('file1.png').write_binary(image1_data)
+    tmpdir.join('file2.png').write_binary(image2_data)
+
+    app = create_resizeapp(
+        RESIZE_URL='http://test.dev/',
+        RESIZE_ROOT=str(tmpdir),
+    )
+    with app.test_request_context():
+        file1_url = app.resize('file1.png', '100x')
+        urls = app.resize.resize_many(
+            ['file1.png', 'file2.png', 'file1.png'],
+            '100x',
+        )
+        assert urls == [
+            file1_url,
+            app.resize('file2.png', '100x'),
+            file1_url,
+        ]
+
+
+def test_resize_invalidate(tmpdir, image1_data, image2_data):
+    tmpdir.join('file1.png').write_binary(image1_data)
+    tmpdir.join('file2.png').write_binary(image2_data)
+
+    app = create_resizeapp(
+        RESIZE_URL='http://test.dev/',
+        RESIZE_ROOT=str(tmpdir),
+        RESIZE_NOOP_CACHE_INDEX=True,
+    )
+    with app.test_request_context():
+        file1_urls = [
+            app.resize('file1.png', '100x'),
+            app.resize('file1.png', '200x'),
+        ]
+        file2_url = app.resize('file2.png', '100x')
+
+        deleted = app.resize.invalidate('http://test.dev/file1.png')
+
+    assert set(deleted) == set(
+        url[len('http://test.dev/'):] for url in file1_urls
+    )
+    assert app.resize.storage_backend.exists_many(deleted) == set()
+    assert app.resize.storage_backend.exists(
+        file2_url[len('http://test.dev/'):]
+    )
+    assert app.resize.invalidate('file1.png') == []
+
+
+def test_resize_missing_source(tmpdir, image1_data):
+    resizer = make_resizer(Config(
+        root=str(tmpdir),
+        url='/',
+        cache_store='noop',
+        missing_source_ttl=60,
+    ))
+
+    with pytest.raises(exc.ImageNotFoundError):
+        resizer('file1.png', '100x')
+    assert resizer.cache_store.is_missing('file1.png') is True
+
+    # Still remembered as missing, without looking for it again
+    tmpdir.join('file1.png').write_binary(image1_data)
+    with pytest.raises(exc.ImageNotFoundError):
+        resizer('file1.png', '100x')
+    with pytest.raises(exc.ImageNotFoundError):
+        resizer.resize_many(['file1.png'], '100x')
+
+    resizer.invalidate('file1.png')
+    assert resizer.cache_store.is_missing('file1.png') is False
+    assert resizer('file1.png', '100x').endswith('.png')
+
+
+def test_resize_missing_source_placeholder(tmpdir):
+    resizer = make_resizer(Config(
+        root=str(tmpdir),
+        url='/',
+        cache_store='noop',
+        missing_source_ttl=60,
+    ))
+
+    url = resizer('file1.png', '100x100', placeholder=True)
+    assert resizer.cache_store.is_missing('file1.png') is True
+    assert resizer('file1.png', '100x100', placeholder=True) == url
+    assert resizer.resize_many(
+        ['file1.png'], '100x100', placeholder=True
+    ) == [url]
+
+    # Placeholders of other sizes are generated when first asked for
+    url = resizer('file1.png', '50x50', placeholder=True)
+    assert tmpdir.join(url.lstrip('/')).check()
+    url, = resizer.resize_many(['file1.png'], '20x20', placeholder=True)
+    assert tmpdir.join(url.lstrip('/')).check()
+
+
+@requires_redis
+def test_resize_prune(tmpdir, image1_data, redis_cache):
+    tmpdir.join('file1.png').write_binary(image1_data)
+    resizer = make_resizer(Config(
+        root=str(tmpdir),
+        url='/',
+        redis_host=redis_cache.redis,
+        redis_key=redis_cache.key,
+        track_access=True,
+    ))
+
+    urls = [resizer('file1.png', dims) for dims in ('10x', '20x', '30x')]
+    keys = [url.lstrip('/') for url in urls]
+    # Make the first image the most recently used one
+    resizer('file1.png', '10x')
+
+    count, total_size = resizer.cache_store.usage()
+    assert count == 3
+
+    assert list(resizer.prune(max_count=3)) == []
+    assert list(resizer.prune(max_count=1)) == keys[1:]
+    assert resizer.storage_backend.exists_many(keys) == set(keys[:1])
+    assert redis_cache.all() == keys[:1]
+    assert redis_cache.variants('file1.png') == keys[:1]
+
+    assert list(resizer.prune(max_bytes=0)) == keys[:1]
+    assert resizer.cache_store.usage() == (0, 0)
+
+
+def test_resize_get_path_records_size(tmpdir, image1_data):
+    tmpdir.join('file1.png').write_binary(image1_data)
+    config = Config(
+        root=str(tmpdir),
+        url='/',
+        cache_store='sqlite',
+        sqlite_path=str(tmpdir.join('cache.sqlite')),
+        track_access=True,
+    )
+    key = make_resizer(config)('file1.png', '10x').lstrip('/')
+    size = tmpdir.join(key).size()
+
+    # Generated elsewhere, so only found in storage
+    resizer = make_resizer(config)
+    resizer.cache_store.clear()
+    resizer('file1.png', '10x')
+    assert resizer.cache_store.usage() == (1, size)
+
+
 def test_fill_dimensions(tmpdir, image1_data, resizetarget_opts):
     file1 = tmpdir.join('file1.png')
     file1.write_binary(image1_data)
@@ -190,3 +349,121 @@ def test_svg_resize_cairosvgimporterror(tmpdir, resizetarget_opts):
 
     with pytest.raises(exc.CairoSVGImportError):
         resize_target.generate()
+
+
+@pytest.mark.parametrize('fallback', ['key', 'original', 'placeholder'])
+def test_resize_generation_timeout(tmpdir, image1_data, fallback):
+    class SlowFileStorage(storage.FileStorage):
+        def open(self, key):
+            fp = super(SlowFileStorage, self).open(key)
+            time.sleep(0.5)
+            return fp
+
+    resizer = resizing.Resizer(
+        storage_backend=SlowFileStorage(base_path=str(tmpdir)),
+        cache_store=cache.NoopCache(),
+        base_url='/',
+        generation_timeout=0.1,
+        generation_timeout_fallback=fallback,
+    )
+    tmpdir.join('file1.png').write_binary(image1_data)
+    target = resizer._make_target('file1.png', '100x100')
+
+    url = resizer('file1.png', '100x100')
+    assert not resizer.storage_backend.exists(target.unique_key)
+    if fallback == 'key':
+        assert url == '/' + target.unique_key
+    elif fallback == 'original':
+        assert url == '/file1.png'
+    else:
+        assert url != '/' + target.unique_key
+        assert resizer.storage_backend.exists(url.lstrip('/'))
+
+    # Finished in the background
+    resizer.executor.shutdown(wait=True)
+    assert resizer.storage_backend.exists(target.unique_key)
+
+
+def test_resize_generation_timeout_invalid_fallback(filestorage):
+    with pytest.raises(exc.InvalidResizeSettingError):
+        resizing.Resizer(
+            storage_backend=filestorage,
+            cache_store=cache.NoopCache(),
+            base_url='/',
+            generation_timeout_fallback='other',
+        )
+
+
+def test_resize_circuit_breaker(tmpdir, image1_data):
+    class BrokenCache(cache.NoopCache):
+        def exists(self, unique_key):
+            raise IOError('Connection refused')
+
+        def transaction(self, unique_key, ttl=600):
+            raise IOError('Connection refused')
+
+    class BrokenFileStorage(storage.FileStorage):
+        broken = False
+
+        def exists(self, key):
+            if self.broken:
+                raise IOError('Connection refused')
+            return super(BrokenFileStorage, self).exists(key)
+
+    resizer = resizing.Resizer(
+        storage_backend=BrokenFileStorage(base_path=str(tmpdir)),
+        cache_store=BrokenCache(),
+        base_url='/',
+        cache_breaker=utils.CircuitBreaker('cache', failure_threshold=1),
+        storage_breaker=utils.CircuitBreaker('storage', failure_threshold=1),
+    )
+    tmpdir.join('file1.png').write_binary(image1_data)
+
+    # Falls back on cache errors before the breaker opens, too
+    url = resizer('file1.png', '100x')
+    assert resizer.cache_breaker.state == 'open'
+    assert resizer.storage_backend.exists(url.lstrip('/'))
+
+    # Skips the cache store, and generates without a transaction
+    url = resizer('file1.png', '150x')
+    assert resizer.storage_backend.exists(url.lstrip('/'))
+
+    resizer.storage_backend.broken = True
+    with pytest.raises(IOError):
+        resizer('file1.png', '200x')
+    assert resizer.storage_breaker.state == 'open'
+
+    # Skips the storage backend, returning the URL the image would have
+    target = resizer._make_target('file1.png', '200x')
+    assert resizer('file1.png', '200x') == '/' + target.unique_key
+
+    # Not known to exist, so not cached
+    class RecordingCache(cache.NoopCache):
+        def add(self, unique_key):
+            added.append(unique_key)
+            return True
+
+    added = []
+    resizer.cache_breaker = None
+    resizer.cache_store = RecordingCache()
+    assert resizer.resize_many(['file1.png'], '200x') == \
+        ['/' + target.unique_key]
+    assert added == []
+
+
+def test_resizetarget_generate_returns_bytes(
+    resizetarget_opts,
+    image1_data,
+    image1_name,
+    image1_key
+):
+    resize_target = resizing.ResizeTarget(**resizetarget_opts)
+    resize_target.image_store.save(image1_name, image1_data)
+
+    data = resize_target.generate()
+    assert isinstance(data, bytes)
+    assert data == resize_target.image_store.get(image1_key)
+
+    resize_target.image_store.delete(image1_key)
+    view = resize_target.generate_view()
+    assert bytes(view) == data
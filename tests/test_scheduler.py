@@ -0,0 +1,108 @@
+import threading
+import time
+
+from flask_resize import cache, resizing, scheduler, storage
+
+
+def _run(generation_scheduler, pixels, priority=0, hold=0.05, log=None):
+    with generation_scheduler.admit(pixels, priority=priority):
+        if log is not None:
+            log.append(priority)
+        time.sleep(hold)
+
+
+def _wait_until_queued(generation_scheduler, count):
+    while generation_scheduler.stats()['queued'] < count:
+        time.sleep(0.01)
+
+
+def test_scheduler_max_concurrency():
+    generation_scheduler = scheduler.Scheduler(max_concurrency=2)
+    running = []
+    lock = threading.Lock()
+
+    def generate():
+        with generation_scheduler.admit(100):
+            with lock:
+                running.append(generation_scheduler.stats()['running'])
+            time.sleep(0.05)
+
+    threads = [threading.Thread(target=generate) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert max(running) == 2
+    stats = generation_scheduler.stats()
+    assert stats['running'] == 0
+    assert stats['running_pixels'] == 0
+    assert stats['queued'] == 0
+    assert stats['admitted'] == 6
+    assert stats['waited'] >= 4
+    assert stats['max_wait_time'] >= 0.05
+    assert stats['total_wait_time'] >= stats['max_wait_time']
+
+
+def test_scheduler_max_pixels():
+    generation_scheduler = scheduler.Scheduler(max_pixels=1000)
+    generation_scheduler.acquire(600)
+
+    # Doesn't fit next to what's running
+    t = threading.Thread(target=_run, args=(generation_scheduler, 600))
+    t.start()
+    _wait_until_queued(generation_scheduler, 1)
+    assert generation_scheduler.stats()['running_pixels'] == 600
+
+    generation_scheduler.release(600)
+    t.join()
+
+    # Too big for the budget, but nothing else is running
+    _run(generation_scheduler, 5000, hold=0)
+    assert generation_scheduler.stats()['admitted'] == 3
+
+
+def test_scheduler_priority():
+    generation_scheduler = scheduler.Scheduler(max_concurrency=1)
+    generation_scheduler.acquire(1)
+    log = []
+    threads = []
+    for i, priority in enumerate([5, 0, 1, 0]):
+        t = threading.Thread(
+            target=_run,
+            args=(generation_scheduler, 1, priority, 0, log),
+        )
+        t.start()
+        threads.append(t)
+        _wait_until_queued(generation_scheduler, i + 1)
+
+    generation_scheduler.release(1)
+    for t in threads:
+        t.join()
+    assert log == [0, 0, 1, 5]
+
+
+def test_resize_scheduler(tmpdir, image1_data):
+    generation_scheduler = scheduler.Scheduler(max_concurrency=1)
+    resizer = resizing.Resizer(
+        storage_backend=storage.FileStorage(base_path=str(tmpdir)),
+        cache_store=cache.NoopCache(),
+        base_url='/',
+        scheduler=generation_scheduler,
+    )
+    tmpdir.join('file1.png').write_binary(image1_data)
+
+    resizer('file1.png', '100x100')
+    stats = generation_scheduler.stats()
+    assert stats['admitted'] == 1
+    assert stats['running'] == 0
+
+
+def test_make_scheduler():
+    config = resizing.Config(generation_max_concurrency=None)
+    assert scheduler.make(config) is None
+
+    config = resizing.Config(generation_max_pixels=1000)
+    generation_scheduler = scheduler.make(config)
+    assert generation_scheduler.max_pixels == 1000
+    assert generation_scheduler.max_concurrency is None
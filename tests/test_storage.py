@@ -1,9 +1,12 @@
+import hashlib
+import io
 import os
+import time
 
 import pytest
 
 import flask_resize
-from flask_resize._compat import boto3
+from flask_resize._compat import boto3, botocore
 
 from ._mocking import mock_s3
 from .decorators import requires_boto3
@@ -28,7 +31,11 @@ def test_file_storage(filestorage, tmpdir):
     assert excinfo.value.errno == 2
 
     filestorage.save('subdir/file2.txt', b'content2')
-    filestorage.save('subdir/subsubdir/file3.txt', b'content3')
+    filestorage.save('subdir/subsubdir/file3.txt', io.BytesIO(b'content3'))
+    assert filestorage.get('subdir/subsubdir/file3.txt') == b'content3'
+    assert filestorage.size('subdir/file2.txt') == 8
+    with pytest.raises(flask_resize.exc.ImageNotFoundError):
+        filestorage.size('subdir/file1.txt')
 
     expected_relpaths = set(['subdir/file2.txt', 'subdir/subsubdir/file3.txt'])
 
@@ -37,6 +44,96 @@ def test_file_storage(filestorage, tmpdir):
     assert list(filestorage.delete_tree('subdir')) == []
 
 
+def test_file_storage_open(filestorage, tmpdir):
+    filestorage.save('subdir/file1.txt', b'content')
+    filestorage.save('subdir/empty.txt', b'')
+
+    fp = filestorage.open('subdir/file1.txt')
+    try:
+        assert fp.read(3) == b'con'
+        fp.seek(0)
+        assert fp.read() == b'content'
+    finally:
+        fp.close()
+
+    fp = filestorage.open('subdir/empty.txt')
+    try:
+        assert fp.read() == b''
+    finally:
+        fp.close()
+
+    with pytest.raises(flask_resize.exc.ImageNotFoundError):
+        filestorage.open('subdir/missing.txt')
+
+
+def test_file_storage_exists_many(filestorage):
+    filestorage.save('subdir/file1.txt', b'content')
+    filestorage.save('subdir/file2.txt', b'content')
+    filestorage.save('file3.txt', b'content')
+
+    keys = ['subdir/file1.txt', 'subdir/file2.txt', 'subdir/missing.txt',
+            'file3.txt', 'missing/file4.txt', '']
+    expected = set(['subdir/file1.txt', 'subdir/file2.txt', 'file3.txt'])
+
+    assert filestorage.exists_many(keys) == expected
+
+    filestorage.scandir_threshold = 1
+    assert filestorage.exists_many(keys) == expected
+
+
+def test_file_storage_delete_many(filestorage):
+    filestorage.save('subdir/file1.txt', b'content')
+    filestorage.save('subdir/ab/file2.txt', b'content')
+
+    keys = ['subdir/file1.txt', 'subdir/ab/file2.txt', 'subdir/missing.txt']
+    assert list(filestorage.delete_many(keys)) == keys
+    assert filestorage.exists_many(keys) == set()
+
+
+def test_file_storage_move(filestorage):
+    filestorage.save('subdir/file1.txt', b'content1')
+    filestorage.save('subdir/file2.txt', b'content2')
+
+    filestorage.move('subdir/file1.txt', 'subdir/ab/file1.txt')
+    assert filestorage.exists('subdir/file1.txt') is False
+    assert filestorage.get('subdir/ab/file1.txt') == b'content1'
+
+    with pytest.raises(flask_resize.exc.FileExistsError):
+        filestorage.move('subdir/file2.txt', 'subdir/ab/file1.txt')
+    assert filestorage.get('subdir/file2.txt') == b'content2'
+
+
+def test_file_storage_save_is_atomic(filestorage, tmpdir):
+    filestorage.save('subdir/file1.txt', b'content')
+    assert tmpdir.join('subdir').listdir() == [tmpdir.join('subdir/file1.txt')]
+
+    class Unwritable(object):
+        pass
+
+    with pytest.raises(TypeError):
+        filestorage.save('subdir/file2.txt', Unwritable())
+
+    assert filestorage.exists('subdir/file2.txt') is False
+    assert tmpdir.join('subdir').listdir() == [tmpdir.join('subdir/file1.txt')]
+
+
+def test_file_storage_list_tree_skips_temp_files(filestorage, tmpdir):
+    filestorage.save('subdir/file1.txt', b'content')
+    tmpdir.join('subdir', filestorage.temp_file_prefix + 'abc' +
+                filestorage.temp_file_suffix).write('partial')
+
+    assert list(filestorage.list_tree('subdir')) == ['subdir/file1.txt']
+
+
+def test_file_storage_fsync(tmpdir):
+    filestorage = flask_resize.storage.FileStorage(
+        base_path=str(tmpdir),
+        fsync=True,
+    )
+    filestorage.save('subdir/file1.txt', b'content')
+    assert filestorage.get('subdir/file1.txt') == b'content'
+
+
 @mock_s3
 @requires_boto3
 def test_s3_storage():
@@ -82,3 +179,398 @@ def test_s3_storage():
     assert set(s3_storage.list_tree('subdir')) == expected_relpaths
     assert set(s3_storage.delete_tree('subdir')) == expected_relpaths
     assert list(s3_storage.delete_tree('subdir')) == []
+
+
+@mock_s3
+@requires_boto3
+def test_s3_storage_streaming():
+    if os.environ.get('RESIZE_S3_BUCKET'):
+        pytest.skip('Only run against a mocked bucket')
+
+    conn = boto3.resource('s3', region_name='eu-central-1')
+    conn.create_bucket(
+        Bucket='test-bucket',
+        CreateBucketConfiguration={'LocationConstraint': 'eu-central-1'},
+    )
+    s3_storage = flask_resize.storage.S3Storage(
+        'test-bucket',
+        region_name='eu-central-1',
+        multipart_threshold=5 * 1024 * 1024,
+        multipart_chunksize=5 * 1024 * 1024,
+        spool_size=1024,
+    )
+
+    data = os.urandom(6 * 1024 * 1024)
+    s3_storage.save('subdir/large.bin', io.BytesIO(data))
+    s3_storage.save('subdir/small.bin', b'content')
+
+    fp = s3_storage.open('subdir/large.bin')
+    try:
+        assert fp.read() == data
+    finally:
+        fp.close()
+
+    assert s3_storage.open('subdir/small.bin').read() == b'content'
+
+    with pytest.raises(flask_resize.exc.ImageNotFoundError):
+        s3_storage.open('subdir/missing.bin')
+
+
+@mock_s3
+@requires_boto3
+def test_s3_storage_exists_many():
+    if os.environ.get('RESIZE_S3_BUCKET'):
+        pytest.skip('Only run against a mocked bucket')
+
+    conn = boto3.resource('s3', region_name='eu-central-1')
+    conn.create_bucket(
+        Bucket='test-bucket',
+        CreateBucketConfiguration={'LocationConstraint': 'eu-central-1'},
+    )
+    s3_storage = flask_resize.storage.S3Storage(
+        'test-bucket',
+        region_name='eu-central-1',
+    )
+    for key in ['subdir/a.txt', 'subdir/c.txt', 'subdir/e.txt', 'f.txt']:
+        s3_storage.save(key, b'content')
+
+    keys = ['subdir/b.txt', 'subdir/c.txt', 'subdir/e.txt', 'f.txt', 'g.txt']
+    expected = set(['subdir/c.txt', 'subdir/e.txt', 'f.txt'])
+
+    assert s3_storage.exists_many(keys) == expected
+
+    s3_storage.list_threshold = 2
+    assert s3_storage.exists_many(keys) == expected
+
+    s3_storage.move('f.txt', 'subdir/f.txt')
+    assert s3_storage.exists('f.txt') is False
+    assert s3_storage.get('subdir/f.txt') == b'content'
+
+
+@mock_s3
+@requires_boto3
+def test_s3_storage_tree():
+    if os.environ.get('RESIZE_S3_BUCKET'):
+        pytest.skip('Only run against a mocked bucket')
+
+    conn = boto3.resource('s3', region_name='eu-central-1')
+    conn.create_bucket(
+        Bucket='test-bucket',
+        CreateBucketConfiguration={'LocationConstraint': 'eu-central-1'},
+    )
+    s3_storage = flask_resize.storage.S3Storage(
+        'test-bucket',
+        region_name='eu-central-1',
+        max_concurrency=2,
+    )
+    expected_keys = set(
+        ['subdir/file.txt'] +
+        ['subdir/{0}/{0}{1}/file.txt'.format(a, b)
+         for a in 'abc' for b in 'xyz']
+    )
+    for key in expected_keys | set(['other/file.txt']):
+        s3_storage.save(key, b'content')
+
+    assert set(s3_storage.list_tree('subdir')) == expected_keys
+    assert set(s3_storage.delete_tree('subdir')) == expected_keys
+    assert list(s3_storage.list_tree('subdir')) == []
+    assert s3_storage.exists('other/file.txt') is True
+
+
+@requires_boto3
+def test_s3_storage_client():
+    s3_storage = flask_resize.storage.S3Storage(
+        'test-bucket',
+        access_key='access-key',
+        secret_key='secret-key',
+        region_name='eu-central-1',
+        timeout=5,
+        max_pool_connections=20,
+        max_retries=2,
+    )
+    assert s3_storage.client_config.max_pool_connections == 20
+    assert s3_storage.client_config.connect_timeout == 5
+    assert s3_storage.client_config.retries == dict(
+        max_attempts=2,
+        mode='standard',
+    )
+
+    client = s3_storage.client
+    assert client.meta.config.max_pool_connections == 20
+    results = list(s3_storage.executor.map(lambda _: s3_storage.client, [1]))
+    assert results == [client]
+
+    # Re-created in a forked process
+    s3_storage._client_pid = -1
+    assert s3_storage.client is not client
+
+
+def test_source_cache_storage(tmpdir):
+    opened = []
+
+    class CountingFileStorage(flask_resize.storage.FileStorage):
+        def open(self, key):
+            opened.append(key)
+            return super(CountingFileStorage, self).open(key)
+
+    backend = CountingFileStorage(base_path=str(tmpdir.mkdir('backend')))
+    source_cache = flask_resize.storage.SourceCacheStorage(
+        backend, str(tmpdir.mkdir('cache')), max_bytes=20,
+    )
+    backend.save('file1.txt', b'content1')
+    backend.save('file2.txt', b'content2')
+
+    assert source_cache.get('file1.txt') == b'content1'
+    assert source_cache.get('file1.txt') == b'content1'
+    assert opened == ['file1.txt']
+
+    # Replaced in the backend
+    for path in tmpdir.join('cache').visit(lambda p: p.isfile()):
+        path.setmtime(path.mtime() - 3600)
+    backend.delete('file1.txt')
+    backend.save('file1.txt', b'replaced1')
+    assert source_cache.get('file1.txt') == b'replaced1'
+    assert opened == ['file1.txt', 'file1.txt']
+
+    # The outdated copy, then the least recently used one, are evicted
+    assert source_cache.get('file2.txt') == b'content2'
+    assert source_cache.get('file1.txt') == b'replaced1'
+    assert opened == ['file1.txt', 'file1.txt', 'file2.txt']
+    assert source_cache.evict() == 0
+
+    with pytest.raises(flask_resize.exc.ImageNotFoundError):
+        source_cache.get('file3.txt')
+
+    assert source_cache.exists('file2.txt') is True
+    assert source_cache.base_path == backend.base_path
+
+
+def test_source_cache_storage_low_water(tmpdir):
+    evictions = []
+
+    class CountingSourceCacheStorage(flask_resize.storage.SourceCacheStorage):
+        def evict(self):
+            removed = super(CountingSourceCacheStorage, self).evict()
+            evictions.append(removed)
+            return removed
+
+    backend = flask_resize.storage.FileStorage(
+        base_path=str(tmpdir.mkdir('backend'))
+    )
+    source_cache = CountingSourceCacheStorage(
+        backend, str(tmpdir.mkdir('cache')), max_bytes=100, low_water=0.5,
+    )
+    for i in range(16):
+        backend.save('file{:02}.txt'.format(i), b'0123456789')
+        source_cache.get('file{:02}.txt'.format(i))
+
+    # Walked once to learn the size, then once when exceeding `max_bytes`,
+    # with enough room left for the rest
+    assert evictions == [0, 6]
+    assert len(list(
+        tmpdir.join('cache').visit(lambda p: p.isfile())
+    )) == 10
+
+
+def test_tiered_storage(tmpdir, image1_data):
+    failures = []
+
+    class FlakyFileStorage(flask_resize.storage.FileStorage):
+        def save(self, key, bdata):
+            if len(failures) < 2:
+                failures.append(key)
+                raise IOError('Unavailable')
+            return super(FlakyFileStorage, self).save(key, bdata)
+
+    local = flask_resize.storage.FileStorage(
+        base_path=str(tmpdir.mkdir('local'))
+    )
+    remote = FlakyFileStorage(base_path=str(tmpdir.mkdir('remote')))
+    tiered = flask_resize.storage.TieredStorage(
+        local, remote, '/local', retry_delay=0.01, local_ttl=0.5,
+    )
+
+    resizer = flask_resize.resizing.Resizer(
+        storage_backend=tiered,
+        cache_store=flask_resize.cache.NoopCache(),
+        base_url='/remote/',
+    )
+    tiered.save('file1.png', image1_data)
+    assert tiered.get_base_url('file1.png') == '/local/'
+    assert tiered.get('file1.png') == image1_data
+
+    url = resizer('file1.png', '100x100')
+    assert url.startswith('/local/')
+    key = url[len('/local/'):]
+    assert tiered.exists(key) is True
+
+    tiered.flush()
+    assert failures
+    assert remote.exists(key) is True
+    assert remote.get('file1.png') == image1_data
+    assert tiered.get_base_url(key) is None
+    assert resizer('file1.png', '100x100') == '/remote/' + key
+    assert tiered.exists_many([key, 'file2.png']) == set([key])
+
+    # Kept on the local disk for a while, for URLs already handed out
+    assert local.exists(key) is True
+    deadline = time.time() + 10
+    while local.exists(key) and time.time() < deadline:
+        time.sleep(0.05)
+    assert local.exists(key) is False
+    assert tiered.get_base_url(key) is None
+
+    tiered.delete(key)
+    assert tiered.exists(key) is False
+
+
+def test_tiered_storage_left_behind(tmpdir):
+    copied = []
+
+    class CountingFileStorage(flask_resize.storage.FileStorage):
+        def save(self, key, bdata):
+            copied.append(key)
+            return super(CountingFileStorage, self).save(key, bdata)
+
+    local = flask_resize.storage.FileStorage(
+        base_path=str(tmpdir.mkdir('local'))
+    )
+    remote = CountingFileStorage(base_path=str(tmpdir.mkdir('remote')))
+
+    def make_tiered():
+        return flask_resize.storage.TieredStorage(
+            local, remote, '/local', local_ttl=0.5,
+        )
+
+    # Left behind by a previous process: one not copied yet, and one that
+    # was copied long enough ago
+    local.save('new.png', b'new')
+    local.save('copied.png', b'copied')
+    marker = tmpdir.join('local', local.temp_file_prefix + 'copied-copied.png')
+    marker.write('')
+    marker.setmtime(time.time() - 3600)
+    tiered = make_tiered()
+
+    tiered.save('file1.png', b'file1')
+    tiered.flush()
+    assert sorted(copied) == ['file1.png', 'new.png']
+    deadline = time.time() + 10
+    while local.exists('copied.png') and time.time() < deadline:
+        time.sleep(0.05)
+    assert local.exists('copied.png') is False
+    assert marker.check() is False
+
+    # Only picked up by one process per host
+    local.save('later.png', b'later')
+    other = make_tiered()
+    other.save('file2.png', b'file2')
+    other.flush()
+    assert sorted(copied) == ['file1.png', 'file2.png', 'new.png']
+
+
+@requires_boto3
+def test_s3_storage_exists_many_sparse_listing():
+    s3_storage = flask_resize.storage.S3Storage(
+        'test-bucket',
+        access_key='access-key',
+        secret_key='secret-key',
+        region_name='eu-central-1',
+        list_threshold=3,
+    )
+    objects = ['dir/{:04d}'.format(i) for i in range(0, 10000, 2)]
+    requests = []
+
+    class FakeClient:
+        def list_objects_v2(self, **kw):
+            requests.append('list')
+            start = int(kw.get('ContinuationToken', 0))
+            page = objects[start:start + 1000]
+            resp = dict(Contents=[dict(Key=key) for key in page])
+            if start + 1000 < len(objects):
+                resp['NextContinuationToken'] = str(start + 1000)
+            return resp
+
+        def head_object(self, Bucket, Key):
+            requests.append('head')
+            if Key not in objects:
+                raise botocore.exceptions.ClientError(
+                    {'Error': {'Code': '404'}}, 'HeadObject'
+                )
+
+    s3_storage._client = FakeClient()
+    s3_storage._client_pid = os.getpid()
+
+    # Dense keys are found by listing
+    dense = ['dir/{:04d}'.format(i) for i in range(0, 3000)]
+    assert s3_storage.exists_many(dense) == set(dense) & set(objects)
+    assert set(requests) == set(['list'])
+
+    # Sparse keys fall back to HEAD requests once listing stops paying off
+    del requests[:]
+    sparse = ['dir/0000', 'dir/5001', 'dir/9998']
+    assert s3_storage.exists_many(sparse) == set(['dir/0000', 'dir/9998'])
+    assert requests.count('list') == 2
+    assert requests.count('head') == 2
+
+
+def test_storage_executor_per_instance(tmpdir):
+    first = flask_resize.storage.FileStorage(base_path=str(tmpdir))
+    second = flask_resize.storage.FileStorage(base_path=str(tmpdir))
+    assert first._executor_lock is not second._executor_lock
+    assert first.executor is first.executor
+    assert first.executor is not second.executor
+
+
+@requires_boto3
+def test_s3_storage_list_tree_flat_pages():
+    s3_storage = flask_resize.storage.S3Storage(
+        'test-bucket',
+        access_key='access-key',
+        secret_key='secret-key',
+        region_name='eu-central-1',
+        max_concurrency=4,
+    )
+    expected_keys = set(
+        'resized-images/{}.png'.format(
+            hashlib.sha1(str(i).encode()).hexdigest()
+        )
+        for i in range(20000)
+    ) | set(['resized-images/README', 'resized-images/-.png'])
+    objects = sorted(expected_keys | set(['other/file.png']))
+    requests = []
+
+    class FakeClient:
+        def list_objects_v2(self, Bucket, Prefix, StartAfter='',
+                            ContinuationToken=None):
+            requests.append(StartAfter)
+            start = int(ContinuationToken or 0)
+            if not start:
+                while start < len(objects) and (
+                    objects[start] <= StartAfter or
+                    objects[start] < Prefix
+                ):
+                    start += 1
+            page = [
+                key for key in objects[start:start + 1000]
+                if key.startswith(Prefix)
+            ]
+            resp = dict(Contents=[dict(Key=key) for key in page])
+            if start + 1000 < len(objects) and \
+                    objects[start + 1000].startswith(Prefix):
+                resp['NextContinuationToken'] = str(start + 1000)
+            return resp
+
+    s3_storage._client = FakeClient()
+    s3_storage._client_pid = os.getpid()
+
+    # Yields the first page before the rest are listed
+    keys = s3_storage.list_tree('resized-images')
+    first = next(keys)
+    assert len(requests) <= s3_storage.max_concurrency
+
+    listed = [first] + list(keys)
+    assert len(listed) == len(expected_keys)
+    assert set(listed) == expected_keys
+    # Split into ranges that are listed concurrently, over several pages
+    assert len(set(requests)) == 16
+    assert len(requests) > 16
@@ -1,7 +1,18 @@
+import threading
+import time
+from multiprocessing.dummy import Pool
+
 import pytest
 
 from flask_resize import exc
-from flask_resize.utils import parse_dimensions, parse_rgb
+from flask_resize.utils import (
+    CircuitBreaker,
+    SingleFlight,
+    new_hash,
+    parse_dimensions,
+    parse_rgb,
+    shard_path
+)
 
 
 def test_parse_dimensions():
@@ -42,3 +53,88 @@ def test_parse_rgb():
     assert parse_rgb('#1432c8', include_number_sign=False) == '1432c8'
     assert parse_rgb('feccde', include_number_sign=False) == 'feccde'
     assert parse_rgb('fcd', include_number_sign=False) == 'ffccdd'
+
+
+def test_shard_path():
+    assert shard_path('abcdef.jpg', 0) == 'abcdef.jpg'
+    assert shard_path('abcdef.jpg', 1) == 'ab/abcdef.jpg'
+    assert shard_path('abcdef.jpg', 2) == 'ab/cd/abcdef.jpg'
+    assert shard_path('abcdef.jpg', 2, 3) == 'abc/def/abcdef.jpg'
+
+
+def test_new_hash():
+    assert new_hash('sha1').hexdigest() == \
+        'da39a3ee5e6b4b0d3255bfef95601890afd80709'
+    assert len(new_hash('blake2b:8').hexdigest()) == 16
+
+
+def test_single_flight():
+    single_flight = SingleFlight()
+    calls = []
+    started = threading.Event()
+    finish = threading.Event()
+
+    def fn(value):
+        calls.append(value)
+        started.set()
+        finish.wait(10)
+        return value
+
+    pool = Pool(4)
+    leader = pool.apply_async(single_flight.do, ('a', fn, 1))
+    started.wait(10)
+    followers = [
+        pool.apply_async(single_flight.do, ('a', fn, 2)) for i in range(3)
+    ]
+    assert single_flight.do('b', lambda: 3) == 3
+    # Give the followers time to join the call in flight
+    time.sleep(0.2)
+    finish.set()
+
+    assert leader.get(10) == 1
+    assert [f.get(10) for f in followers] == [1, 1, 1]
+    assert calls == [1]
+    assert single_flight.do('a', lambda: 4) == 4
+
+
+def test_single_flight_exception():
+    single_flight = SingleFlight()
+
+    def fn():
+        raise ValueError
+
+    with pytest.raises(ValueError):
+        single_flight.do('a', fn)
+    assert single_flight.do('a', lambda: 1) == 1
+
+
+def test_circuit_breaker():
+    breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=0.2)
+
+    def fail():
+        raise IOError
+
+    def missing():
+        raise exc.ImageNotFoundError
+
+    for fn in (fail, missing, fail):
+        with pytest.raises(IOError):
+            breaker.call(fn)
+    # Expected errors aren't failures, and reset the count
+    assert breaker.state == 'closed'
+
+    with pytest.raises(IOError):
+        breaker.call(fail)
+    assert breaker.state == 'open'
+    with pytest.raises(exc.CircuitOpenError):
+        breaker.call(lambda: 1)
+
+    time.sleep(0.2)
+    assert breaker.state == 'half-open'
+    with pytest.raises(IOError):
+        breaker.call(fail)
+    assert breaker.state == 'open'
+
+    time.sleep(0.2)
+    assert breaker.call(lambda: 1) == 1
+    assert breaker.state == 'closed'